@@ -1,166 +1,1944 @@
 import telebot
 from telebot import types
-from datetime import datetime
+from telebot.apihelper import ApiTelegramException
+from telebot.handler_backends import HandlerBackend
+from telebot import apihelper
+from datetime import date, datetime, timedelta
 import os
+import sys
 from openpyxl import Workbook
 from dotenv import load_dotenv
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, request, jsonify, Response, abort, g
+from werkzeug.http import http_date, parse_date
+from werkzeug.middleware.proxy_fix import ProxyFix
 import threading
+import bisect
+import functools
+import json
+import logging
+from contextlib import ContextDecorator
+import re
+import mimetypes
+import sqlite3
+import pickle
+import csv
+import gzip
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future, InvalidStateError
+import hashlib
+from collections import OrderedDict
+import time
+import queue
+import requests as http_requests
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor  # нужно для работы с PostgreSQL
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor, execute_values  # нужно для работы с PostgreSQL
+
+try:
+    import brotli  # необязательно: без него отдаём только gzip
+except ImportError:
+    brotli = None
 
 # === Загрузка переменных из .env ===
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 PORT = int(os.getenv("PORT", 8080))
+SERVER = os.getenv("SERVER", "dev")  # dev — встроенный сервер Flask, gunicorn — продакшн
+RUNTIME = os.getenv("RUNTIME", "sync")  # sync — Flask и TeleBot в потоках, async — okservice_async.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # другой адрес Bot API, например фейковый сервер из bench/
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))  # процессов gunicorn
+# Где хранить шаги формы заявки: memory — в процессе, postgres / sqlite — общая таблица для всех воркеров
+NEXT_STEP_BACKEND = os.getenv("NEXT_STEP_BACKEND") or ("postgres" if WEB_CONCURRENCY > 1 else "memory")
+NEXT_STEP_TTL = int(os.getenv("NEXT_STEP_TTL", 3600))  # сек., после которых недозаполненная форма забывается
+NEXT_STEP_CLEANUP_INTERVAL = float(os.getenv("NEXT_STEP_CLEANUP_INTERVAL", 300))
+PAGE_QUERY_TTL = int(os.getenv("PAGE_QUERY_TTL", 86400))  # сек., сколько работают кнопки «далее/назад» под результатами поиска
+NEXT_STEP_SQLITE_PATH = os.getenv("NEXT_STEP_SQLITE_PATH", "bot_state.sqlite3")
 DATABASE_URL = os.getenv("DATABASE_URL")  # PostgreSQL URL из Render
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))  # соединений открывается сразу; вернувшиеся держатся открытыми до DB_POOL_MAX
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# RUNTIME=async: DB_POOL_MAX — общий предел соединений процесса; ASYNC_DB_POOL_SIZE из них получает пул psycopg 3
+# для чтений в цикле событий, остаток — DbPool для ingestor, outbox, выгрузок и шагов формы (каждому не меньше 1)
+ASYNC_DB_POOL_SIZE = max(int(os.getenv("ASYNC_DB_POOL_SIZE", DB_POOL_MAX // 2)), 1)
+THREAD_DB_POOL_MAX = max(DB_POOL_MAX - ASYNC_DB_POOL_SIZE, 1) if RUNTIME == "async" else DB_POOL_MAX
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # сек. ожидания свободного соединения
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", 30))  # сек. простоя, после которых соединение проверяется
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", 2))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", 1000))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 8))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", 2))  # сек., удваивается с каждой попыткой
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", 300))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", 5))  # как часто перечитывать outbox
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", 1))  # Telegram: ~1 сообщение/сек в один чат
+NOTIFY_GLOBAL_INTERVAL = float(os.getenv("NOTIFY_GLOBAL_INTERVAL", 1 / 30))  # Telegram: ~30 сообщений/сек всего
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 10))  # заявок на одной странице в админке
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", 60))  # сек., сколько процесс помнит сводку для «📊 Статистика»
+STATS_TOP_KEYWORDS = int(os.getenv("STATS_TOP_KEYWORDS", 10))  # сколько частых слов из описаний показывать
+REQUESTS_PARTITIONS_AHEAD = int(os.getenv("REQUESTS_PARTITIONS_AHEAD", 3))  # месяцев, на которые секции создаются заранее
+REQUESTS_ARCHIVE_AFTER_DAYS = int(os.getenv("REQUESTS_ARCHIVE_AFTER_DAYS", 0))  # 0 — не архивировать автоматически
+REQUESTS_ARCHIVE_DIR = os.getenv("REQUESTS_ARCHIVE_DIR", "archive")  # лучше постоянный диск: файлы — единственная копия
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 6 * 3600))
+CLEAR_BATCH_SIZE = int(os.getenv("CLEAR_BATCH_SIZE", 5000))  # строк за одну транзакцию при «очистить старше N дней»
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 1))  # сколько выгрузок может идти одновременно
+EXPORT_ITERSIZE = int(os.getenv("EXPORT_ITERSIZE", 2000))  # строк за один FETCH серверного курсора
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", 5))  # сек. между сообщениями о прогрессе
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 4))  # потоков обработки апдейтов Telegram
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 100))  # очередь на каждый поток
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", 2))  # сек. ожидания места в очереди
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")  # отдаём наружу только файлы из этой папки
+STATIC_CHECK_INTERVAL = float(os.getenv("STATIC_CHECK_INTERVAL", 2))  # сек. между проверками mtime
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))  # кэш для адресов без хэша, например /logo.png
+PHOTOS_DIR = os.path.join(BASE_DIR, "photos")  # все фото отсюда уходят альбомом по кнопке «Фото сервиса»
+STARTUP_RETRY_BASE = float(os.getenv("STARTUP_RETRY_BASE", 2))  # сек. до повтора подготовки БД/webhook, удваивается
+STARTUP_RETRY_MAX = float(os.getenv("STARTUP_RETRY_MAX", 60))
+READINESS_CACHE_TTL = float(os.getenv("READINESS_CACHE_TTL", 5))  # сек. кэширования проверки готовности
+TRGM_RECHECK_INTERVAL = float(os.getenv("TRGM_RECHECK_INTERVAL", 60))  # сек., через сколько снова искать pg_trgm, если его не было
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 50))  # заявок в одной транзакции
+INGEST_MAX_DELAY_MS = float(os.getenv("INGEST_MAX_DELAY_MS", 20))  # сколько первая заявка ждёт попутчиков
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", 15))  # сек. ожидания записи вызывающим
+INGEST_DEDUP_WINDOW = int(os.getenv("INGEST_DEDUP_WINDOW", 600))  # сек.: повтор с того же телефона — дубль
+PROXY_COUNT = int(os.getenv("PROXY_COUNT", 1))  # сколько прокси (балансировщик Render) стоит перед приложением
+FORM_MAX_BYTES = int(os.getenv("FORM_MAX_BYTES", 8192))  # максимальный размер тела /send_request
+FORM_IP_RATE_PER_MIN = float(os.getenv("FORM_IP_RATE_PER_MIN", 5))  # заявок в минуту с одного IP
+FORM_IP_BURST = int(os.getenv("FORM_IP_BURST", 5))
+FORM_PHONE_RATE_PER_MIN = float(os.getenv("FORM_PHONE_RATE_PER_MIN", 0.2))  # заявок в минуту на один телефон
+FORM_PHONE_BURST = int(os.getenv("FORM_PHONE_BURST", 2))
+FORM_LIMITER_KEYS = int(os.getenv("FORM_LIMITER_KEYS", 10000))  # сколько IP/телефонов помнит лимитер
+FORM_DUPLICATE_WINDOW = int(os.getenv("FORM_DUPLICATE_WINDOW", 600))  # сек.: та же заявка повторно — не пишем
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # если задан — нужен для доступа к /internal/stats и /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # 0 — замеры времени не выполняются вовсе
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json — структурированные логи, text — как раньше, строками
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+
+# === Логи: JSON-строки вместо print ===
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+log = logging.getLogger("okservice")
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(asctime)s %(message)s"))
+log.addHandler(log_handler)
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+
+
+def log_event(event, message, level=logging.INFO, **fields):
+    log.log(level, message, extra={"event": event, "fields": fields})
+
+
+# === Метрики: счётчики и гистограммы в формате Prometheus ===
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_PREFIX = "okservice_"
+
+
+def prometheus_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{prometheus_escape(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Счётчики, гистограммы задержек и «снимки» статистики компонентов (пул, очереди) для /metrics."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauge_sources = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def register_gauges(self, prefix, source):
+        """source() возвращает dict: числа становятся gauge, вложенные dict — gauge с меткой key.
+
+        Повторная регистрация prefix заменяет источник (асинхронный режим подменяет «updates» своим).
+        """
+        self.gauge_sources[prefix] = source
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: ([*value[0]], value[1], value[2]) for key, value in self.histograms.items()}
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{METRICS_PREFIX}{name}{prometheus_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    bucket_labels = prometheus_labels(labels + (("le", bound),))
+                    lines.append(f"{METRICS_PREFIX}{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{METRICS_PREFIX}{name}_sum{prometheus_labels(labels)} {total}")
+                lines.append(f"{METRICS_PREFIX}{name}_count{prometheus_labels(labels)} {count}")
+
+        for prefix, source in list(self.gauge_sources.items()):
+            try:
+                stats = source()
+            except Exception as e:
+                log_event("metrics_source_failed", "Не удалось собрать метрики", logging.WARNING, source=prefix, error=str(e))
+                continue
+            for key, value in stats.items():
+                name = f"{METRICS_PREFIX}{prefix}_{key}"
+                if isinstance(value, dict):
+                    lines.append(f"# TYPE {name} gauge")
+                    for sub_key, sub_value in sorted(value.items()):
+                        lines.append(f"{name}{prometheus_labels((('key', sub_key),))} {float(sub_value)}")
+                elif isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(METRICS_BUCKETS)
+
+
+class timed(ContextDecorator):
+    """Замер времени блока или функции в гистограмму name (секунды) с меткой status=ok/error."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def _recreate_cm(self):
+        # Как декоратор — новый экземпляр на каждый вызов, иначе потоки перепишут друг другу started
+        return timed(self.name, **self.labels)
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if METRICS_ENABLED and self.started is not None:
+            metrics.observe(
+                self.name,
+                time.perf_counter() - self.started,
+                status="error" if exc_type else "ok",
+                **self.labels,
+            )
+        return False
+
+
+def instrumented(func):
+    """Обёртка для обработчиков бота (корутин): время выполнения в bot_handler_seconds{handler=...}."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timed("bot_handler_seconds", handler=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "CREATE", "ALTER", "WITH", "COPY"}
+
+
+def sql_operation(query):
+    if isinstance(query, bytes):
+        query = query[:32].decode("utf-8", "ignore")
+    elif not isinstance(query, str):
+        return "OTHER"
+    words = query.split(None, 1)
+    operation = words[0].upper() if words else ""
+    return operation if operation in SQL_OPERATIONS else "OTHER"
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor, который замеряет каждый execute в db_query_seconds{op=SELECT/INSERT/...}."""
+
+    def execute(self, query, vars=None):
+        if not METRICS_ENABLED:
+            return super().execute(query, vars)
+        with timed("db_query_seconds", op=sql_operation(query)):
+            return super().execute(query, vars)
+
+
+def timed_telegram_request(method, url, **kwargs):
+    """Отправитель запросов к Bot API для pyTelegramBotAPI с замером времени по методу API."""
+    api_method = url.rsplit("/", 1)[-1]
+    with timed("telegram_api_seconds", method=api_method):
+        response = apihelper._get_req_session().request(method, url, **kwargs)
+    metrics.inc("telegram_api_responses_total", method=api_method, code=response.status_code)
+    return response
+
+
+if METRICS_ENABLED:
+    apihelper.CUSTOM_REQUEST_SENDER = timed_telegram_request
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+
+# === Пул соединений с PostgreSQL ===
+class DbPool:
+    """Общий пул соединений: ограниченный размер, проверка при выдаче, переподключение и метрики.
+
+    Вернувшееся соединение остаётся открытым (до maxconn штук), а не закрывается сверх minconn,
+    как в ThreadedConnectionPool: под нагрузкой каждое новое соединение — это TCP + TLS + авторизация.
+    """
+
+    def __init__(self, dsn, minconn, maxconn, timeout, check_after, **connect_kwargs):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.connect_kwargs = connect_kwargs
+        self._idle = []  # [(соединение, когда вернули)], последнее вернувшееся выдаётся первым
+        self._idle_lock = threading.Lock()
+        self._opened = False
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _connect(self):
+        # Новое соединение — TCP + TLS + авторизация: именно это время и экономит пул
+        with timed("db_connect_seconds"):
+            conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._stats_lock:
+            self.connects += 1
+        return conn
+
+    def _open(self):
+        # minconn соединений открываются при первом обращении, а не при импорте
+        with self._idle_lock:
+            if self._opened:
+                return
+            self._opened = True
+        for _ in range(self.minconn):
+            conn = self._connect()
+            with self._idle_lock:
+                self._idle.append((conn, time.monotonic()))
+
+    def _take_idle(self):
+        with self._idle_lock:
+            return self._idle.pop() if self._idle else (None, None)
+
+    def _is_alive(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _healthy_conn(self):
+        self._open()
+        # После рестарта сервера БД все простаивающие соединения битые — отбрасываем их по одному
+        while True:
+            conn, last_used = self._take_idle()
+            if conn is None:
+                return self._connect()
+            if self._is_alive(conn, last_used):
+                return conn
+            self._discard(conn)
+            with self._stats_lock:
+                self.reconnects += 1
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout(self):
+        started = time.monotonic()
+        with self._stats_lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self.waiting -= 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if not acquired:
+                self.timeouts += 1
+        if METRICS_ENABLED:
+            metrics.observe("db_checkout_wait_seconds", waited, status="ok" if acquired else "timeout")
+        if not acquired:
+            raise pg_pool.PoolError(f"Нет свободных соединений с БД за {self.timeout} с")
+
+        try:
+            conn = self._healthy_conn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def _release(self, conn):
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        try:
+            if broken:
+                self._discard(conn)
+            else:
+                # Слоты ограничивают выданные соединения, поэтому простаивающих не больше maxconn
+                with self._idle_lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._stats_lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение из пула; commit при успехе, rollback при ошибке (как `with conn`)."""
+        conn = self._checkout()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self._release(conn)
+
+    def close(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+            self._opened = False
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._idle_lock:
+            idle = len(self._idle)
+        with self._stats_lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "idle": idle,
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "reconnects": self.reconnects,
+                "checkout_wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+db_pool = DbPool(
+    DATABASE_URL,
+    min(DB_POOL_MIN, THREAD_DB_POOL_MAX),
+    THREAD_DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_CHECK_AFTER,
+    sslmode=DB_SSLMODE,
+    cursor_factory=TimedCursor,
+)
+
 
 # === Подключение к PostgreSQL ===
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL, sslmode="require", cursor_factory=RealDictCursor)
+    return db_pool.connection()
+
+# threaded=False: обработчики выполняются в потоках UpdateDispatcher, где сохраняется порядок по чату
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+
+
+# === Статические файлы и главная страница из памяти ===
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+HASHED_NAME_RE = re.compile(r"^(?P<stem>[^/]+)\.(?P<digest>[0-9a-f]{10})(?P<ext>\.[A-Za-z0-9]+)$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+class CachedFile:
+    """Файл в памяти вместе со сжатыми версиями, ETag и Last-Modified; перечитывается при смене mtime."""
+
+    def __init__(self, path, render=None, depends_on=None):
+        self.path = path
+        self.render = render
+        self.depends_on = depends_on  # для страниц: перерисовать, если сменились хэши статики
+        self.version = None
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/"):
+            self.content_type += "; charset=utf-8"
+        self.mtime = None
+        self.checked_at = 0.0
+        self.variants = {}
+        self.digest = None
+        self.etag = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if self.mtime is not None and now - self.checked_at < STATIC_CHECK_INTERVAL:
+            return self
+        with self._lock:
+            self.checked_at = now
+            mtime = os.stat(self.path).st_mtime
+            version = (mtime, self.depends_on() if self.depends_on else None)
+            if version != self.version:
+                self._load(mtime)
+                self.version = version
+        return self
+
+    def _load(self, mtime):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if self.render:
+            data = self.render(data)
+        variants = {"identity": data}
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            variants["gzip"] = gzip.compress(data, compresslevel=9)
+            if brotli is not None:
+                variants["br"] = brotli.compress(data)
+        self.variants = variants
+        self.digest = hashlib.sha256(data).hexdigest()[:10]
+        self.etag = f'W/"{self.digest}"'
+        self.mtime = mtime
+
+    def respond(self, cache_control, if_none_match, if_modified_since, accepts_encoding):
+        """Статус, тело и заголовки ответа; accepts_encoding(name) — принимает ли клиент это сжатие."""
+        # Условный запрос: браузер уже имеет эту версию
+        not_modified = (
+            if_none_match is not None and self.etag in [tag.strip() for tag in if_none_match.split(",")]
+        ) or (
+            if_none_match is None and if_modified_since is not None
+            and int(self.mtime) <= if_modified_since.timestamp()
+        )
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": http_date(self.mtime),
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if not_modified:
+            return 304, b"", headers
+
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in self.variants and accepts_encoding(candidate):
+                encoding = candidate
+                break
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, self.variants[encoding], headers
+
+    def response(self, cache_control):
+        status, body, headers = self.respond(
+            cache_control,
+            request.headers.get("If-None-Match"),
+            parse_date(request.headers.get("If-Modified-Since")),
+            lambda encoding: request.accept_encodings[encoding],
+        )
+        if status == 304:
+            return Response(status=304, headers=headers)
+        return Response(body, content_type=self.content_type, headers=headers)
+
+
+class StaticAssets:
+    """Белый список файлов из STATIC_DIR и адреса с хэшем содержимого для долгого кэширования."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        if "/" in name or "\\" in name or name.startswith("."):
+            return None
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            cached = self.files.get(name)
+            if cached is None:
+                cached = self.files[name] = CachedFile(path)
+        return cached.current()
+
+    def url_for(self, name):
+        asset = self.get(name)
+        if asset is None:
+            return name
+        stem, ext = os.path.splitext(name)
+        return f"/static/{stem}.{asset.digest}{ext}"
+
+    def get_hashed(self, hashed_name):
+        match = HASHED_NAME_RE.match(hashed_name)
+        if not match:
+            return None
+        asset = self.get(match["stem"] + match["ext"])
+        # Старый хэш после замены файла — отдаём 404, чтобы не закэшировать чужое содержимое навсегда
+        if asset is None or asset.digest != match["digest"]:
+            return None
+        return asset
+
+
+static_assets = StaticAssets(STATIC_DIR)
+ASSET_REF_RE = re.compile(rb'(src|href)="([^"/:?#]+)"')
+
+
+def render_index(data):
+    # logo.png → /static/logo.<хэш>.png: браузер кэширует надолго и сразу видит новую версию
+    return ASSET_REF_RE.sub(
+        lambda m: b'%s="%s"' % (m.group(1), static_assets.url_for(m.group(2).decode()).encode()),
+        data,
+    )
 
-bot = telebot.TeleBot(BOT_TOKEN)
 
+def static_digests():
+    assets = (static_assets.get(name) for name in sorted(os.listdir(STATIC_DIR)))
+    return tuple(asset.digest for asset in assets if asset is not None)
 
-# === Flask-сервер для Render ===
-app = Flask(__name__)
 
-# ✅ Разрешаем Flask отдавать статические файлы (например logo.png)
+index_page = CachedFile(os.path.join(BASE_DIR, "index.html"), render=render_index, depends_on=static_digests)
+
+
+# === Flask-сервер для Render ===
+app = Flask(__name__, static_folder=None)
+if PROXY_COUNT:
+    # Реальный IP клиента берём из X-Forwarded-For, выставленного нашим прокси, а не присланного клиентом
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT, x_proto=PROXY_COUNT)
+
+# ✅ Статика с хэшем в имени кэшируется браузером на год
+@app.route("/static/<filename>")
+def serve_hashed_static(filename):
+    asset = static_assets.get_hashed(filename)
+    if asset is None:
+        abort(404)
+    return asset.response(IMMUTABLE_CACHE)
+
+# ✅ Разрешаем Flask отдавать статические файлы (например logo.png) — только из папки static
 @app.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('.', filename)
+    asset = static_assets.get(filename)
+    if asset is None:
+        abort(404)
+    return asset.response(f"public, max-age={STATIC_MAX_AGE}")
+
+# ✅ Служебная статистика (пул соединений и т.п.)
+COMPONENT_STATS = {
+    "db_pool": lambda: db_pool.stats(),
+    "notifications": lambda: notifier.stats(),
+    "updates": lambda: update_dispatcher.stats(),
+    "ingest": lambda: ingestor.stats(),
+    "form_guard": lambda: form_guard_stats(),
+}
+for section, source in COMPONENT_STATS.items():
+    metrics.register_gauges(section, source)
+
+
+def stats_allowed():
+    if not METRICS_TOKEN:
+        return True
+    token = request.headers.get("X-Metrics-Token") or request.args.get("token")
+    return token == METRICS_TOKEN
+
+
+@app.route("/internal/stats")
+def internal_stats():
+    if not stats_allowed():
+        return jsonify({"status": "error", "message": "forbidden"}), 403
+    return jsonify({section: source() for section, source in COMPONENT_STATS.items()}), 200
+
+
+# ✅ Метрики для Prometheus: задержки БД, Telegram API, обработчиков и HTTP
+@app.route("/metrics")
+def prometheus_metrics():
+    if not stats_allowed():
+        return Response("forbidden\n", status=403, mimetype="text/plain")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get("request_started")
+        if started is not None:
+            metrics.observe(
+                "http_request_seconds",
+                time.perf_counter() - started,
+                endpoint=request.endpoint or "not_found",
+                method=request.method,
+                code=response.status_code,
+            )
+        return response
 
-# ✅ Главная страница
+# ✅ Главная страница (/index.html — старые ссылки на неё)
 @app.route('/')
+@app.route('/index.html')
 def home():
-    with open("index.html", encoding="utf-8") as f:
-        return f.read()
+    # no-cache: браузер каждый раз сверяет ETag и получает 304, если страница не менялась
+    return index_page.current().response("no-cache")
 
 # === Создание таблицы заявок, если её нет ===
 # === Создание таблицы заявок, если её нет ===
 def init_db():
     with get_db_connection() as conn:
         with conn.cursor() as cur:
+            init_requests_table(cur)
+            init_search_indexes(cur)
+            init_stats_tables(cur)
+            # Для поиска дублей: тот же телефон за последние INGEST_DEDUP_WINDOW секунд
+            cur.execute(f"""
+                CREATE INDEX IF NOT EXISTS requests_phone_digits_created_idx
+                ON requests (({PHONE_DIGITS_SQL}), created_at)
+            """)
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS requests (
+                CREATE TABLE IF NOT EXISTS notification_outbox (
                     id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    problem TEXT,
-                    source TEXT DEFAULT 'unknown',
+                    chat_id BIGINT NOT NULL,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INT NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    claimed_at TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                );
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS bot_next_steps (
+                    id SERIAL PRIMARY KEY,
+                    chat_id BIGINT NOT NULL,
+                    handler BYTEA NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
             """)
+            cur.execute("ALTER TABLE bot_next_steps ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP")
+            cur.execute("CREATE INDEX IF NOT EXISTS bot_next_steps_chat_idx ON bot_next_steps (chat_id)")
+            cur.execute("CREATE INDEX IF NOT EXISTS bot_next_steps_expires_idx ON bot_next_steps (expires_at)")
+            # Параметры поиска под ключом из callback_data: кнопку «далее/назад» может обработать любой воркер
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS search_queries (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS search_queries_used_idx ON search_queries (used_at)")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    path TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+                ON notification_outbox (next_attempt_at) WHERE status <> 'sent' AND status <> 'failed';
+            """)
             conn.commit()
-    print("✅ Таблица requests проверена/создана")
+    log_event("db_initialized", "✅ Таблицы requests, notification_outbox и bot_next_steps проверены/созданы")
 
 
+# === Хранение шагов формы (next-step handlers) ===
+# Все хранилища забывают шаг через NEXT_STEP_TTL секунд: брошенная на середине форма
+# не перехватит следующее сообщение пользователя через сутки, а cleanup() чистит такие записи.
+class MemoryTTLHandlerBackend(HandlerBackend):
+    """Шаги в памяти процесса (как в pyTelegramBotAPI по умолчанию), но с истечением срока."""
 
-# === Маршрут для приёма данных с формы сайта ===
-@app.route("/send_request", methods=["POST"])
-def send_request():
-    try:
-        data = request.get_json(force=True)
-        name = data.get("name")
-        phone = data.get("phone")
-        problem = data.get("message")
+    def __init__(self, ttl):
+        super().__init__()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def register_handler(self, handler_group_id, handler):
+        with self._lock:
+            _, handlers = self.handlers.get(handler_group_id, (None, []))
+            self.handlers[handler_group_id] = (time.time() + self.ttl, handlers + [handler])
+
+    def clear_handlers(self, handler_group_id):
+        with self._lock:
+            self.handlers.pop(handler_group_id, None)
 
-        # Проверяем, что данные есть
-        if not name or not phone:
-            return jsonify({"status": "error", "message": "Имя и телефон обязательны"}), 400
+    def get_handlers(self, handler_group_id):
+        with self._lock:
+            entry = self.handlers.pop(handler_group_id, None)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
 
-        # Сохраняем заявку в БД
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self.handlers.items() if expires_at < now]
+            for key in expired:
+                del self.handlers[key]
+        return len(expired)
+
+
+class PostgresHandlerBackend(HandlerBackend):
+    """Next-step обработчики в PostgreSQL: следующий шаг формы может обработать любой воркер."""
+
+    def __init__(self, ttl):
+        super().__init__()
+        self.ttl = ttl
+
+    def register_handler(self, handler_group_id, handler):
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO requests (name, phone, problem, source)
-                    VALUES (%s, %s, %s, %s);
-                """, (name, phone, problem, "site"))
+                    INSERT INTO bot_next_steps (chat_id, handler, expires_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                """, (handler_group_id, psycopg2.Binary(pickle.dumps(handler)), self.ttl))
                 conn.commit()
 
-        # Отправляем уведомление админу в Telegram
-        msg = (
-            f"📬 *Новая заявка с сайта!*\n"
-            f"👤 Имя: {name}\n"
-            f"📞 Телефон: {phone}\n"
-            f"💬 Проблема: {problem}"
-        )
-        bot.send_message(ADMIN_ID, msg, parse_mode="Markdown")
+    def clear_handlers(self, handler_group_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_next_steps WHERE chat_id = %s", (handler_group_id,))
+                conn.commit()
+
+    def get_handlers(self, handler_group_id):
+        # DELETE ... RETURNING забирает шаг атомарно — два воркера не обработают его дважды
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM bot_next_steps WHERE chat_id = %s
+                    RETURNING id, handler, expires_at IS NULL OR expires_at >= CURRENT_TIMESTAMP AS alive
+                """, (handler_group_id,))
+                rows = cur.fetchall()
+                conn.commit()
+        rows = [row for row in rows if row["alive"]]
+        if not rows:
+            return None
+        return [pickle.loads(bytes(row["handler"])) for row in sorted(rows, key=lambda r: r["id"])]
+
+    def cleanup(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_next_steps WHERE expires_at < CURRENT_TIMESTAMP")
+                deleted = cur.rowcount
+                conn.commit()
+        return deleted
+
+
+class SqliteHandlerBackend(HandlerBackend):
+    """Next-step обработчики в файле SQLite — переживают рестарт и общие для воркеров на одной машине."""
+
+    def __init__(self, path, ttl):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS bot_next_steps (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    handler BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS bot_next_steps_chat_idx ON bot_next_steps (chat_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS bot_next_steps_expires_idx ON bot_next_steps (expires_at)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA busy_timeout = 10000")
+        return db
+
+    def register_handler(self, handler_group_id, handler):
+        db = self._connect()
+        try:
+            db.execute(
+                "INSERT INTO bot_next_steps (chat_id, handler, expires_at) VALUES (?, ?, ?)",
+                (handler_group_id, pickle.dumps(handler), time.time() + self.ttl),
+            )
+        finally:
+            db.close()
+
+    def clear_handlers(self, handler_group_id):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM bot_next_steps WHERE chat_id = ?", (handler_group_id,))
+        finally:
+            db.close()
+
+    def get_handlers(self, handler_group_id):
+        db = self._connect()
+        try:
+            # BEGIN IMMEDIATE: чтение и удаление шага — одна операция для всех процессов
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(
+                "SELECT handler, expires_at FROM bot_next_steps WHERE chat_id = ? ORDER BY id",
+                (handler_group_id,),
+            ).fetchall()
+            db.execute("DELETE FROM bot_next_steps WHERE chat_id = ?", (handler_group_id,))
+            db.execute("COMMIT")
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        now = time.time()
+        handlers = [pickle.loads(handler) for handler, expires_at in rows if expires_at >= now]
+        return handlers or None
+
+    def cleanup(self):
+        db = self._connect()
+        try:
+            return db.execute("DELETE FROM bot_next_steps WHERE expires_at < ?", (time.time(),)).rowcount
+        finally:
+            db.close()
+
+
+def make_next_step_backend(kind):
+    if kind == "memory":
+        return MemoryTTLHandlerBackend(NEXT_STEP_TTL)
+    if kind == "postgres":
+        return PostgresHandlerBackend(NEXT_STEP_TTL)
+    if kind == "sqlite":
+        return SqliteHandlerBackend(NEXT_STEP_SQLITE_PATH, NEXT_STEP_TTL)
+    raise ValueError(f"Неизвестный NEXT_STEP_BACKEND: {kind} (memory, postgres или sqlite)")
+
+
+def next_step_janitor():
+    while True:
+        time.sleep(NEXT_STEP_CLEANUP_INTERVAL)
+        try:
+            removed = bot.next_step_backend.cleanup()
+            if removed:
+                log_event("next_steps_cleaned", "🧹 Удалены незавершённые формы", removed=removed)
+        except Exception as e:
+            log_event("next_steps_cleanup_failed", "❌ Ошибка очистки шагов формы", logging.ERROR, error=str(e))
+        try:
+            removed = cleanup_page_queries()
+            if removed:
+                log_event("page_queries_cleaned", "🧹 Удалены устаревшие поисковые запросы", removed=removed)
+        except Exception as e:
+            log_event("page_queries_cleanup_failed", "❌ Ошибка очистки поисковых запросов", logging.ERROR,
+                      error=str(e))
+
+
+bot.next_step_backend = make_next_step_backend(NEXT_STEP_BACKEND)
+
+
+# === Фоновая отправка уведомлений в Telegram ===
+class NotificationDispatcher:
+    """Очередь уведомлений с outbox-таблицей: HTTP-запрос не ждёт Telegram, сообщения переживают рестарт."""
+
+    def __init__(self, workers, queue_size, max_attempts, backoff_base, backoff_max,
+                 poll_interval, chat_interval, global_interval):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.chat_interval = chat_interval
+        self.global_interval = global_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._started = False
+        self._chat_next_send = {}
+        self._global_next_send = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def add_many(self, cur, notifications):
+        """Кладёт уведомления (chat_id, text, parse_mode) в outbox одним INSERT в текущей транзакции.
+
+        Возвращённые id передайте в submit() после commit.
+        """
+        if not notifications:
+            return []
+        rows = execute_values(cur, """
+            INSERT INTO notification_outbox (chat_id, text, parse_mode)
+            VALUES %s
+            RETURNING id
+        """, notifications, page_size=len(notifications), fetch=True)
+        return [row["id"] for row in rows]
+
+    def submit(self, notification_id):
+        with self._lock:
+            if notification_id in self._queued:
+                return
+            try:
+                self.queue.put_nowait(notification_id)
+            except queue.Full:
+                # Уведомление уже в outbox — его подберёт периодический проход
+                return
+            self._queued.add(notification_id)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"notify-{i}", daemon=True).start()
+        threading.Thread(target=self._sweeper, name="notify-sweeper", daemon=True).start()
+        log_event("notifier_started", "✅ Отправка уведомлений запущена", workers=self.workers)
+
+    def _sweeper(self):
+        while True:
+            try:
+                free = self.queue.maxsize - self.queue.qsize()
+                if free > 0:
+                    with get_db_connection() as conn:
+                        with conn.cursor() as cur:
+                            # Возвращаем «зависшие» после падения процесса отправки
+                            cur.execute("""
+                                UPDATE notification_outbox SET status = 'pending'
+                                WHERE status = 'sending' AND claimed_at < CURRENT_TIMESTAMP - INTERVAL '5 minutes';
+                            """)
+                            cur.execute("""
+                                SELECT id FROM notification_outbox
+                                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                                ORDER BY id
+                                LIMIT %s;
+                            """, (free,))
+                            rows = cur.fetchall()
+                            conn.commit()
+                    for row in rows:
+                        self.submit(row["id"])
+            except Exception as e:
+                log_event("outbox_sweep_failed", "❌ Ошибка при чтении outbox", logging.ERROR, error=str(e))
+            time.sleep(self.poll_interval)
+
+    def _worker(self):
+        while True:
+            notification_id = self.queue.get()
+            with self._lock:
+                self._queued.discard(notification_id)
+            try:
+                self._deliver(notification_id)
+            except Exception as e:
+                log_event("notification_error", "❌ Ошибка при отправке уведомления", logging.ERROR,
+                          notification_id=notification_id, error=str(e))
+            finally:
+                self.queue.task_done()
+
+    def _claim(self, notification_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET status = 'sending', claimed_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                    WHERE id = %s AND status = 'pending'
+                    RETURNING id, chat_id, text, parse_mode, attempts;
+                """, (notification_id,))
+                row = cur.fetchone()
+                conn.commit()
+        return row
+
+    def _finish(self, notification_id, status, error=None, retry_in=None):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET status = %s,
+                        last_error = %s,
+                        sent_at = CASE WHEN %s = 'sent' THEN CURRENT_TIMESTAMP END,
+                        next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                    WHERE id = %s;
+                """, (status, error, status, retry_in or 0, notification_id))
+                conn.commit()
+
+    def _throttle(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            send_at = max(now, self._global_next_send, self._chat_next_send.get(chat_id, 0.0))
+            self._global_next_send = send_at + self.global_interval
+            self._chat_next_send[chat_id] = send_at + self.chat_interval
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def _pause_chat(self, chat_id, seconds):
+        with self._lock:
+            self._chat_next_send[chat_id] = max(self._chat_next_send.get(chat_id, 0.0), time.monotonic() + seconds)
+
+    def _retry_or_fail(self, row, error, retry_in=None):
+        if row["attempts"] >= self.max_attempts:
+            self.failed += 1
+            self._finish(row["id"], "failed", error)
+            log_event("notification_failed", "❌ Уведомление не доставлено", logging.ERROR,
+                      notification_id=row["id"], attempts=row["attempts"], error=error)
+            return
+        if retry_in is None:
+            retry_in = min(self.backoff_max, self.backoff_base * 2 ** (row["attempts"] - 1))
+        self.retried += 1
+        self._finish(row["id"], "pending", error, retry_in)
+
+    def _deliver(self, notification_id):
+        row = self._claim(notification_id)
+        if row is None:
+            return  # уже отправлено или взято другим потоком/процессом
+
+        parse_mode = row["parse_mode"]
+        self._throttle(row["chat_id"])
+        try:
+            try:
+                bot.send_message(row["chat_id"], row["text"], parse_mode=parse_mode)
+            except ApiTelegramException as e:
+                # Текст из формы может сломать Markdown — отправляем как есть, без разметки
+                if e.error_code == 400 and parse_mode and "parse entities" in str(e.description):
+                    bot.send_message(row["chat_id"], row["text"])
+                else:
+                    raise
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 1)
+                self._pause_chat(row["chat_id"], retry_after)
+                self._retry_or_fail(row, str(e), retry_after)
+            elif e.error_code >= 500:
+                self._retry_or_fail(row, str(e))
+            else:
+                self.failed += 1
+                self._finish(row["id"], "failed", str(e))
+                log_event("notification_rejected", "❌ Telegram отклонил уведомление", logging.ERROR,
+                          notification_id=row["id"], error=str(e))
+        except http_requests.exceptions.RequestException as e:
+            self._retry_or_fail(row, str(e))
+        else:
+            self.sent += 1
+            self._finish(row["id"], "sent")
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "workers": self.workers,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+notifier = NotificationDispatcher(
+    NOTIFY_WORKERS,
+    NOTIFY_QUEUE_SIZE,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_BACKOFF_BASE,
+    NOTIFY_BACKOFF_MAX,
+    NOTIFY_POLL_INTERVAL,
+    NOTIFY_CHAT_INTERVAL,
+    NOTIFY_GLOBAL_INTERVAL,
+)
+
+
+
+# === Пакетная запись заявок (group commit) ===
+class RequestIngestor:
+    """Копит заявки несколько миллисекунд и пишет их одной транзакцией; вызывающий ждёт, пока его строка в БД."""
+
+    def __init__(self, batch_size, max_delay, dedup_window):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.dedup_window = dedup_window
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._started = False
+        self.batches = 0
+        self.rows = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name="ingest", daemon=True).start()
+
+    def submit(self, name, phone, problem, source, notification_text):
+        """Возвращает Future с {"id": ..., "duplicate": bool}; результат появляется после commit."""
+        self.start()
+        # Телефон из Telegram приходит как его набрали; приводим к виду формы сайта, чтобы дубли
+        # находились между каналами. Что не похоже на телефон, сохраняем как есть
+        phone = normalize_phone(str(phone).strip()) or phone
+        future = Future()
+        item = {
+            "name": name,
+            "phone": phone,
+            "problem": problem,
+            "source": source,
+            "notification_text": notification_text,
+            "digits": "".join(ch for ch in str(phone) if ch.isdigit()),
+            "enqueued_at": time.monotonic(),
+            "future": future,
+        }
+        with self._cond:
+            self._buffer.append(item)
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer:
+                    self._cond.wait()
+                deadline = self._buffer[0]["enqueued_at"] + self.max_delay
+                while len(self._buffer) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+
+            try:
+                results, notification_ids = self._flush(batch)
+            except Exception as e:
+                self.errors += 1
+                log_event("ingest_failed", "❌ Ошибка пакетной записи заявок", logging.ERROR, batch=len(batch), error=str(e))
+                for item in batch:
+                    self._settle(item["future"], error=e)
+                continue
+
+            for item, result in zip(batch, results):
+                self._settle(item["future"], result)
+            for notification_id in notification_ids:
+                notifier.submit(notification_id)
+
+    @staticmethod
+    def _settle(future, result=None, error=None):
+        # Вызывающий мог перестать ждать и отменить Future (тайм-аут): пакет уже записан, сообщать некому
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _flush(self, batch):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                # Дубли: тот же телефон недавно уже оставлял заявку
+                digits = list({item["digits"] for item in batch if item["digits"]})
+                existing = {}
+                if digits:
+                    cur.execute(f"""
+                        SELECT DISTINCT ON ({PHONE_DIGITS_SQL}) {PHONE_DIGITS_SQL} AS digits, id
+                        FROM requests
+                        WHERE {PHONE_DIGITS_SQL} = ANY(%s)
+                          AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                        ORDER BY {PHONE_DIGITS_SQL}, created_at DESC
+                    """, (digits, self.dedup_window))
+                    existing = {row["digits"]: row["id"] for row in cur.fetchall()}
+
+                fresh = []
+                seen_in_batch = {}
+                for i, item in enumerate(batch):
+                    key = item["digits"]
+                    if key and (key in existing or key in seen_in_batch):
+                        continue
+                    if key:
+                        seen_in_batch[key] = i
+                    fresh.append(i)
+
+                ids = {}
+                notification_ids = []
+                if fresh:
+                    rows = execute_values(cur, """
+                        INSERT INTO requests (name, phone, problem, source)
+                        VALUES %s
+                        RETURNING id
+                    """, [
+                        (batch[i]["name"], batch[i]["phone"], batch[i]["problem"], batch[i]["source"])
+                        for i in fresh
+                    ], page_size=len(fresh), fetch=True)
+                    ids = {i: row["id"] for i, row in zip(fresh, rows)}
+                    notification_ids = notifier.add_many(cur, [
+                        (ADMIN_ID, batch[i]["notification_text"], "Markdown") for i in fresh
+                    ])
+                conn.commit()
+
+        results = []
+        for i, item in enumerate(batch):
+            if i in ids:
+                results.append({"id": ids[i], "duplicate": False})
+            else:
+                key = item["digits"]
+                duplicate_of = existing.get(key) or ids.get(seen_in_batch.get(key))
+                results.append({"id": duplicate_of, "duplicate": True})
+
+        self.batches += 1
+        self.rows += len(ids)
+        self.duplicates += len(batch) - len(ids)
+        return results, notification_ids
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+        return {
+            "buffered": buffered,
+            "batches": self.batches,
+            "rows": self.rows,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "avg_batch_size": round((self.rows + self.duplicates) / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+ingestor = RequestIngestor(INGEST_BATCH_SIZE, INGEST_MAX_DELAY_MS / 1000, INGEST_DEDUP_WINDOW)
+
+
+# === Защита формы сайта: лимиты, проверка данных, ловушка для ботов ===
+FORM_NAME_RE = re.compile(r"^[^\x00-\x1f<>]{1,100}$")
+FORM_MESSAGE_MAX = 2000
+PHONE_ALLOWED_RE = re.compile(r"^\+?[\d\s()\-.]{6,25}$")
+PHONE_NON_DIGITS_RE = re.compile(r"\D")
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ (IP, телефон); ключи хранятся в LRU, самые давние вытесняются."""
+
+    def __init__(self, rate_per_min, burst, max_keys):
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+class RecentKeys:
+    """Помнит ключи заданное время (LRU с ограничением размера) — для отсева повторных отправок."""
+
+    def __init__(self, ttl, max_keys):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key):
+        with self._lock:
+            seen_at = self._keys.get(key)
+            return seen_at is not None and time.monotonic() - seen_at < self.ttl
+
+    def add(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+            self._keys[key] = time.monotonic()
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+
+form_ip_limiter = TokenBucketLimiter(FORM_IP_RATE_PER_MIN, FORM_IP_BURST, FORM_LIMITER_KEYS)
+form_phone_limiter = TokenBucketLimiter(FORM_PHONE_RATE_PER_MIN, FORM_PHONE_BURST, FORM_LIMITER_KEYS)
+form_recent = RecentKeys(FORM_DUPLICATE_WINDOW, FORM_LIMITER_KEYS)
+form_rejections = {}
+form_rejections_lock = threading.Lock()
+
+
+def count_rejection(reason):
+    with form_rejections_lock:
+        form_rejections[reason] = form_rejections.get(reason, 0) + 1
+
+
+def normalize_phone(phone):
+    """Приводит казахстанский/российский номер к виду +7XXXXXXXXXX; None — если это не похоже на телефон."""
+    if not PHONE_ALLOWED_RE.match(phone):
+        return None
+    digits = PHONE_NON_DIGITS_RE.sub("", phone)
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = "7" + digits
+    if len(digits) < 10 or len(digits) > 15:
+        return None
+    return f"+{digits}"
+
+
+def form_rejection(reason, body, status, headers=None):
+    count_rejection(reason)
+    return body, status, headers or {}
+
+
+def form_error(reason, message, status, headers=None):
+    return form_rejection(reason, {"status": "error", "message": message}, status, headers)
+
+
+def form_fake_success(reason):
+    # Ботам и повторным нажатиям отвечаем «успехом», чтобы не подсказывать, что их отсеяли
+    return form_rejection(reason, {"status": "success"}, 200)
+
+
+def precheck_form(content_length, remote_addr):
+    """Проверки до чтения тела: размер и частота с одного IP. None — можно читать, иначе отказ (тело, статус, заголовки)."""
+    if content_length is None:
+        return form_error("no_length", "Не указан размер запроса (Content-Length)", 411)
+    if content_length > FORM_MAX_BYTES:
+        return form_error("too_large", "Слишком большой запрос", 413)
+
+    if not form_ip_limiter.allow(remote_addr):
+        retry_after = str(int(60 / FORM_IP_RATE_PER_MIN) if FORM_IP_RATE_PER_MIN else 60)
+        return form_error("rate_ip", "Слишком много заявок, попробуйте позже", 429, {"Retry-After": retry_after})
+    return None
+
+
+def validate_form_data(data):
+    """Проверки полей формы до БД и Telegram. Возвращает (данные, None) или (None, отказ)."""
+    if not isinstance(data, dict):
+        return None, form_error("bad_json", "Некорректные данные формы", 400)
+
+    # Скрытое поле website люди не видят и не заполняют
+    if data.get("website"):
+        return None, form_fake_success("honeypot")
+
+    name = data.get("name")
+    phone = data.get("phone")
+    problem = data.get("message") or ""
+    if not isinstance(name, str) or not isinstance(phone, str) or not isinstance(problem, str):
+        return None, form_error("invalid", "Имя и телефон обязательны", 400)
+
+    name = name.strip()
+    problem = problem.strip()
+    if not name or not phone.strip():
+        return None, form_error("invalid", "Имя и телефон обязательны", 400)
+    if not FORM_NAME_RE.match(name):
+        return None, form_error("invalid", "Некорректное имя", 400)
+    if len(problem) > FORM_MESSAGE_MAX:
+        return None, form_error("invalid", "Слишком длинное описание проблемы", 400)
+    phone = normalize_phone(phone.strip())
+    if phone is None:
+        return None, form_error("invalid", "Некорректный номер телефона", 400)
+
+    if not form_phone_limiter.allow(phone):
+        return None, form_error("rate_phone", "Слишком много заявок с этого номера, попробуйте позже", 429)
+    if form_recent.seen((phone, problem.lower())):
+        return None, form_fake_success("duplicate")
+
+    return {"name": name, "phone": phone, "problem": problem}, None
 
-        print(f"✅ Заявка сохранена: {name}, {phone}, {problem}")
+
+def check_form_submission():
+    """Быстрые проверки до БД и Telegram. Возвращает (данные, None) или (None, готовый ответ)."""
+    rejection = precheck_form(request.content_length, request.remote_addr)
+    if rejection is None:
+        data, rejection = validate_form_data(request.get_json(force=True, silent=True))
+        if rejection is None:
+            return data, None
+    body, status, headers = rejection
+    return None, (jsonify(body), status, headers)
+
+
+def form_guard_stats():
+    with form_rejections_lock:
+        rejections = dict(form_rejections)
+    return {"rejected": rejections, "rejected_total": sum(rejections.values())}
+
+
+# === Маршрут для приёма данных с формы сайта ===
+def site_request_text(name, phone, problem):
+    return (
+        f"📬 *Новая заявка с сайта!*\n"
+        f"👤 Имя: {name}\n"
+        f"📞 Телефон: {phone}\n"
+        f"💬 Проблема: {problem}"
+    )
+
+
+@app.route("/send_request", methods=["POST"])
+def send_request():
+    try:
+        data, rejection = check_form_submission()
+        if rejection:
+            return rejection
+        name = data["name"]
+        phone = data["phone"]
+        problem = data["problem"]
+
+        msg = site_request_text(name, phone, problem)
+
+        # Заявка и уведомление админу пишутся пакетом вместе с соседними заявками;
+        # ответ уходит, когда строка закоммичена, а уведомление отправляется в фоне
+        result = ingestor.submit(name, phone, problem, "site", msg).result(timeout=INGEST_TIMEOUT)
+        form_recent.add((phone, problem.lower()))
+
+        if result["duplicate"]:
+            log_event("request_duplicate", "ℹ️ Повторная заявка с сайта пропущена", source="site", phone=phone,
+                      request_id=result["id"])
+        else:
+            log_event("request_saved", "✅ Заявка сохранена", source="site", request_id=result["id"], name=name, phone=phone)
         return jsonify({"status": "success"}), 200
 
     except Exception as e:
-        print(f"❌ Ошибка при обработке заявки: {e}")
+        log_event("request_failed", "❌ Ошибка при обработке заявки", logging.ERROR, source="site", error=str(e))
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
 
+# === Обработка апдейтов Telegram в пуле потоков ===
+class UpdateDispatcher:
+    """Пул обработчиков апдейтов: апдейты одного чата всегда попадают в один поток и идут по порядку."""
+
+    def __init__(self, workers, queue_size, enqueue_timeout):
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._started = False
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @staticmethod
+    def chat_key(update):
+        for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+            message = getattr(update, field, None)
+            if message is not None:
+                return message.chat.id
+        for field in ("callback_query", "inline_query", "chosen_inline_result", "shipping_query",
+                      "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request"):
+            event = getattr(update, field, None)
+            if event is not None and getattr(event, "from_user", None) is not None:
+                return event.from_user.id
+        return update.update_id
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i, shard in enumerate(self.queues):
+            threading.Thread(target=self._worker, args=(shard,), name=f"updates-{i}", daemon=True).start()
+        log_event("updates_started", "✅ Обработка апдейтов запущена", workers=self.workers)
+
+    def submit(self, update):
+        """Ставит апдейт в очередь его чата; False — очередь переполнена, Telegram повторит доставку."""
+        shard = self.queues[hash(self.chat_key(update)) % self.workers]
+        try:
+            shard.put((time.monotonic(), update), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def _worker(self, shard):
+        while True:
+            enqueued_at, update = shard.get()
+            if METRICS_ENABLED:
+                metrics.observe("update_queue_wait_seconds", time.monotonic() - enqueued_at)
+            try:
+                bot.process_new_updates([update])
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                log_event("update_failed", "❌ Ошибка обработки апдейта", logging.ERROR,
+                          update_id=update.update_id, error=str(e))
+            finally:
+                latency = time.monotonic() - enqueued_at
+                with self._lock:
+                    self.processed += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                shard.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": sum(q.qsize() for q in self.queues),
+                "queue_depth_max_shard": max(q.qsize() for q in self.queues),
+                "processed": self.processed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "latency_avg_ms": round(self.latency_total / self.processed * 1000, 3) if self.processed else 0.0,
+                "latency_max_ms": round(self.latency_max * 1000, 3),
+            }
+
+
+update_dispatcher = UpdateDispatcher(UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_ENQUEUE_TIMEOUT)
+
+
 # === Маршрут для Telegram Webhook ===
 @app.route(f"/{BOT_TOKEN}", methods=["POST"])
 def telegram_webhook():
     try:
         json_str = request.get_data().decode("UTF-8")
         update = telebot.types.Update.de_json(json_str)
-        bot.process_new_updates([update])
     except Exception as e:
-        print(f"❌ Ошибка Webhook: {e}")
+        log_event("webhook_bad_update", "❌ Ошибка Webhook", logging.ERROR, error=str(e))
+        return "OK", 200
+
+    # Отвечаем сразу, апдейт обрабатывается в фоне; при переполнении просим Telegram повторить позже
+    if not update_dispatcher.submit(update):
+        log_event("webhook_busy", "⚠️ Очередь апдейтов переполнена, апдейт отклонён", logging.WARNING,
+                  update_id=update.update_id)
+        return "Busy", 503
     return "OK", 200
 
 
 
-def run_flask():
-    init_db()  # Проверяем/создаём таблицу
-    bot.remove_webhook()
+# === Запуск: порт открывается сразу, БД и webhook готовятся в фоне ===
+# Этапы подготовки отмечаются в таблице startup_marks, а не в памяти: под gunicorn подготовку
+# выполняет отдельный процесс мастера, и воркеры узнают о ней только из БД.
+# Отметки прошлых запусков остаются в таблице, поэтому каждая помечена BOOT_ID: его создаёт мастер
+# gunicorn при импорте в on_starting, и процесс подготовки и воркеры получают его вместе с fork
+STARTUP_TASKS = ("db", "webhook")
+BOOT_ID = uuid.uuid4().hex
+readiness_cache = {"checked_at": 0.0, "ready": False, "startup": dict.fromkeys(STARTUP_TASKS, False)}
+
+
+def mark_startup_done(name):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS startup_marks (
+                    boot_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    done_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (boot_id, name)
+                )
+            """)
+            cur.execute("""
+                INSERT INTO startup_marks (boot_id, name) VALUES (%s, %s)
+                ON CONFLICT (boot_id, name) DO UPDATE SET done_at = CURRENT_TIMESTAMP
+            """, (BOOT_ID, name))
+            # Отметки других запусков нужны, пока те ещё работают (выкладка, несколько инстансов)
+            cur.execute("DELETE FROM startup_marks WHERE done_at < CURRENT_TIMESTAMP - interval '7 days'")
+            conn.commit()
+
+
+def retry_startup_task(name, func):
+    delay = STARTUP_RETRY_BASE
+    while True:
+        try:
+            func()
+            mark_startup_done(name)
+            return
+        except Exception as e:
+            log_event("startup_retry", "❌ Подготовка не удалась, будет повтор", logging.ERROR,
+                      task=name, retry_in=delay, error=str(e))
+            time.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX)
+
+
+def ensure_webhook():
     webhook_url = f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME')}/{BOT_TOKEN}"
+    # Лишний set_webhook — это сетевой запрос и сброс очереди Telegram, делаем его только при смене адреса
+    if bot.get_webhook_info().url == webhook_url:
+        log_event("webhook_unchanged", "✅ Webhook уже установлен")
+        return
     bot.set_webhook(url=webhook_url)
-    print(f"✅ Webhook установлен: {webhook_url}")
+    log_event("webhook_set", "✅ Webhook установлен", host=os.getenv("RENDER_EXTERNAL_HOSTNAME"))
+
+
+def startup():
+    """Однократная подготовка: таблицы и webhook, с повторами. Под gunicorn — в отдельном процессе мастера."""
+    retry_startup_task("db", init_db)  # Проверяем/создаём таблицу
+    retry_startup_task("webhook", ensure_webhook)
+
+
+def start_startup_in_background():
+    threading.Thread(target=startup, name="startup", daemon=True).start()
+
+
+READINESS_SQL = "SELECT name FROM startup_marks WHERE boot_id = %s"  # параметр — BOOT_ID
+
+
+def remember_readiness(now, rows):
+    """rows — строки READINESS_SQL или None, если БД недоступна; готовы, когда подготовлены таблицы."""
+    startup = dict.fromkeys(STARTUP_TASKS, False)
+    for row in rows or []:
+        startup[row["name"]] = True
+    readiness_cache.update(checked_at=now, ready=startup["db"], startup=startup)
+    return startup["db"]
+
+
+def cached_readiness(now):
+    """True/False из кэша или None, если пора спросить БД."""
+    if readiness_cache["ready"] and now - readiness_cache["checked_at"] < READINESS_CACHE_TTL:
+        return True
+    if not readiness_cache["ready"] and now - readiness_cache["checked_at"] < 1:
+        return False
+    return None
+
+
+def db_ready():
+    # Готовность проверяем по отметкам в БД: подготовку мог выполнить другой процесс
+    now = time.monotonic()
+    cached = cached_readiness(now)
+    if cached is not None:
+        return cached
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(READINESS_SQL, (BOOT_ID,))
+                rows = cur.fetchall()
+    except Exception:
+        rows = None
+    return remember_readiness(now, rows)
+
+
+# ✅ Liveness: процесс жив и отвечает
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "alive"}), 200
+
+
+# ✅ Readiness: БД доступна и таблицы созданы
+@app.route("/readyz")
+def readyz():
+    ready = db_ready()
+    return jsonify({"status": "ready" if ready else "starting", "startup": readiness_cache["startup"]}), 200 if ready else 503
+
+
+def start_background_workers():
+    """Фоновые потоки нужны в каждом процессе, который обслуживает запросы (потоки не переживают fork)."""
+    notifier.start()
+    update_dispatcher.start()
+    ingestor.start()
+    threading.Thread(target=next_step_janitor, name="next-step-janitor", daemon=True).start()
+    threading.Thread(target=partition_maintainer, name="partition-maintainer", daemon=True).start()
+
+
+def run_flask():
+    start_startup_in_background()
+    start_background_workers()
     app.run(host="0.0.0.0", port=PORT)
 
 
+def run_gunicorn():
+    # Настройки воркеров и хуки запуска — в gunicorn.conf.py
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(base_dir, "gunicorn.conf.py")
+    os.execvp("gunicorn", ["gunicorn", "-c", config_path, "--chdir", base_dir, "Okservice:app"])
 
-# Подключение к PostgreSQL
-DATABASE_URL = os.getenv("DATABASE_URL")
-try:
-    conn_test = psycopg2.connect(DATABASE_URL)
-    conn_test.close()
-    print("✅ Успешное подключение к PostgreSQL!")
-except Exception as e:
-    print("❌ Ошибка подключения к PostgreSQL:", e)
 
+def run_async():
+    # Отдельный процесс-модуль: aiohttp/psycopg 3 нужны только этому режиму, а Okservice импортируется один раз
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    os.execv(sys.executable, [sys.executable, os.path.join(base_dir, "okservice_async.py")])
 
 
-# === Главное меню ===
-def main_menu():
+
+# === Кнопки меню и клавиатуры (собираются один раз при запуске) ===
+BTN_ABOUT = "💡 О сервисе"
+BTN_PRICES = "💰 Услуги и цены"
+BTN_PHOTOS = "📸 Фото сервиса"
+BTN_ADDRESS = "📍 Как добраться"
+BTN_HOURS = "🕓 Время работы"
+BTN_CONTACTS = "☎️ Связаться с нами"
+BTN_MAP = "🗺 Показать на карте"
+BTN_REQUEST = "💬 Оставить заявку на ремонт"
+
+BTN_ALL_REQUESTS = "📋 Все заявки"
+BTN_SEARCH = "🔍 Найти заявку"
+BTN_STATS = "📊 Статистика"
+BTN_EXPORT_XLSX = "📤 Экспорт в Excel"
+BTN_EXPORT_CSV = "📤 Экспорт в CSV"
+BTN_CLEAR = "🗑 Очистить базу"
+BTN_MAIN_MENU = "🏠 Главное меню"
+
+
+def build_reply_keyboard(labels):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add(
-        types.KeyboardButton("💡 О сервисе"),
-        types.KeyboardButton("💰 Услуги и цены"),
-        types.KeyboardButton("📸 Фото сервиса"),
-        types.KeyboardButton("📍 Как добраться"),
-        types.KeyboardButton("🕓 Время работы"),
-        types.KeyboardButton("☎️ Связаться с нами"),
-        types.KeyboardButton("🗺 Показать на карте"),
-        types.KeyboardButton("💬 Оставить заявку на ремонт")
-    )
+    markup.add(*(types.KeyboardButton(label) for label in labels))
     return markup
 
 
+MAIN_MENU_MARKUP = build_reply_keyboard([
+    BTN_ABOUT, BTN_PRICES, BTN_PHOTOS, BTN_ADDRESS, BTN_HOURS, BTN_CONTACTS, BTN_MAP, BTN_REQUEST,
+])
+ADMIN_MENU_MARKUP = build_reply_keyboard([
+    BTN_ALL_REQUESTS, BTN_SEARCH, BTN_STATS, BTN_EXPORT_XLSX, BTN_EXPORT_CSV, BTN_CLEAR, BTN_MAIN_MENU,
+])
+
+
+# === Главное меню ===
+def main_menu():
+    return MAIN_MENU_MARKUP
+
+
+# === Обработчики бота: общие для синхронного и асинхронного режимов ===
+# Обработчик — корутина handler(io, update, *args): Telegram, БД и запись заявок — только через io.
+# SyncBotIO выполняет всё сразу и ничего не ждёт, поэтому в синхронном режиме корутина проходит
+# за один шаг (run_sync) в потоке UpdateDispatcher; okservice_async.AsyncBotIO — AsyncTeleBot и psycopg 3.
+class SyncBotIO:
+    """Ввод-вывод обработчиков в синхронном режиме: TeleBot, DbPool и next-step хранилище TeleBot."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def send(self, chat_id, text, **kwargs):
+        return self.bot.send_message(chat_id, text, **kwargs)
+
+    async def send_location(self, chat_id, latitude, longitude):
+        return self.bot.send_location(chat_id, latitude, longitude)
+
+    async def edit(self, text, chat_id, message_id, **kwargs):
+        return self.bot.edit_message_text(text, chat_id, message_id, **kwargs)
+
+    async def answer_callback(self, callback_id, text=None):
+        return self.bot.answer_callback_query(callback_id, text)
+
+    async def next_step(self, message, handler, *args):
+        # Шаг хранится как в TeleBot (функция по имени + аргументы), поэтому его понимают оба режима
+        self.bot.register_next_step_handler(message, run_next_step, handler, *args)
+
+    async def queries(self, statements):
+        """statements — [(sql, params, many)]; результаты по порядку, все запросы на одном соединении."""
+        results = []
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for sql, params, many in statements:
+                    cur.execute(sql, params)
+                    results.append(cur.fetchall() if many else cur.fetchone())
+            # DbPool откатывает незавершённую транзакцию при возврате соединения — фиксируем явно
+            conn.commit()
+        return results
+
+    async def query(self, sql, params=None):
+        return (await self.queries([(sql, params, True)]))[0]
+
+    async def execute(self, sql, params=None):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+            conn.commit()
+
+    async def ingest(self, name, phone, problem, source, notification_text):
+        return ingestor.submit(name, phone, problem, source, notification_text).result(timeout=INGEST_TIMEOUT)
+
+    async def blocking(self, func, *args, **kwargs):
+        """Долгий синхронный вызов (загрузка фото): здесь — сразу, в асинхронном режиме — в потоке."""
+        return func(*args, **kwargs)
+
+
+def run_sync(coro):
+    """Выполняет корутину обработчика с SyncBotIO: она не ждёт ничего асинхронного и завершается за один шаг."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Обработчик ждёт асинхронную операцию — в синхронном режиме так нельзя")
+
+
+def run_next_step(message, handler, *args):
+    """Callback next-step для TeleBot: продолжает форму общим обработчиком handler(io, message, *args)."""
+    return run_sync(handler(sync_io, message, *args))
+
+
+def sync_handler(handler):
+    @functools.wraps(handler)
+    def run(update):
+        return run_sync(handler(sync_io, update))
+    return run
+
+
+BOT_HANDLERS = []  # [(тип апдейта, фильтры TeleBot, обработчик)] — порядок регистрации важен
+
+
+def bot_handler(kind, **filters):
+    """Запоминает обработчик; register_bot_handlers регистрирует его в TeleBot или AsyncTeleBot."""
+    def decorate(handler):
+        BOT_HANDLERS.append((kind, filters, handler))
+        return handler
+    return decorate
+
+
+def register_bot_handlers(target, wrap):
+    for kind, filters, handler in BOT_HANDLERS:
+        if kind == "message":
+            target.register_message_handler(wrap(handler), **filters)
+        else:
+            target.register_callback_query_handler(wrap(handler), **filters)
+
+
+sync_io = SyncBotIO(bot)
+
+
 # === Приветствие ===
-@bot.message_handler(commands=['start'])
-def start_message(message):
-    bot.send_message(
-        message.chat.id,
-        "👋 Привет! Я бот сервисного центра по ремонту компьютеров 💻\n\n"
-        "Я помогу вам узнать:\n"
-        "• О нашем сервисе\n"
-        "• Наши услуги и цены\n"
-        "• Как нас найти\n"
-        "• Время работы и контакты\n"
-        "• А также оставить заявку на ремонт ⚙️",
-        reply_markup=main_menu()
-    )
+@bot_handler("message", commands=['start'])
+@instrumented
+async def start_message(io, message):
+    await io.send(message.chat.id, START_TEXT, reply_markup=main_menu())
 
 
 # === Проверка на администратора ===
@@ -169,314 +1947,1465 @@ def is_admin(message):
 
 
 # === Админ-панель ===
-@bot.message_handler(commands=['admin'])
-def admin_panel(message):
+@bot_handler("message", commands=['admin'])
+@instrumented
+async def admin_panel(io, message):
     if not is_admin(message):
-        bot.send_message(message.chat.id, "⛔ У вас нет доступа к этой команде.")
+        await io.send(message.chat.id, NO_ACCESS_TEXT)
         return
 
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add(
-        types.KeyboardButton("📋 Все заявки"),
-        types.KeyboardButton("🔍 Найти по имени"),
-        types.KeyboardButton("📤 Экспорт в Excel"),
-        types.KeyboardButton("🗑 Очистить базу"),
-        types.KeyboardButton("🏠 Главное меню")
-    )
+    await io.send(message.chat.id, ADMIN_PANEL_TEXT, reply_markup=ADMIN_MENU_MARKUP)
 
-    bot.send_message(
-        message.chat.id,
-        "🛠 Добро пожаловать в панель администратора.\n\nВыберите действие:",
-        reply_markup=markup
+
+# === Админ: постраничный просмотр заявок ===
+TELEGRAM_MESSAGE_LIMIT = 4096
+PROBLEM_PREVIEW_LIMIT = 500  # длинные описания в списке обрезаются, полный текст — в экспорте
+PAGE_QUERIES_LIMIT = 500  # сколько поисковых запросов процесс держит в памяти, не спрашивая search_queries
+
+page_queries = OrderedDict()
+page_queries_lock = threading.Lock()
+
+
+def format_request(row):
+    problem = row["problem"] or ""
+    if len(problem) > PROBLEM_PREVIEW_LIMIT:
+        problem = problem[:PROBLEM_PREVIEW_LIMIT] + "…"
+    return (
+        f"🆔 Заявка №{row['id']}\n"
+        f"👤 Имя: {row['name']}\n"
+        f"📞 Телефон: {row['phone']}\n"
+        f"💬 Проблема: {problem}\n"
+        f"🕒 Дата: {row['created_at']}\n"
+        f"🌐 Источник: {row['source']}"
     )
 
 
-# === Админ: просмотр всех заявок ===
-@bot.message_handler(func=lambda m: is_admin(m) and "все заявки" in m.text.lower())
-def show_all_requests(message):
+def page_query_key(query):
+    return hashlib.sha1(repr(sorted(query.items())).encode("utf-8")).hexdigest()[:10]
+
+
+def cache_page_query(key, query):
+    with page_queries_lock:
+        page_queries[key] = query
+        page_queries.move_to_end(key)
+        while len(page_queries) > PAGE_QUERIES_LIMIT:
+            page_queries.popitem(last=False)
+
+
+async def remember_page_query(io, query):
+    """Запоминает параметры поиска под коротким ключом — callback_data ограничена 64 байтами.
+
+    Ключ пишется в search_queries: при WEB_CONCURRENCY > 1 кнопку нажмут уже в другом воркере.
+    """
+    key = page_query_key(query)
+    cache_page_query(key, query)
+    await io.execute("""
+        INSERT INTO search_queries (key, query) VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE SET used_at = CURRENT_TIMESTAMP
+    """, (key, json.dumps(query, ensure_ascii=False)))
+    return key
+
+
+async def load_page_query(io, key):
+    if key == "all":
+        return {}
+    with page_queries_lock:
+        query = page_queries.get(key)
+    if query is not None:
+        return query
+    rows = await io.query("""
+        SELECT query FROM search_queries
+        WHERE key = %s AND used_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (key, PAGE_QUERY_TTL))
+    if not rows:
+        return None
+    query = json.loads(rows[0]["query"])
+    cache_page_query(key, query)
+    return query
+
+
+def cleanup_page_queries():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM search_queries WHERE used_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                        (PAGE_QUERY_TTL,))
+            deleted = cur.rowcount
+            conn.commit()
+    return deleted
+
+
+# === Поиск заявок ===
+PHONE_DIGITS_SQL = r"regexp_replace(phone, '\D', '', 'g')"  # то же выражение, что в индексе
+SEARCH_RANK_SQL = (
+    "round(GREATEST(similarity(name, %(text)s), word_similarity(%(text)s, name), "
+    "word_similarity(%(text)s, coalesce(problem, '')))::numeric, 4)"
+)
+SEARCH_SOURCES = {"site", "telegram", "unknown"}
+SEARCH_DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d")
+
+trgm_state = {"enabled": None, "checked_at": None}
+
+
+def init_search_indexes(cur):
+    """Индексы для поиска: триграммы по имени/проблеме, цифры телефона, дата и источник."""
+    cur.execute("SAVEPOINT search_trgm")
     try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute("RELEASE SAVEPOINT search_trgm")
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT search_trgm")
+        log_event("trgm_unavailable", "⚠️ Расширение pg_trgm недоступно, нечёткий поиск отключён", logging.WARNING,
+                  error=str(e))
+
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cur.fetchone():
+        cur.execute("CREATE INDEX IF NOT EXISTS requests_name_trgm_idx ON requests USING gin (name gin_trgm_ops)")
+        cur.execute("CREATE INDEX IF NOT EXISTS requests_problem_trgm_idx ON requests USING gin (problem gin_trgm_ops)")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS requests_phone_digits_trgm_idx ON requests USING gin (({PHONE_DIGITS_SQL}) gin_trgm_ops)")
+    # (created_at, id) — порядок списка в админке: свежие страницы читаются из последней секции
+    cur.execute("CREATE INDEX IF NOT EXISTS requests_created_at_id_idx ON requests (created_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS requests_source_id_idx ON requests (source, id)")
+
+
+def trgm_pending(now):
+    """Нужно ли спросить БД о pg_trgm: навсегда запоминается только «есть». init_db создаёт расширение
+    в фоне (под gunicorn — в другом процессе), и ранний поиск не должен отключить нечёткий поиск до рестарта."""
+    if trgm_state["enabled"]:
+        return False
+    return trgm_state["checked_at"] is None or now - trgm_state["checked_at"] >= TRGM_RECHECK_INTERVAL
+
+
+def trgm_enabled():
+    now = time.monotonic()
+    if trgm_pending(now):
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT id, name, phone, problem, created_at, source FROM requests ORDER BY id DESC")
-                rows = cur.fetchall()
+                cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                trgm_state.update(enabled=cur.fetchone() is not None, checked_at=now)
+    return bool(trgm_state["enabled"])
 
-        if not rows:
-            bot.send_message(message.chat.id, "📭 Заявок пока нет.")
-            return
 
-        for row in rows:
-            bot.send_message(
-                message.chat.id,
-                f"🆔 Заявка №{row['id']}\n"
-                f"👤 Имя: {row['name']}\n"
-                f"📞 Телефон: {row['phone']}\n"
-                f"💬 Проблема: {row['problem']}\n"
-                f"🕒 Дата: {row['created_at']}\n"
-                f"🌐 Источник: {row['source']}"
-            )
+def like_pattern(value):
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def parse_search_date(value):
+    for fmt in SEARCH_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Не понял дату «{value}», используйте ДД.ММ.ГГГГ")
+
+
+def parse_search_query(text):
+    """Разбирает строку поиска: свободный текст плюс фильтры тел:, с:, по:, источник:."""
+    query = {}
+    words = []
+    for word in text.split():
+        prefix, sep, value = word.partition(":")
+        prefix = prefix.lower()
+        if sep and value:
+            if prefix in ("тел", "телефон", "phone"):
+                query["phone"] = value
+                continue
+            if prefix in ("с", "от", "from"):
+                query["date_from"] = parse_search_date(value).isoformat()
+                continue
+            if prefix in ("по", "до", "to"):
+                query["date_to"] = parse_search_date(value).isoformat()
+                continue
+            if prefix in ("источник", "source"):
+                if value.lower() not in SEARCH_SOURCES:
+                    raise ValueError(f"Источник может быть: {', '.join(sorted(SEARCH_SOURCES))}")
+                query["source"] = value.lower()
+                continue
+        words.append(word)
+
+    text = " ".join(words)
+    digits = "".join(ch for ch in text if ch.isdigit())
+    # Строка из одних цифр и разделителей — это фрагмент телефона
+    if text and len(digits) >= 3 and not any(ch.isalpha() for ch in text):
+        query.setdefault("phone", text)
+        text = ""
+    if "phone" in query:
+        query["phone"] = "".join(ch for ch in query["phone"] if ch.isdigit())
+        if not query["phone"]:
+            raise ValueError("В фильтре тел: нет цифр")
+    if text:
+        query["text"] = text
+    return query
+
+
+def build_request_filter(query):
+    conditions = []
+    params = {}
+    if query.get("text"):
+        params["text"] = query["text"]
+        params["text_like"] = like_pattern(query["text"])
+        if trgm_enabled():
+            conditions.append("(name ILIKE %(text_like)s OR problem ILIKE %(text_like)s OR name %% %(text)s)")
+        else:
+            conditions.append("(name ILIKE %(text_like)s OR problem ILIKE %(text_like)s)")
+    if query.get("phone"):
+        conditions.append(f"{PHONE_DIGITS_SQL} LIKE %(phone_like)s")
+        params["phone_like"] = like_pattern(query["phone"])
+    if query.get("date_from"):
+        conditions.append("created_at >= %(date_from)s::date")
+        params["date_from"] = query["date_from"]
+    if query.get("date_to"):
+        conditions.append("created_at < %(date_to)s::date + 1")
+        params["date_to"] = query["date_to"]
+    if query.get("source"):
+        conditions.append("source = %(source)s")
+        params["source"] = query["source"]
+    return conditions, params
+
+
+def request_sort_keys(query):
+    """Ключи сортировки страницы: (SQL-выражение, тип, имя колонки). По ним же строится курсор."""
+    if query.get("text") and trgm_enabled():
+        return [(SEARCH_RANK_SQL, "numeric", "rank"), ("id", "bigint", "id")]
+    # По ключу секционирования планировщик читает секции по порядку и останавливается на LIMIT
+    return [("created_at", "timestamp", "created_at"), ("id", "bigint", "id")]
+
+
+def page_cursor(row, keys):
+    return "~".join(str(row[alias]) for _, _, alias in keys)
+
+
+def requests_page_query(query, cursor=None, direction="next"):
+    """SQL и параметры одной страницы keyset-пагинации и ключи сортировки для курсора."""
+    conditions, params = build_request_filter(query)
+    keys = request_sort_keys(query)
+    if cursor is not None:
+        values = cursor.split("~")
+        columns = ", ".join(expr for expr, _, _ in keys)
+        placeholders = ", ".join(f"%(cursor_{i})s::{cast}" for i, (_, cast, _) in enumerate(keys))
+        conditions.append(f"({columns}) {'<' if direction == 'next' else '>'} ({placeholders})")
+        params.update({f"cursor_{i}": value for i, value in enumerate(values)})
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = ", ".join(f"{expr} {'DESC' if direction == 'next' else 'ASC'}" for expr, _, _ in keys)
+    extra = "".join(f", {expr} AS {alias}" for expr, _, alias in keys if alias not in ("id", "created_at"))
+    params["limit"] = ADMIN_PAGE_SIZE + 1
+    sql = f"""
+        SELECT id, name, phone, problem, created_at, source{extra}
+        FROM requests
+        {where}
+        ORDER BY {order}
+        LIMIT %(limit)s
+    """
+    return sql, params, keys
+
+
+def split_requests_page(rows, cursor, direction):
+    """Из ADMIN_PAGE_SIZE + 1 строк — страница в порядке показа и признаки соседних страниц."""
+    has_more = len(rows) > ADMIN_PAGE_SIZE
+    rows = rows[:ADMIN_PAGE_SIZE]
+    if direction == "next":
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    return rows, has_prev, has_next
+
+
+async def fetch_requests_page(io, query, cursor=None, direction="next"):
+    """Keyset-пагинация: «next» — следующие по сортировке (старее/менее релевантные), «prev» — предыдущие."""
+    sql, params, keys = requests_page_query(query, cursor, direction)
+    rows = await io.query(sql, params)
+    rows, has_prev, has_next = split_requests_page(rows, cursor, direction)
+    return rows, keys, has_prev, has_next
+
+
+def telegram_len(text):
+    # Telegram считает длину сообщения в UTF-16, эмодзи занимают по две позиции
+    return len(text.encode("utf-16-le")) // 2
+
+
+def render_requests_page(title, key, rows, keys, has_prev, has_next, direction="next"):
+    """Собирает страницу в одно сообщение в пределах лимита Telegram и кнопки навигации."""
+    blocks = [format_request(row) for row in rows]
+    # При листании назад ближе к курсору последние заявки страницы — их и оставляем
+    order = range(len(rows) - 1, -1, -1) if direction == "prev" else range(len(rows))
+    budget = TELEGRAM_MESSAGE_LIMIT - telegram_len(title)
+    kept = []
+    for i in order:
+        cost = telegram_len(blocks[i]) + 2
+        if cost > budget:
+            break
+        budget -= cost
+        kept.append(i)
+    kept.sort()
+
+    if len(kept) < len(rows):
+        if direction == "prev":
+            has_prev = True
+        else:
+            has_next = True
+    shown = [rows[i] for i in kept]
+    text = title + "".join(f"\n\n{blocks[i]}" for i in kept)
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if has_prev and shown:
+        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"pg:{key}:prev:{page_cursor(shown[0], keys)}"))
+    if has_next and shown:
+        buttons.append(types.InlineKeyboardButton("Далее ➡️", callback_data=f"pg:{key}:next:{page_cursor(shown[-1], keys)}"))
+    if buttons:
+        markup.add(*buttons)
+    return text, markup
+
+
+async def send_requests_page(io, chat_id, title, query, empty_text):
+    key = await remember_page_query(io, query) if query else "all"
+    rows, keys, has_prev, has_next = await fetch_requests_page(io, query)
+    if not rows:
+        await io.send(chat_id, empty_text)
+        return
+    text, markup = render_requests_page(title, key, rows, keys, has_prev, has_next)
+    await io.send(chat_id, text, reply_markup=markup)
+
+
+def page_title(query):
+    if not query:
+        return "📋 Все заявки"
+    parts = []
+    if query.get("text"):
+        parts.append(f"«{query['text']}»")
+    if query.get("phone"):
+        parts.append(f"тел. …{query['phone']}…")
+    if query.get("date_from"):
+        parts.append(f"с {query['date_from']}")
+    if query.get("date_to"):
+        parts.append(f"по {query['date_to']}")
+    if query.get("source"):
+        parts.append(f"источник {query['source']}")
+    return f"🔍 Поиск: {', '.join(parts)}"
+
+
+# === Админ: просмотр всех заявок ===
+@instrumented
+async def show_all_requests(io, message):
+    try:
+        await send_requests_page(io, message.chat.id, page_title({}), {}, "📭 Заявок пока нет.")
     except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Ошибка при получении заявок: {e}")
+        await io.send(message.chat.id, f"❌ Ошибка при получении заявок: {e}")
 
 
-# === Админ: поиск по имени ===
-@bot.message_handler(func=lambda m: is_admin(m) and "найти" in m.text.lower())
-def find_request_by_name(message):
-    bot.send_message(message.chat.id, "🔍 Введите имя для поиска:")
-    bot.register_next_step_handler(message, admin_search_name)
+@bot_handler("callback_query", func=lambda call: call.data.startswith("pg:"))
+@instrumented
+async def requests_page_callback(io, call):
+    if call.message.chat.id != ADMIN_ID:
+        await io.answer_callback(call.id, "⛔ Нет доступа.")
+        return
 
+    _, key, direction, cursor = call.data.split(":", 3)
+    query = await load_page_query(io, key)
+    if query is None:
+        await io.answer_callback(call.id, "⌛ Результаты поиска устарели, повторите поиск.")
+        return
 
-def admin_search_name(message):
-    search_name = message.text.strip()
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM requests WHERE name ILIKE %s", (f"%{search_name}%",))
-            rows = cur.fetchall()
+    try:
+        rows, keys, has_prev, has_next = await fetch_requests_page(io, query, cursor, direction)
+        if not rows:
+            await io.answer_callback(call.id, "📭 Больше заявок нет.")
+            return
+        text, markup = render_requests_page(page_title(query), key, rows, keys, has_prev, has_next, direction)
+        await io.edit(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+        await io.answer_callback(call.id)
+    except Exception as e:
+        await io.answer_callback(call.id, f"❌ Ошибка: {e}"[:200])
 
-    if not rows:
-        bot.send_message(message.chat.id, "❌ Ничего не найдено.")
+
+# === Админ: поиск заявок ===
+@instrumented
+async def find_request_by_name(io, message):
+    await io.send(message.chat.id, SEARCH_HELP_TEXT)
+    await io.next_step(message, admin_search_name)
+
+
+@instrumented
+async def admin_search_name(io, message):
+    try:
+        query = parse_search_query(message.text or "")
+    except ValueError as e:
+        await io.send(message.chat.id, f"⚠️ {e}")
+        return
+    if not query:
+        await io.send(message.chat.id, "⚠️ Пустой запрос.")
         return
 
-    for row in rows:
-        bot.send_message(
-            message.chat.id,
-            f"🆔 Заявка №{row['id']}\n"
-            f"👤 Имя: {row['name']}\n"
-            f"📞 Телефон: {row['phone']}\n"
-            f"💬 Проблема: {row['problem']}\n"
-            f"🕒 Дата: {row['created_at']}\n"
-            f"🌐 Источник: {row['source']}"
-        )
+    try:
+        await send_requests_page(io, message.chat.id, page_title(query), query, "❌ Ничего не найдено.")
+    except Exception as e:
+        await io.send(message.chat.id, f"❌ Ошибка при поиске заявок: {e}")
+
+
+
+# === Админ: статистика ===
+# Сводки ведут триггеры уровня оператора по таблицам переходов: один пакет вставки группового
+# коммита — один UPSERT на день и источник. Дашборд читает только сводки, а не requests.
+KEYWORD_MIN_LENGTH = 4
+KEYWORD_STOP_WORDS = [
+    "после", "когда", "очень", "просто", "нужно", "надо", "есть", "если", "чтобы", "тоже", "меня", "него",
+    "сразу", "потом", "иногда", "почему", "который", "которая", "которые", "пожалуйста", "здравствуйте",
+    "добрый", "спасибо", "this", "that", "with",
+]
+
+REQUEST_KEYWORDS_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION request_keywords(problem TEXT) RETURNS SETOF TEXT
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT DISTINCT lower(word)
+        FROM regexp_split_to_table(coalesce(problem, ''), '[^0-9A-Za-zА-ЯЁа-яё]+') AS word
+        WHERE length(word) >= %(min_length)s AND lower(word) <> ALL (%(stop_words)s::text[])
+    $$
+"""
+
+REQUEST_STATS_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION request_stats_{op}() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO request_stats_daily AS s (day, source, count)
+        SELECT created_at::date, coalesce(source, 'unknown'), {sign} count(*) FROM {rows} GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (day, source) DO UPDATE SET count = s.count + EXCLUDED.count;
+
+        INSERT INTO request_keyword_stats AS k (keyword, count)
+        SELECT word, {sign} count(*) FROM {rows}, request_keywords(problem) AS word GROUP BY word ORDER BY word
+        ON CONFLICT (keyword) DO UPDATE SET count = k.count + EXCLUDED.count;
+
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM request_stats_daily WHERE count <= 0;
+            DELETE FROM request_keyword_stats WHERE count <= 0;
+        END IF;
+        RETURN NULL;
+    END $$
+"""
+
+stats_cache = {"loaded_at": 0.0, "data": None}
+stats_cache_lock = threading.Lock()
+
+
+def init_stats_tables(cur):
+    """Сводки по дням/источникам и по словам из описаний, триггеры на requests и первичное заполнение."""
+    cur.execute("SELECT to_regclass('public.request_stats_daily') IS NULL AS missing")
+    backfill = cur.fetchone()["missing"]
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS request_stats_daily (
+            day DATE NOT NULL,
+            source TEXT NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (day, source)
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS request_keyword_stats (
+            keyword TEXT PRIMARY KEY,
+            count BIGINT NOT NULL
+        );
+    """)
+    cur.execute(REQUEST_KEYWORDS_FUNCTION_SQL, {"min_length": KEYWORD_MIN_LENGTH, "stop_words": KEYWORD_STOP_WORDS})
+    cur.execute(REQUEST_STATS_FUNCTION_SQL.format(op="insert", sign="", rows="new_rows"))
+    cur.execute(REQUEST_STATS_FUNCTION_SQL.format(op="delete", sign="-", rows="old_rows"))
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION request_stats_truncate() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            TRUNCATE request_stats_daily, request_keyword_stats;
+            RETURN NULL;
+        END $$
+    """)
+
+    # Заявки в приложении не редактируются, поэтому UPDATE сводки не трогает
+    cur.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = 'requests'::regclass AND tgname LIKE 'request_stats_%'")
+    existing = {row["tgname"] for row in cur.fetchall()}
+    if backfill:
+        # Пока пересчитываем сводки по уже накопленным заявкам, новые вставки ждут
+        cur.execute("LOCK TABLE requests IN SHARE ROW EXCLUSIVE MODE")
+    triggers = {
+        "request_stats_insert": "AFTER INSERT ON requests REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT",
+        "request_stats_delete": "AFTER DELETE ON requests REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT",
+        "request_stats_truncate": "AFTER TRUNCATE ON requests FOR EACH STATEMENT",
+    }
+    for name, event in triggers.items():
+        if name not in existing:
+            cur.execute(f"CREATE TRIGGER {name} {event} EXECUTE FUNCTION {name}()")
+
+    if backfill:
+        cur.execute("""
+            INSERT INTO request_stats_daily (day, source, count)
+            SELECT created_at::date, coalesce(source, 'unknown'), count(*) FROM requests GROUP BY 1, 2
+        """)
+        cur.execute("""
+            INSERT INTO request_keyword_stats (keyword, count)
+            SELECT word, count(*) FROM requests, request_keywords(problem) AS word GROUP BY word
+        """)
+        log_event("stats_backfilled", "✅ Сводки статистики заполнены по существующим заявкам")
+
+
+# (ключ, SQL, параметры, все строки?) — общие для синхронного и асинхронного режимов
+DASHBOARD_QUERIES = [
+    ("totals", """
+        SELECT
+            coalesce(sum(count) FILTER (WHERE day = CURRENT_DATE), 0)::bigint AS today,
+            coalesce(sum(count) FILTER (WHERE day = CURRENT_DATE - 1), 0)::bigint AS yesterday,
+            coalesce(sum(count) FILTER (WHERE day > CURRENT_DATE - 7), 0)::bigint AS week,
+            coalesce(sum(count) FILTER (WHERE day > CURRENT_DATE - 30), 0)::bigint AS month,
+            coalesce(sum(count), 0)::bigint AS total
+        FROM request_stats_daily
+    """, None, False),
+    ("sources", """
+        SELECT source, sum(count)::bigint AS count FROM request_stats_daily
+        WHERE day > CURRENT_DATE - 30
+        GROUP BY source ORDER BY count DESC
+    """, None, True),
+    ("days", """
+        SELECT d::date AS day, coalesce(sum(s.count), 0)::bigint AS count
+        FROM generate_series(CURRENT_DATE - 6, CURRENT_DATE, interval '1 day') AS d
+        LEFT JOIN request_stats_daily s ON s.day = d::date
+        GROUP BY 1 ORDER BY 1 DESC
+    """, None, True),
+    ("weeks", """
+        SELECT date_trunc('week', day)::date AS week, sum(count)::bigint AS count
+        FROM request_stats_daily
+        WHERE day >= date_trunc('week', CURRENT_DATE)::date - 49
+        GROUP BY 1 ORDER BY 1 DESC
+    """, None, True),
+    ("keywords", """
+        SELECT keyword, count FROM request_keyword_stats
+        ORDER BY count DESC, keyword LIMIT %s
+    """, (STATS_TOP_KEYWORDS,), True),
+]
+
+
+async def dashboard_stats(io):
+    with stats_cache_lock:
+        if stats_cache["data"] is not None and time.monotonic() - stats_cache["loaded_at"] < STATS_CACHE_TTL:
+            return stats_cache["data"]
+    results = await io.queries([(sql, params, many) for _, sql, params, many in DASHBOARD_QUERIES])
+    data = {key: result for (key, _, _, _), result in zip(DASHBOARD_QUERIES, results)}
+    data["generated_at"] = datetime.now()
+    with stats_cache_lock:
+        stats_cache.update(loaded_at=time.monotonic(), data=data)
+    return data
+
+
+def invalidate_stats_cache():
+    with stats_cache_lock:
+        stats_cache.update(loaded_at=0.0, data=None)
+
+
+def render_dashboard(data):
+    totals = data["totals"]
+    lines = [
+        "📊 Статистика заявок",
+        f"Сегодня: {totals['today']} · Вчера: {totals['yesterday']}",
+        f"7 дней: {totals['week']} · 30 дней: {totals['month']} · Всего: {totals['total']}",
+        "",
+        "📥 По источникам за 30 дней:",
+    ]
+    lines += [f"• {row['source']} — {row['count']}" for row in data["sources"]] or ["• заявок не было"]
+    lines += ["", "📅 По дням:"]
+    lines += [f"• {row['day'].strftime('%d.%m')} — {row['count']}" for row in data["days"]]
+    lines += ["", "🗓 По неделям:"]
+    lines += [
+        f"• {row['week'].strftime('%d.%m')}–{(row['week'] + timedelta(days=6)).strftime('%d.%m')} — {row['count']}"
+        for row in data["weeks"]
+    ] or ["• заявок не было"]
+    lines += ["", "🔑 Частые слова в описаниях:"]
+    lines += [f"{i}. {row['keyword']} — {row['count']}" for i, row in enumerate(data["keywords"], 1)] or ["• пока нет"]
+    lines += ["", f"🕒 Данные на {data['generated_at'].strftime('%H:%M:%S')}"]
+    return "\n".join(lines)
+
+
+@instrumented
+async def show_stats(io, message):
+    try:
+        await io.send(message.chat.id, render_dashboard(await dashboard_stats(io)))
+    except Exception as e:
+        await io.send(message.chat.id, f"❌ Ошибка при получении статистики: {e}")
+
+
+
+# === Админ: экспорт в Excel / CSV ===
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024  # бот не может отправить файл больше 50 МБ
+EXPORT_HEADER = ["ID", "Имя", "Телефон", "Проблема", "Дата", "Источник"]
+
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+active_exports = set()
+active_exports_lock = threading.Lock()
+
+
+EXPORT_FILTER_PREFIXES = {"тел", "телефон", "phone", "с", "от", "from", "по", "до", "to", "источник", "source"}
+EXPORT_TEXT_PREFIXES = {"текст", "text"}
+EXPORT_SKIP_WORDS = {"📤", "в", "excel", "xlsx"}
+EXPORT_USAGE = (
+    "Формат: экспорт [csv] [с:01.10.2025] [по:17.10.2025] [тел:7064] [источник:site] [текст:слово]"
+)
+
+
+def parse_export_command(text):
+    """«экспорт csv с:01.10.2025 источник:site» → ("csv", фильтры). Кнопки дают выгрузку без фильтров.
+
+    Незнакомое слово — ошибка, а не поиск по тексту: опечатка в фильтре не должна молча сузить выгрузку.
+    """
+    export_format = "xlsx"
+    filters = []
+    text_words = []
+    for word in text.split():
+        lowered = word.lower()
+        prefix, sep, value = lowered.partition(":")
+        if lowered in ("csv", "csv.gz"):
+            export_format = "csv"
+        elif "экспорт" in lowered or lowered in EXPORT_SKIP_WORDS:
+            continue
+        elif sep and value and prefix in EXPORT_FILTER_PREFIXES:
+            filters.append(word)
+        elif sep and value and prefix in EXPORT_TEXT_PREFIXES:
+            text_words.append(word.partition(":")[2])
+        else:
+            raise ValueError(f"Непонятное слово «{word}».\n{EXPORT_USAGE}")
+    query = parse_search_query(" ".join(filters))
+    if text_words:
+        query["text"] = " ".join(text_words)
+    return export_format, query
+
+
+def iter_export_rows(conn, query):
+    conditions, params = build_request_filter(query)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Серверный курсор: строки приходят порциями по EXPORT_ITERSIZE, а не всей таблицей сразу
+    with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+        cur.itersize = EXPORT_ITERSIZE
+        cur.execute(f"""
+            SELECT id, name, phone, problem, created_at, source
+            FROM requests
+            {where}
+            ORDER BY created_at DESC, id DESC
+        """, params)
+        for row in cur:
+            yield [row["id"], row["name"], row["phone"], row["problem"], str(row["created_at"]), row["source"]]
+
+
+def write_xlsx(path, rows, progress):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Заявки")
+    ws.append(EXPORT_HEADER)
+    done = 0
+    for done, row in enumerate(rows, 1):
+        ws.append(row)
+        progress(done)
+    wb.save(path)
+    return done
+
+
+def write_csv_gz(path, rows, progress):
+    # utf-8-sig — чтобы Excel правильно открыл кириллицу
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(EXPORT_HEADER)
+        done = 0
+        for done, row in enumerate(rows, 1):
+            writer.writerow(row)
+            progress(done)
+    return done
+
+
+def run_export(chat_id, export_format, query):
+    suffix = ".xlsx" if export_format == "xlsx" else ".csv.gz"
+    path = None
+    try:
+        status = bot.send_message(chat_id, "⏳ Готовлю выгрузку…")
+        fd, path = tempfile.mkstemp(prefix="requests_", suffix=suffix)
+        os.close(fd)
+        last_report = [time.monotonic()]
+
+        def progress(done):
+            now = time.monotonic()
+            if now - last_report[0] >= EXPORT_PROGRESS_INTERVAL:
+                last_report[0] = now
+                try:
+                    bot.edit_message_text(f"⏳ Выгружено {done} строк…", chat_id, status.message_id)
+                except Exception as e:
+                    # Прогресс — только подсказка: 429 или удалённое сообщение не должны обрывать выгрузку
+                    log_event("export_progress_failed", "⚠️ Не удалось обновить прогресс выгрузки", logging.WARNING,
+                              error=str(e))
+
+        # Строки считаются по ходу выгрузки: отдельный count(*) прочитал бы те же данные второй раз
+        writer = write_xlsx if export_format == "xlsx" else write_csv_gz
+        with get_db_connection() as conn:
+            total = writer(path, iter_export_rows(conn, query), progress)
+        if not total:
+            bot.edit_message_text("📭 Нет данных для экспорта.", chat_id, status.message_id)
+            return
 
+        size = os.path.getsize(path)
+        if size > TELEGRAM_DOCUMENT_LIMIT:
+            bot.edit_message_text(
+                f"⚠️ Файл получился {size // (1024 * 1024)} МБ — больше лимита Telegram. "
+                f"Сузьте выгрузку фильтрами, например: экспорт csv с:01.10.2025 по:17.10.2025",
+                chat_id,
+                status.message_id,
+            )
+            return
+
+        file_name = f"requests_{datetime.now().strftime('%Y%m%d_%H%M')}{suffix}"
+        caption = "📤 Заявки экспортированы в Excel!" if export_format == "xlsx" else "📤 Заявки экспортированы в CSV (gzip)!"
+        with open(path, "rb") as file:
+            bot.send_document(chat_id, file, caption=f"{caption}\nСтрок: {total}", visible_file_name=file_name)
+        bot.delete_message(chat_id, status.message_id)
+    except Exception as e:
+        log_event("export_failed", "❌ Ошибка при экспорте", logging.ERROR, error=str(e))
+        bot.send_message(chat_id, f"❌ Ошибка при экспорте: {e}")
+    finally:
+        # Что бы ни случилось выше, админ должен иметь возможность запустить выгрузку снова
+        with active_exports_lock:
+            active_exports.discard(chat_id)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def queue_export(chat_id, text):
+    """Ставит выгрузку по команде text в очередь; возвращает ответ админу, если выгрузка не началась."""
+    try:
+        export_format, query = parse_export_command(text)
+    except ValueError as e:
+        return f"⚠️ {e}"
+
+    with active_exports_lock:
+        if chat_id in active_exports:
+            return "⏳ Предыдущая выгрузка ещё не закончилась."
+        active_exports.add(chat_id)
+
+    # Выгрузка идёт в отдельном потоке и не держит обработчик бота
+    export_executor.submit(run_export, chat_id, export_format, query)
+    return None
+
+
+@instrumented
+async def export_to_excel(io, message):
+    reply = queue_export(message.chat.id, message.text)
+    if reply:
+        await io.send(message.chat.id, reply)
+
+
+
+# === Секции requests по месяцам created_at и архив ===
+# Секции без DEFAULT: она отключает упорядоченный обход секций и мешает создавать новые,
+# поэтому секции заводятся заранее на REQUESTS_PARTITIONS_AHEAD месяцев и досоздаются в фоне.
+REQUEST_PARTITION_RE = re.compile(r"^requests_p(\d{4})_(\d{2})$")
+PARTITION_LOCK_KEY = 0x0C5E_0018  # pg_advisory_xact_lock: архивом и удалением секций занят один процесс
+
+ENSURE_PARTITIONS_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION ensure_request_partitions(from_ts TIMESTAMP, to_ts TIMESTAMP) RETURNS INT
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        part_month DATE := date_trunc('month', from_ts)::date;
+        part_name TEXT;
+        created INT := 0;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('ensure_request_partitions'));
+        WHILE part_month <= to_ts LOOP
+            part_name := 'requests_p' || to_char(part_month, 'YYYY_MM');
+            IF to_regclass(part_name) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF requests FOR VALUES FROM (%L) TO (%L)',
+                               part_name, part_month, (part_month + interval '1 month')::date);
+                created := created + 1;
+            END IF;
+            part_month := (part_month + interval '1 month')::date;
+        END LOOP;
+        RETURN created;
+    END $$
+"""
+
+
+def init_requests_table(cur):
+    """Секционированная requests; обычную таблицу из прошлых версий переносит один раз."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.requests')")
+    row = cur.fetchone()
+    legacy = row is not None and row["relkind"] != "p"
+    if row is None or legacy:
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS requests_id_seq")
+        if legacy:
+            cur.execute("LOCK TABLE requests IN ACCESS EXCLUSIVE MODE")
+            cur.execute("ALTER SEQUENCE requests_id_seq AS BIGINT OWNED BY NONE")
+            cur.execute("ALTER TABLE requests RENAME TO requests_legacy")
+        # Уникальность в секционированной таблице возможна только вместе с ключом секционирования
+        cur.execute("""
+            CREATE TABLE requests (
+                id BIGINT NOT NULL DEFAULT nextval('requests_id_seq'),
+                name TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                problem TEXT,
+                source TEXT DEFAULT 'unknown',
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                CONSTRAINT requests_id_created_at_pkey PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        """)
+        cur.execute("ALTER SEQUENCE requests_id_seq OWNED BY requests.id")
+    cur.execute(ENSURE_PARTITIONS_FUNCTION_SQL)
+
+    oldest = None
+    if legacy:
+        cur.execute("SELECT min(created_at) AS oldest FROM requests_legacy")
+        oldest = cur.fetchone()["oldest"]
+    cur.execute(
+        "SELECT ensure_request_partitions(coalesce(%s, CURRENT_TIMESTAMP), CURRENT_TIMESTAMP + %s * interval '1 month')",
+        (oldest, REQUESTS_PARTITIONS_AHEAD),
+    )
+    if legacy:
+        cur.execute("""
+            INSERT INTO requests (id, name, phone, problem, source, created_at)
+            SELECT id, name, phone, problem, source, coalesce(created_at, CURRENT_TIMESTAMP) FROM requests_legacy
+        """)
+        moved = cur.rowcount
+        cur.execute("DROP TABLE requests_legacy")
+        log_event("requests_partitioned", "✅ Таблица requests переведена на секции по месяцам", rows=moved)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def request_partitions(cur):
+    """Месячные секции requests по возрастанию: [(имя, первый день, первый день следующего месяца)]."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'requests'::regclass
+    """)
+    partitions = []
+    for row in cur.fetchall():
+        match = REQUEST_PARTITION_RE.match(row["relname"])
+        if match:
+            start = date(int(match[1]), int(match[2]), 1)
+            partitions.append((row["relname"], start, next_month(start)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def lock_partition(cur, name):
+    """Берёт блокировку обслуживания секций; False — секцией уже занят другой процесс или её нет."""
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (PARTITION_LOCK_KEY,))
+    if not cur.fetchone()["locked"]:
+        return False
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+    return cur.fetchone()["present"]
+
+
+def drop_partition(cur, name, start, end):
+    """Отцепляет и удаляет секцию целиком; сводки статистики уменьшаются на её строки."""
+    # Имя секции проверено REQUEST_PARTITION_RE, поэтому его можно подставлять в SQL.
+    # В старую секцию никто не пишет: SHARE не даёт это сделать и не мешает чтению, пока идёт
+    # полный проход по ней ради сводок. requests в это время открыта для вставок и выборок
+    cur.execute(f"LOCK TABLE {name} IN SHARE MODE")
+    cur.execute(f"SELECT count(*) AS total FROM {name}")
+    total = cur.fetchone()["total"]
+    cur.execute(f"""
+        SELECT word, -count(*) AS delta FROM {name}, request_keywords(problem) AS word
+        GROUP BY word ORDER BY word
+    """)
+    keyword_deltas = [(row["word"], row["delta"]) for row in cur.fetchall()]
+
+    # Родитель блокируется только на правку сводок, DETACH и DROP — без сканирования данных
+    cur.execute("LOCK TABLE ONLY requests IN ACCESS EXCLUSIVE MODE")
+    # DETACH и DROP не вызывают триггеры DELETE, поэтому сводки правим сами
+    cur.execute("DELETE FROM request_stats_daily WHERE day >= %s AND day < %s", (start, end))
+    if keyword_deltas:
+        execute_values(cur, """
+            INSERT INTO request_keyword_stats AS k (keyword, count) VALUES %s
+            ON CONFLICT (keyword) DO UPDATE SET count = k.count + EXCLUDED.count
+        """, keyword_deltas)
+        cur.execute("DELETE FROM request_keyword_stats WHERE count <= 0")
+    cur.execute(f"ALTER TABLE requests DETACH PARTITION {name}")
+    cur.execute(f"DROP TABLE {name}")
+    return total
+
+
+def archive_partition(name, start, end):
+    """Выгружает секцию в REQUESTS_ARCHIVE_DIR/<секция>.csv.gz и удаляет её; файл отправляется админу."""
+    archive_dir = os.path.join(BASE_DIR, REQUESTS_ARCHIVE_DIR)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp_path = path + ".tmp"
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            if not lock_partition(cur, name):
+                return None
+            # Читаем саму секцию, а не родителя: долгий COPY не держит блокировку на requests
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as file:
+                cur.copy_expert(f"""
+                    COPY (
+                        SELECT id, name, phone, problem, created_at, source FROM {name} ORDER BY id
+                    ) TO STDOUT WITH (FORMAT csv, HEADER)
+                """, file)
+            # Секция удаляется, только когда архив уже лежит на диске целиком
+            os.replace(tmp_path, path)
+            total = drop_partition(cur, name, start, end)
+            conn.commit()
+    invalidate_stats_cache()
+    log_event("partition_archived", "📦 Секция заявок заархивирована", partition=name, rows=total, path=path)
+
+    if os.path.getsize(path) <= TELEGRAM_DOCUMENT_LIMIT:
+        try:
+            with open(path, "rb") as file:
+                bot.send_document(ADMIN_ID, file, caption=f"📦 Архив заявок за {start.strftime('%m.%Y')}\nСтрок: {total}")
+        except Exception as e:
+            log_event("partition_archive_send_failed", "⚠️ Архив не отправлен админу", logging.WARNING,
+                      partition=name, error=str(e))
+    return total
 
 
-# === Админ: экспорт в Excel ===
-@bot.message_handler(func=lambda m: is_admin(m) and "экспорт" in m.text.lower())
-def export_to_excel(message):
+def maintain_request_partitions():
+    """Досоздаёт секции на будущие месяцы и архивирует те, что старше REQUESTS_ARCHIVE_AFTER_DAYS."""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, name, phone, problem, created_at, source FROM requests ORDER BY id DESC")
-            rows = cur.fetchall()
+            cur.execute(
+                "SELECT ensure_request_partitions(CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * interval '1 month') AS created",
+                (REQUESTS_PARTITIONS_AHEAD,),
+            )
+            created = cur.fetchone()["created"]
+            partitions = request_partitions(cur)
+            conn.commit()
+    if created:
+        log_event("partitions_created", "✅ Созданы секции заявок", created=created)
 
-    if not rows:
-        bot.send_message(message.chat.id, "📭 Нет данных для экспорта.")
-        return
+    if REQUESTS_ARCHIVE_AFTER_DAYS > 0:
+        cutoff = date.today() - timedelta(days=REQUESTS_ARCHIVE_AFTER_DAYS)
+        for name, start, end in partitions:
+            if end <= cutoff:
+                archive_partition(name, start, end)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Заявки"
-    ws.append(["ID", "Имя", "Телефон", "Проблема", "Дата", "Источник"])
 
-    for row in rows:
-        ws.append([row["id"], row["name"], row["phone"], row["problem"], str(row["created_at"]), row["source"]])
+def partition_maintainer():
+    while True:
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            maintain_request_partitions()
+        except Exception as e:
+            log_event("partition_maintenance_failed", "❌ Ошибка обслуживания секций заявок", logging.ERROR, error=str(e))
 
-    file_path = os.path.join(os.path.dirname(__file__), "requests.xlsx")
-    wb.save(file_path)
 
-    with open(file_path, "rb") as file:
-        bot.send_document(message.chat.id, file, caption="📤 Все заявки экспортированы в Excel!")
+def clear_requests_older_than(days):
+    """Удаляет заявки старше days дней: целые секции — DROP, остаток — DELETE порциями по CLEAR_BATCH_SIZE."""
+    cutoff = datetime.now() - timedelta(days=days)
+    removed = 0
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for name, start, end in request_partitions(cur):
+                if end <= cutoff.date() and lock_partition(cur, name):
+                    removed += drop_partition(cur, name, start, end)
+                    conn.commit()
+        # Короткие транзакции: autovacuum успевает за удалением, вставки не ждут
+        while True:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM requests WHERE (id, created_at) IN (
+                        SELECT id, created_at FROM requests WHERE created_at < %s ORDER BY created_at LIMIT %s
+                    )
+                """, (cutoff, CLEAR_BATCH_SIZE))
+                deleted = cur.rowcount
+            conn.commit()
+            removed += deleted
+            if deleted < CLEAR_BATCH_SIZE:
+                break
+    invalidate_stats_cache()
+    return removed
 
 
+def run_clear_older(chat_id, days):
+    try:
+        status = bot.send_message(chat_id, f"⏳ Удаляю заявки старше {days} дн.…")
+        removed = clear_requests_older_than(days)
+        bot.edit_message_text(f"🧹 Удалено заявок старше {days} дн.: {removed}", chat_id, status.message_id)
+        log_event("requests_cleared_older", "🧹 Удалены старые заявки", days=days, removed=removed)
+    except Exception as e:
+        log_event("requests_clear_failed", "❌ Ошибка при удалении старых заявок", logging.ERROR, error=str(e))
+        bot.send_message(chat_id, f"❌ Ошибка при удалении: {e}")
+
 
 # === Админ: очистка базы ===
-@bot.message_handler(func=lambda m: is_admin(m) and "очист" in m.text.lower())
-def clear_database(message):
+CLEAR_OLDER_RE = re.compile(r"старше\s+(\d+)")
+
+
+def clear_prompt(text):
+    """Вопрос с кнопками подтверждения: «очистить старше 90» — только старые заявки, кнопка — вся база."""
+    match = CLEAR_OLDER_RE.search((text or "").lower())
     markup = types.InlineKeyboardMarkup()
+    if match:
+        days = int(match[1])
+        markup.add(
+            types.InlineKeyboardButton("✅ Да, удалить", callback_data=f"clear_older:{days}"),
+            types.InlineKeyboardButton("❌ Нет", callback_data="cancel_clear")
+        )
+        return f"⚠️ Удалить заявки старше {days} дн.?", markup
+
     markup.add(
         types.InlineKeyboardButton("✅ Да, удалить всё", callback_data="confirm_clear"),
         types.InlineKeyboardButton("❌ Нет", callback_data="cancel_clear")
     )
-    bot.send_message(message.chat.id, "⚠️ Вы уверены, что хотите очистить базу заявок?", reply_markup=markup)
+    return (
+        "⚠️ Вы уверены, что хотите очистить базу заявок?\n\n"
+        "Чтобы удалить только старые заявки, напишите: очистить старше 90"
+    ), markup
+
 
+@instrumented
+async def clear_database(io, message):
+    text, markup = clear_prompt(message.text)
+    await io.send(message.chat.id, text, reply_markup=markup)
+
+
+@bot_handler("callback_query", func=lambda call: call.data in ["confirm_clear", "cancel_clear"] or call.data.startswith("clear_older:"))
+@instrumented
+async def clear_callback(io, call):
+    if call.message.chat.id != ADMIN_ID:
+        await io.answer_callback(call.id, "⛔ Нет доступа.")
+        return
 
-@bot.callback_query_handler(func=lambda call: call.data in ["confirm_clear", "cancel_clear"])
-def clear_callback(call):
     if call.data == "confirm_clear":
+        # TRUNCATE освобождает место сразу и не оставляет мёртвых строк, в отличие от DELETE всей таблицы
+        await io.execute("TRUNCATE requests")
+        invalidate_stats_cache()
+        await io.send(call.message.chat.id, "🧹 Все заявки успешно удалены!")
+    elif call.data.startswith("clear_older:"):
+        days = int(call.data.split(":", 1)[1])
+        # Удаление порциями может идти долго — не держим обработчик бота
+        export_executor.submit(run_clear_older, call.message.chat.id, days)
+    else:
+        await io.send(call.message.chat.id, "❌ Отмена очистки базы.")
+    await io.answer_callback(call.id)
+
+
+# === Админ: возврат в главное меню ===
+@instrumented
+async def admin_to_main_menu(io, message):
+    await io.send(message.chat.id, MAIN_MENU_TEXT, reply_markup=main_menu())
+
+
+# === Кэш file_id для фото: Telegram хранит файл, мы шлём только ссылку на него ===
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+TELEGRAM_ALBUM_LIMIT = 10
+SERVICE_PHOTO_CAPTION = "📸 Наш уютный сервисный центр!\nСовременное оборудование и опытные мастера 👨‍🔧"
+
+
+class MediaCache:
+    """Помнит file_id, который Telegram вернул после загрузки; при изменении файла (sha256) загружает заново."""
+
+    def __init__(self):
+        self._hashes = {}  # path -> (mtime, size, sha256): пересчитываем хэш только при изменении файла
+        self._file_ids = {}  # path -> (sha256, file_id)
+        self._lock = threading.Lock()
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[:2] == signature:
+            return cached[2]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._hashes[path] = signature + (digest,)
+        return digest
+
+    def lookup(self, path, digest):
+        key = os.path.relpath(path, BASE_DIR)
+        with self._lock:
+            cached = self._file_ids.get(key)
+        if cached is None:
+            try:
+                with get_db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT sha256, file_id FROM media_cache WHERE path = %s", (key,))
+                        row = cur.fetchone()
+            except (psycopg2.Error, pg_pool.PoolError) as e:
+                # Без кэша просто загрузим файл ещё раз
+                log_event("media_cache_unavailable", "⚠️ Кэш фото недоступен", logging.WARNING, error=str(e))
+                return None
+            if row is None:
+                return None
+            cached = (row["sha256"], row["file_id"])
+            with self._lock:
+                self._file_ids[key] = cached
+        return cached[1] if cached[0] == digest else None
+
+    def store(self, path, digest, file_id):
+        key = os.path.relpath(path, BASE_DIR)
+        with self._lock:
+            if self._file_ids.get(key) == (digest, file_id):
+                return
+            self._file_ids[key] = (digest, file_id)
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM requests")
+                cur.execute("""
+                    INSERT INTO media_cache (path, sha256, file_id, updated_at)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (path) DO UPDATE
+                    SET sha256 = EXCLUDED.sha256, file_id = EXCLUDED.file_id, updated_at = EXCLUDED.updated_at
+                """, (key, digest, file_id))
                 conn.commit()
-        bot.send_message(call.message.chat.id, "🧹 Все заявки успешно удалены!")
-    else:
-        bot.send_message(call.message.chat.id, "❌ Отмена очистки базы.")
 
- # === Админ: возврат в главное меню ===
-@bot.message_handler(func=lambda m: is_admin(m) and "главное меню" in m.text.lower())
-def admin_to_main_menu(message):
-    bot.send_message(
-        message.chat.id,
-        "🏠 Возвращаемся в главное меню.",
-        reply_markup=main_menu()
-    )
+    def forget(self, path):
+        key = os.path.relpath(path, BASE_DIR)
+        with self._lock:
+            self._file_ids.pop(key, None)
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM media_cache WHERE path = %s", (key,))
+                conn.commit()
+
+    def _send(self, chat_id, items, caption, reply_markup):
+        """items — список (path, digest, file_id или None). Возвращает сообщения Telegram."""
+        files = []
+        try:
+            sources = []
+            for path, _, file_id in items:
+                if file_id is None:
+                    f = open(path, "rb")
+                    files.append(f)
+                    sources.append(f)
+                else:
+                    sources.append(file_id)
+            if len(sources) == 1:
+                return [bot.send_photo(chat_id, sources[0], caption=caption, reply_markup=reply_markup)]
+            media = [
+                types.InputMediaPhoto(source, caption=caption if i == 0 else None)
+                for i, source in enumerate(sources)
+            ]
+            return bot.send_media_group(chat_id, media)
+        finally:
+            for f in files:
+                f.close()
+
+    def send_photos(self, chat_id, paths, caption=None, reply_markup=None):
+        items = []
+        for path in paths[:TELEGRAM_ALBUM_LIMIT]:
+            digest = self.file_hash(path)
+            items.append((path, digest, self.lookup(path, digest)))
+
+        try:
+            messages = self._send(chat_id, items, caption, reply_markup)
+        except ApiTelegramException as e:
+            # file_id мог стать недействительным (например, сменили бота) — загружаем файлы заново
+            if e.error_code != 400 or all(file_id is None for _, _, file_id in items):
+                raise
+            for path, _, file_id in items:
+                if file_id is not None:
+                    self.forget(path)
+            items = [(path, digest, None) for path, digest, _ in items]
+            messages = self._send(chat_id, items, caption, reply_markup)
+
+        try:
+            for (path, digest, _), sent in zip(items, messages):
+                if sent.photo:
+                    self.store(path, digest, sent.photo[-1].file_id)
+        except (psycopg2.Error, pg_pool.PoolError) as e:
+            log_event("media_cache_store_failed", "⚠️ Не удалось сохранить file_id фото", logging.WARNING, error=str(e))
+
+
+media_cache = MediaCache()
+
+
+def service_photo_paths():
+    if not os.path.isdir(PHOTOS_DIR):
+        return []
+    return [
+        os.path.join(PHOTOS_DIR, name)
+        for name in sorted(os.listdir(PHOTOS_DIR))
+        if name.lower().endswith(PHOTO_EXTENSIONS)
+    ]
 
 
 # === Пользовательские функции ===
-def get_name(message):
+@instrumented
+async def get_name(io, message):
     user_name = message.text
-    bot.send_message(message.chat.id, "📞 Укажите ваш номер телефона:")
-    bot.register_next_step_handler(message, get_phone, user_name)
+    await io.send(message.chat.id, FORM_PHONE_PROMPT)
+    await io.next_step(message, get_phone, user_name)
 
 
-def get_phone(message, user_name):
+@instrumented
+async def get_phone(io, message, user_name):
     phone = message.text
-    bot.send_message(message.chat.id, "🔧 Опишите кратко проблему с компьютером:")
-    bot.register_next_step_handler(message, get_problem, user_name, phone)
+    await io.send(message.chat.id, FORM_PROBLEM_PROMPT)
+    await io.next_step(message, get_problem, user_name, phone)
 
 
-def get_problem(message, user_name, phone):
-    problem = message.text
+def telegram_request_text(user_name, phone, problem):
     date = datetime.now().strftime("%Y-%m-%d %H:%M")
+    return (
+        f"📬 *Новая заявка из Telegram!*\n"
+        f"👤 Имя: {user_name}\n"
+        f"📞 Телефон: {phone}\n"
+        f"💬 Проблема: {problem}\n"
+        f"🕒 Время: {date}"
+    )
 
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO requests (name, phone, problem, source)
-                    VALUES (%s, %s, %s, %s)
-                """, (user_name, phone, problem, "telegram"))
-                conn.commit()
 
-        bot.send_message(
-            message.chat.id,
-            "✅ Ваша заявка сохранена! Наш мастер скоро свяжется с вами 💙",
-            reply_markup=main_menu()
-        )
+@instrumented
+async def get_problem(io, message, user_name, phone):
+    problem = message.text
 
-        bot.send_message(
-            ADMIN_ID,
-            f"📬 *Новая заявка из Telegram!*\n"
-            f"👤 Имя: {user_name}\n"
-            f"📞 Телефон: {phone}\n"
-            f"💬 Проблема: {problem}\n"
-            f"🕒 Время: {date}",
-            parse_mode="Markdown"
-        )
+    try:
+        await io.ingest(user_name, phone, problem, "telegram", telegram_request_text(user_name, phone, problem))
+
+        await io.send(message.chat.id, FORM_SAVED_TEXT, reply_markup=main_menu())
 
-        print(f"✅ Заявка из Telegram сохранена: {user_name}, {phone}, {problem}")
+        log_event("request_saved", "✅ Заявка из Telegram сохранена", source="telegram", name=user_name, phone=phone)
 
     except Exception as e:
-        print(f"❌ Ошибка при сохранении заявки из Telegram: {e}")
-        bot.send_message(
-            message.chat.id,
-            "⚠️ Произошла ошибка при сохранении заявки. Попробуйте позже 🙏",
-            reply_markup=main_menu()
-        )
+        log_event("request_failed", "❌ Ошибка при сохранении заявки из Telegram", logging.ERROR,
+                  source="telegram", error=str(e))
+        await io.send(message.chat.id, FORM_FAILED_TEXT, reply_markup=main_menu())
+
+
+
+# === Тексты диалогов (общие для синхронного и асинхронного режимов) ===
+START_TEXT = (
+    "👋 Привет! Я бот сервисного центра по ремонту компьютеров 💻\n\n"
+    "Я помогу вам узнать:\n"
+    "• О нашем сервисе\n"
+    "• Наши услуги и цены\n"
+    "• Как нас найти\n"
+    "• Время работы и контакты\n"
+    "• А также оставить заявку на ремонт ⚙️"
+)
+NO_ACCESS_TEXT = "⛔ У вас нет доступа к этой команде."
+ADMIN_PANEL_TEXT = "🛠 Добро пожаловать в панель администратора.\n\nВыберите действие:"
+SEARCH_HELP_TEXT = (
+    "🔍 Введите имя, часть телефона или описание проблемы.\n\n"
+    "Можно добавить фильтры:\n"
+    "• тел:7064 — по цифрам телефона\n"
+    "• с:01.10.2025 по:17.10.2025 — по дате\n"
+    "• источник:site или источник:telegram"
+)
+MAIN_MENU_TEXT = "🏠 Возвращаемся в главное меню."
+FORM_NAME_PROMPT = "📝 Отлично! Давайте оформим заявку. Как вас зовут?"
+FORM_PHONE_PROMPT = "📞 Укажите ваш номер телефона:"
+FORM_PROBLEM_PROMPT = "🔧 Опишите кратко проблему с компьютером:"
+FORM_SAVED_TEXT = "✅ Ваша заявка сохранена! Наш мастер скоро свяжется с вами 💙"
+FORM_FAILED_TEXT = "⚠️ Произошла ошибка при сохранении заявки. Попробуйте позже 🙏"
+MAP_TEXT = "📍 Наш сервис здесь!"
+UNKNOWN_TEXT = "🤔 Я вас не понял. Выберите нужный раздел из меню 👇"
+
+
+# === Тексты разделов меню ===
+ABOUT_TEXT = (
+    "🧰 *О нашем сервисе*\n\n"
+    "Мы — профессиональный сервис по ремонту компьютеров и ноутбуков.\n"
+    "✅ Более 5 лет опыта\n"
+    "✅ Гарантия до 1 года\n"
+    "✅ Срочный ремонт за 1 час\n"
+    "✅ Бесплатная диагностика\n\n"
+    "💙 Надёжный сервис, которому доверяют тысячи клиентов!"
+)
+
+PRICES_TEXT = (
+    "💰 *Наши услуги и цены:*\n\n"
+    "1️⃣ Диагностика компьютера — *бесплатно*\n"
+    "2️⃣ Установка Windows / Linux / macOS — *от 10000 тенге*\n"
+    "3️⃣ Чистка от пыли + замена термопасты — *от 10000 тенге*\n"
+    "4️⃣ Прошивка BIOS — * от 6000 тенге*\n"
+    "5️⃣ Замена кулера, термопрокладок — *от 5000 тенге*\n"
+    "6️⃣ Восстановление данных с HDD / SSD — *от 12000 тенге ₽*\n"
+    "7️⃣ Замена экрана ноутбука — *от 10000 тенге*\n"
+    "8️⃣ Ремонт материнской платы — *от 15000 тенге*\n"
+    "9️⃣ Замена клавиатуры ноутбука — *от 5000 тенге*\n"
+    "🔟 Ремонт телевизоров — *от 5000 тенге*\n\n"
+    "1️⃣1️⃣ Ремонт электросамокатов - *от 5000 тенге*\n\n"
+    "1️⃣2️⃣ Ремонт смартфонов - *от 5000 тенге*\n\n "
+    "💡 Все работы выполняются с гарантией до 12 месяцев!"
+)
+
+ADDRESS_TEXT = (
+    "📍 *Адрес:* г. Уральск, проспект Нурсултана Назарбаева, 240/1\n"
+    "🚌 Остановка *Маншук Маметовой* — 5 минут пешком.\n\n"
+    "🗺 [Открыть в Яндекс.Картах](https://yandex.ru/maps/?text=Уральск, проспект Нурсултана Назарбаева, 240/1)"
+)
+
+HOURS_TEXT = "🕓 *Время работы:*\nПн–Сб: 10:00–19:00\nВс: 10:00–19:00"
+
+CONTACTS_TEXT = (
+    "📱 *Контакты сервисного центра:*\n\n"
+    "👨‍🔧 *Ок Service — ремонт компьютеров и ноутбуков*\n\n"
+    "📞 Телефон: +7 (706) 429-55-45\n"
+    "💬 WhatsApp: +7 (706) 429-55-45\n"
+    "✈️ Telegram: [@Fixuralsk](https://t.me/yourusername)\n"
+    "📸 Instagram: [@okservice_uralsk](https://instagram.com/okservice_uralsk)\n"
+    "🌍 Сайт: [pcservice.ru](https://pcservice.ru)\n\n"
+    "Выберите удобный способ связи 👇"
+)
+
+CONTACTS_MARKUP = types.InlineKeyboardMarkup(row_width=2)
+CONTACTS_MARKUP.add(
+    types.InlineKeyboardButton("📞 Позвонить", url="https://t.me/share/url?url=tel:+7064295545"),
+    types.InlineKeyboardButton("💬 WhatsApp", url="https://wa.me/7064295545"),
+    types.InlineKeyboardButton("✈️ Telegram", url="https://t.me/@Fixuralsk"),
+    types.InlineKeyboardButton("📸 Instagram", url="https://instagram.com/okservice_uralsk"),
+    types.InlineKeyboardButton("🌐 Сайт", url="https://okservice.onrender.com")
+)
+
+SERVICE_LOCATION = (51.221450, 51.363653)
+
+
+# === Разделы основного меню ===
+@instrumented
+async def show_about(io, message):
+    await io.send(message.chat.id, ABOUT_TEXT, parse_mode="Markdown", reply_markup=main_menu())
+
+
+@instrumented
+async def show_prices(io, message):
+    await io.send(message.chat.id, PRICES_TEXT, parse_mode="Markdown", reply_markup=main_menu())
+
+
+@instrumented
+async def show_photos(io, message):
+    try:
+        photo_paths = service_photo_paths()
+        if photo_paths:
+            # Повторно фото уходят по file_id, без загрузки файла в Telegram
+            await io.blocking(
+                media_cache.send_photos,
+                message.chat.id,
+                photo_paths,
+                caption=SERVICE_PHOTO_CAPTION,
+                reply_markup=main_menu()
+            )
+        else:
+            await io.send(message.chat.id, "⚠️ Фото не найдено в папке photos.", reply_markup=main_menu())
+    except Exception as e:
+        await io.send(message.chat.id, f"❌ Ошибка при отправке фото: {e}", reply_markup=main_menu())
 
 
+@instrumented
+async def show_address(io, message):
+    await io.send(
+        message.chat.id,
+        ADDRESS_TEXT,
+        parse_mode="Markdown",
+        disable_web_page_preview=False,
+        reply_markup=main_menu()
+    )
 
-# === Основное меню ===
-@bot.message_handler(content_types=['text'])
-def handle_text(message):
-    text = message.text.lower()
-
-    if "о сервисе" in text:
-        bot.send_message(
-            message.chat.id,
-            "🧰 *О нашем сервисе*\n\n"
-            "Мы — профессиональный сервис по ремонту компьютеров и ноутбуков.\n"
-            "✅ Более 5 лет опыта\n"
-            "✅ Гарантия до 1 года\n"
-            "✅ Срочный ремонт за 1 час\n"
-            "✅ Бесплатная диагностика\n\n"
-            "💙 Надёжный сервис, которому доверяют тысячи клиентов!",
-            parse_mode="Markdown",
-            reply_markup=main_menu()
-        )
 
-    elif "услуги" in text or "цены" in text:
-        bot.send_message(
-            message.chat.id,
-            "💰 *Наши услуги и цены:*\n\n"
-            "1️⃣ Диагностика компьютера — *бесплатно*\n"
-            "2️⃣ Установка Windows / Linux / macOS — *от 10000 тенге*\n"
-            "3️⃣ Чистка от пыли + замена термопасты — *от 10000 тенге*\n"
-            "4️⃣ Прошивка BIOS — * от 6000 тенге*\n"
-            "5️⃣ Замена кулера, термопрокладок — *от 5000 тенге*\n"
-            "6️⃣ Восстановление данных с HDD / SSD — *от 12000 тенге ₽*\n"
-            "7️⃣ Замена экрана ноутбука — *от 10000 тенге*\n"
-            "8️⃣ Ремонт материнской платы — *от 15000 тенге*\n"
-            "9️⃣ Замена клавиатуры ноутбука — *от 5000 тенге*\n"
-            "🔟 Ремонт телевизоров — *от 5000 тенге*\n\n"
-            "1️⃣1️⃣ Ремонт электросамокатов - *от 5000 тенге*\n\n"
-            "1️⃣2️⃣ Ремонт смартфонов - *от 5000 тенге*\n\n "
-            "💡 Все работы выполняются с гарантией до 12 месяцев!",
-            parse_mode="Markdown",
-            reply_markup=main_menu()
-        )
+@instrumented
+async def show_hours(io, message):
+    await io.send(message.chat.id, HOURS_TEXT, parse_mode="Markdown", reply_markup=main_menu())
 
-    elif "фото" in text:
-        try:
-            photo_path = os.path.join(os.path.dirname(__file__), "photos", "service_photo.jpg")
-            if os.path.exists(photo_path):
-                with open(photo_path, "rb") as photo:
-                    bot.send_photo(
-                        message.chat.id,
-                        photo,
-                        caption="📸 Наш уютный сервисный центр!\nСовременное оборудование и опытные мастера 👨‍🔧",
-                        reply_markup=main_menu()
-                    )
-            else:
-                bot.send_message(message.chat.id, "⚠️ Фото не найдено в папке photos.", reply_markup=main_menu())
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка при отправке фото: {e}", reply_markup=main_menu())
-
-    elif "как добраться" in text or "адрес" in text:
-        bot.send_message(
-            message.chat.id,
-            "📍 *Адрес:* г. Уральск, проспект Нурсултана Назарбаева, 240/1\n"
-            "🚌 Остановка *Маншук Маметовой* — 5 минут пешком.\n\n"
-            "🗺 [Открыть в Яндекс.Картах](https://yandex.ru/maps/?text=Уральск, проспект Нурсултана Назарбаева, 240/1)",
-            parse_mode="Markdown",
-            disable_web_page_preview=False,
-            reply_markup=main_menu()
-        )
 
-    elif "время работы" in text:
-        bot.send_message(
-            message.chat.id,
-            "🕓 *Время работы:*\nПн–Сб: 10:00–19:00\nВс: 10:00–19:00",
-            parse_mode="Markdown",
-            reply_markup=main_menu()
-        )
+@instrumented
+async def show_contacts(io, message):
+    await io.send(
+        message.chat.id,
+        CONTACTS_TEXT,
+        parse_mode="Markdown",
+        disable_web_page_preview=False,
+        reply_markup=CONTACTS_MARKUP
+    )
 
-    elif "связаться" in text or "контакт" in text:
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            types.InlineKeyboardButton("📞 Позвонить", url="https://t.me/share/url?url=tel:+7064295545"),
-            types.InlineKeyboardButton("💬 WhatsApp", url="https://wa.me/7064295545"),
-            types.InlineKeyboardButton("✈️ Telegram", url="https://t.me/@Fixuralsk"),
-            types.InlineKeyboardButton("📸 Instagram", url="https://instagram.com/okservice_uralsk"),
-            types.InlineKeyboardButton("🌐 Сайт", url="https://okservice.onrender.com")
-        )
 
-        bot.send_message(
-            message.chat.id,
-            "📱 *Контакты сервисного центра:*\n\n"
-            "👨‍🔧 *Ок Service — ремонт компьютеров и ноутбуков*\n\n"
-            "📞 Телефон: +7 (706) 429-55-45\n"
-            "💬 WhatsApp: +7 (706) 429-55-45\n"
-            "✈️ Telegram: [@Fixuralsk](https://t.me/yourusername)\n"
-            "📸 Instagram: [@okservice_uralsk](https://instagram.com/okservice_uralsk)\n"
-            "🌍 Сайт: [pcservice.ru](https://pcservice.ru)\n\n"
-            "Выберите удобный способ связи 👇",
-            parse_mode="Markdown",
-            disable_web_page_preview=False,
-            reply_markup=markup
-        )
+@instrumented
+async def show_map(io, message):
+    latitude, longitude = SERVICE_LOCATION
+    await io.send_location(message.chat.id, latitude, longitude)
+    await io.send(message.chat.id, MAP_TEXT, reply_markup=main_menu())
+
+
+@instrumented
+async def start_request_form(io, message):
+    await io.send(message.chat.id, FORM_NAME_PROMPT)
+    await io.next_step(message, get_name)
+
+
+@instrumented
+async def show_unknown(io, message):
+    await io.send(message.chat.id, UNKNOWN_TEXT, reply_markup=main_menu())
+
+
+# === Маршрутизация текстовых сообщений ===
+# Нажатие кнопки — точное совпадение текста, поиск в словаре за O(1).
+# Свободный текст проверяется одним скомпилированным выражением по ключевым словам.
+def normalize_route(text):
+    return " ".join(text.lower().split())
+
+
+def build_fallback(routes):
+    # Каждая ветка — просмотр вперёд от начала строки: побеждает первый по списку маршрут,
+    # чьё слово есть в тексте, а не слово, которое встретилось в тексте раньше (как в прежней цепочке elif)
+    pattern = "|".join(f"(?P<r{i}>(?=.*?(?:{keywords})))" for i, (keywords, _) in enumerate(routes))
+    return re.compile(f"^(?:{pattern})"), {f"r{i}": handler for i, (_, handler) in enumerate(routes)}
+
+
+def match_fallback(fallback, text):
+    regex, handlers = fallback
+    match = regex.match(text)
+    return handlers[match.lastgroup] if match else None
+
+
+MENU_ROUTES = {normalize_route(label): handler for label, handler in [
+    (BTN_ABOUT, show_about),
+    (BTN_PRICES, show_prices),
+    (BTN_PHOTOS, show_photos),
+    (BTN_ADDRESS, show_address),
+    (BTN_HOURS, show_hours),
+    (BTN_CONTACTS, show_contacts),
+    (BTN_MAP, show_map),
+    (BTN_REQUEST, start_request_form),
+]}
+
+MENU_FALLBACK = build_fallback([
+    ("о сервисе", show_about),
+    ("услуги|цены", show_prices),
+    ("фото", show_photos),
+    ("как добраться|адрес", show_address),
+    ("время работы", show_hours),
+    ("связаться|контакт", show_contacts),
+    ("карта|показать", show_map),
+    ("заявк|ремонт", start_request_form),
+])
+
+ADMIN_ROUTES = {normalize_route(label): handler for label, handler in [
+    (BTN_ALL_REQUESTS, show_all_requests),
+    (BTN_SEARCH, find_request_by_name),
+    (BTN_STATS, show_stats),
+    (BTN_EXPORT_XLSX, export_to_excel),
+    (BTN_EXPORT_CSV, export_to_excel),
+    (BTN_CLEAR, clear_database),
+    (BTN_MAIN_MENU, admin_to_main_menu),
+]}
+
+ADMIN_FALLBACK = build_fallback([
+    ("все заявки", show_all_requests),
+    ("найти", find_request_by_name),
+    ("статист", show_stats),
+    ("экспорт", export_to_excel),  # «экспорт csv с:01.10.2025 …» — выгрузка с фильтрами
+    ("очист", clear_database),
+    ("главное меню", admin_to_main_menu),
+])
 
 
+# === Основное меню ===
+@bot_handler("message", content_types=['text'])
+@instrumented
+async def handle_text(io, message):
+    text = normalize_route(message.text)
+
+    if is_admin(message):
+        handler = ADMIN_ROUTES.get(text) or match_fallback(ADMIN_FALLBACK, text)
+        if handler:
+            await handler(io, message)
+            return
 
-    elif "карта" in text or "показать" in text:
-        latitude = 51.221450
-        longitude = 51.363653
-        bot.send_location(message.chat.id, latitude, longitude)
-        bot.send_message(message.chat.id, "📍 Наш сервис здесь!", reply_markup=main_menu())
+    handler = MENU_ROUTES.get(text) or match_fallback(MENU_FALLBACK, text) or show_unknown
+    await handler(io, message)
 
-    elif "заявк" in text or "ремонт" in text:
-        bot.send_message(message.chat.id, "📝 Отлично! Давайте оформим заявку. Как вас зовут?")
-        bot.register_next_step_handler(message, get_name)
 
-    else:
-        bot.send_message(message.chat.id, "🤔 Я вас не понял. Выберите нужный раздел из меню 👇", reply_markup=main_menu())
+register_bot_handlers(bot, sync_handler)
 
 
 # === Запуск ===
@@ -485,5 +3414,10 @@ def handle_text(message):
     #bot.infinity_polling(timeout=60, long_polling_timeout=30)
 
 if __name__ == "__main__":
-    run_flask()
+    if RUNTIME == "async":
+        run_async()
+    elif SERVER == "gunicorn":
+        run_gunicorn()
+    else:
+        run_flask()
 
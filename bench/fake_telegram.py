@@ -0,0 +1,233 @@
+"""Локальный фейковый Telegram Bot API для нагрузочных тестов.
+
+Отвечает на методы, которые использует бот (sendMessage, sendPhoto, sendDocument, ...),
+записывает каждый вызов, может добавлять задержку и отвечать 429 с заданной вероятностью.
+
+Отдельный запуск:  python bench/fake_telegram.py --port 8081 --latency-ms 50 --rate-429 0.01
+Служебные адреса:  GET /_calls — сводка вызовов, POST /_reset — очистить журнал.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class CallLog:
+    """Журнал вызовов Bot API со счётчиками по чатам и методам, которых можно дождаться."""
+
+    def __init__(self):
+        self.calls = []
+        self.counts = {}
+        self.next_message_id = 1
+        self.last_call_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    def record(self, method, params):
+        chat_id = params.get("chat_id")
+        with self._cond:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            self.last_call_at = time.monotonic()
+            self.calls.append({"ts": self.last_call_at, "method": method, "params": params})
+            if chat_id is not None:
+                for key in ((int(chat_id), None), (int(chat_id), method)):
+                    self.counts[key] = self.counts.get(key, 0) + 1
+            self._cond.notify_all()
+        return message_id
+
+    def count(self, chat_id, method=None):
+        with self._cond:
+            return self.counts.get((chat_id, method), 0)
+
+    def wait_for(self, chat_id, count, method=None, timeout=30.0):
+        """Ждёт, пока в чат уйдёт не меньше count вызовов (метода method); False — не дождались."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.counts.get((chat_id, method), 0) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def wait_idle(self, quiet=1.0, timeout=60.0):
+        """Ждёт паузы в quiet секунд без вызовов: фоновые уведомления и выгрузки дописались."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                idle = time.monotonic() - self.last_call_at
+            if idle >= quiet:
+                return True
+            time.sleep(min(quiet - idle, 0.1) + 0.01)
+        return False
+
+    def last_call(self, chat_id, methods):
+        with self._cond:
+            for call in reversed(self.calls):
+                if call["method"] in methods and str(call["params"].get("chat_id")) == str(chat_id):
+                    return call
+        return None
+
+    def summary(self):
+        with self._cond:
+            methods = {}
+            for call in self.calls:
+                methods[call["method"]] = methods.get(call["method"], 0) + 1
+            return {"total": len(self.calls), "methods": methods}
+
+    def reset(self):
+        with self._cond:
+            self.calls.clear()
+            self.counts.clear()
+
+
+def parse_params(handler):
+    """Параметры запроса из query string, form-urlencoded, JSON или multipart (файлы пропускаем)."""
+    url = urlparse(handler.path)
+    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    content_type = handler.headers.get("Content-Type", "")
+    if content_type.startswith("application/json") and body:
+        params.update(json.loads(body))
+    elif content_type.startswith("application/x-www-form-urlencoded") and body:
+        params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+    elif content_type.startswith("multipart/form-data") and body:
+        boundary = content_type.split("boundary=", 1)[1].encode()
+        for part in body.split(b"--" + boundary):
+            head, _, value = part.partition(b"\r\n\r\n")
+            if b'name="' not in head or b"filename=" in head:
+                continue
+            name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+            params[name] = value.rstrip(b"\r\n").decode("utf-8", "ignore")
+    return params
+
+
+def fake_message(message_id, params, **extra):
+    chat_id = int(params.get("chat_id", 0))
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+    }
+    if "text" in params:
+        message["text"] = params["text"]
+    message.update(extra)
+    return message
+
+
+def fake_result(method, message_id, params):
+    if method in ("sendMessage", "editMessageText", "sendLocation"):
+        return fake_message(message_id, params)
+    if method == "sendPhoto":
+        photo = [{"file_id": f"photo-{message_id}", "file_unique_id": f"u{message_id}", "width": 800, "height": 600}]
+        return fake_message(message_id, params, photo=photo)
+    if method == "sendMediaGroup":
+        media = json.loads(params.get("media", "[]"))
+        return [
+            fake_message(message_id + i, params, photo=[{
+                "file_id": f"photo-{message_id}-{i}", "file_unique_id": f"u{message_id}-{i}", "width": 800, "height": 600,
+            }])
+            for i in range(len(media))
+        ]
+    if method == "sendDocument":
+        document = {"file_id": f"doc-{message_id}", "file_unique_id": f"d{message_id}"}
+        return fake_message(message_id, params, document=document)
+    if method == "getWebhookInfo":
+        return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+    if method == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    return True
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=0.0, rate_429=0.0, retry_after=1):
+        super().__init__(address, FakeTelegramHandler)
+        self.latency = latency_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.log = CallLog()
+        self.throttled = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/_calls"):
+            self._reply(200, self.server.log.summary())
+            return
+        self._handle_api()
+
+    def do_POST(self):
+        if self.path.startswith("/_reset"):
+            self.server.log.reset()
+            self._reply(200, {"ok": True})
+            return
+        self._handle_api()
+
+    def _handle_api(self):
+        # /bot<token>/<method>
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        method = parts[1]
+        params = parse_params(self)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.rate_429 and random.random() < self.server.rate_429:
+            self.server.throttled += 1
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.server.retry_after}",
+                "parameters": {"retry_after": self.server.retry_after},
+            })
+            return
+
+        message_id = self.server.log.record(method, params)
+        self._reply(200, {"ok": True, "result": fake_result(method, message_id, params)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeTelegramServer((args.host, args.port), args.latency_ms, args.rate_429)
+    print(f"Фейковый Bot API слушает {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""Нагрузочный прогон Okservice на локальных заглушках.
+
+Поднимает фейковый Bot API (bench/fake_telegram.py), запускает приложение отдельным процессом
+(встроенный сервер Flask, gunicorn или асинхронный режим RUNTIME=async) против отдельной базы PostgreSQL, наполняет таблицу
+requests и прогоняет сценарии:
+
+  form            — POST /send_request с уникальными телефонами;
+  webhook_menu    — нажатия кнопок меню, время до ответа бота;
+  webhook_flow    — полная форма заявки: кнопка → имя → телефон → проблема;
+  admin_list      — «📋 Все заявки» и листание страниц по кнопкам;
+  admin_export    — выгрузка CSV большой таблицы до отправки файла.
+
+База: BENCH_DATABASE_URL (её содержимое очищается!) или --spawn-postgres — временный кластер
+через initdb/pg_ctl из PATH. SQLite приложению не подходит: запросы используют pg_trgm,
+регулярные выражения PostgreSQL и серверные курсоры.
+
+Результат — bench/results/<время>-<коммит>.json. Сравнение двух прогонов:
+    python bench/run.py --compare bench/results/A.json bench/results/B.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fake_telegram import FakeTelegramServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+BOT_TOKEN = "123456:BENCH-TOKEN"
+ADMIN_ID = 1000
+CHAT_BASE = 10_000_000
+
+# Тексты кнопок должны совпадать с BTN_* в Okservice.py; берём те, на которые бот отвечает одним сообщением
+MENU_BUTTONS = ["💡 О сервисе", "💰 Услуги и цены", "📍 Как добраться", "🕓 Время работы", "☎️ Связаться с нами"]
+BTN_REQUEST = "💬 Оставить заявку на ремонт"
+BTN_ALL_REQUESTS = "📋 Все заявки"
+BTN_EXPORT_CSV = "📤 Экспорт в CSV"
+
+SCENARIOS = ["form", "webhook_menu", "webhook_flow", "admin_list", "admin_export"]
+
+
+# === Статистика ===
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, duration):
+    values = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "count": len(values),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(values) / duration, 2) if duration > 0 else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+class Recorder:
+    """Собирает замеры из потоков нагрузки."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def ok(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+
+# === HTTP-клиент: одно keep-alive соединение на поток ===
+class AppClient:
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+        self._update_id = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = dict(headers or {}, **({"Content-Type": "application/json"} if payload else {}))
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def _next_ids(self):
+        with self._lock:
+            self._update_id += 1
+            self._message_id += 1
+            return self._update_id, self._message_id
+
+    def send_text(self, chat_id, text):
+        update_id, message_id = self._next_ids()
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": user,
+                "text": text,
+            },
+        }
+        return self.request("POST", f"/{BOT_TOKEN}", update)
+
+    def send_callback(self, chat_id, message_id, data):
+        update_id, _ = self._next_ids()
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        update = {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "...",
+                },
+            },
+        }
+        return self.request("POST", f"/{BOT_TOKEN}", update)
+
+
+# === Окружение: PostgreSQL, фейковый Telegram, приложение ===
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SpawnedPostgres:
+    """Временный кластер PostgreSQL в tmp; удаляется после прогона."""
+
+    def __init__(self):
+        if not shutil.which("initdb") or not shutil.which("pg_ctl"):
+            raise SystemExit("❌ initdb/pg_ctl не найдены в PATH, задайте BENCH_DATABASE_URL")
+        self.dir = tempfile.mkdtemp(prefix="okservice-bench-pg-")
+        self.data = os.path.join(self.dir, "data")
+        self.port = free_port()
+        subprocess.run(["initdb", "-D", self.data, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(["pg_ctl", "-D", self.data, "-l", os.path.join(self.dir, "pg.log"), "-w", "start",
+                        "-o", f"-p {self.port} -k {self.dir} -c listen_addresses=127.0.0.1"],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.url = f"postgresql://bench@127.0.0.1:{self.port}/postgres"
+
+    def stop(self):
+        subprocess.run(["pg_ctl", "-D", self.data, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def reset_database(database_url):
+    import psycopg2  # зависимость приложения; для --compare не нужна
+
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            # Сводки статистики ведут триггеры: без сброса они переносят счётчики из прошлого прогона
+            cur.execute("""
+                DROP TABLE IF EXISTS requests, notification_outbox, bot_next_steps, media_cache, startup_marks,
+                    search_queries, request_stats_daily, request_keyword_stats CASCADE
+            """)
+
+
+def seed_requests(database_url, rows):
+    """Наполняет requests синтетическими заявками за последний год одним INSERT ... SELECT."""
+    import psycopg2
+
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT ensure_request_partitions(now() - interval '1 year', now())")
+            cur.execute("""
+                INSERT INTO requests (name, phone, problem, source, created_at)
+                SELECT
+                    (ARRAY['Иван', 'Пётр', 'Анна', 'Мария', 'Олег', 'Светлана'])[1 + i % 6] || ' ' || i,
+                    '+7 9' || lpad((i * 7919 % 1000000000)::text, 9, '0'),
+                    (ARRAY['Не включается ноутбук', 'Медленно работает', 'Синий экран',
+                           'Замена термопасты', 'Установка Windows', 'Не работает клавиатура'])[1 + i % 6],
+                    CASE WHEN i % 3 = 0 THEN 'telegram' ELSE 'site' END,
+                    now() - (i % 525600) * interval '1 minute'
+                FROM generate_series(1, %s) AS i
+            """, (rows,))
+            cur.execute("ANALYZE requests")
+
+
+def start_app(args, database_url, telegram_url, log_file):
+    port = free_port()
+    big = "1000000000"
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        ADMIN_ID=str(ADMIN_ID),
+        PORT=str(port),
+        RUNTIME=args.runtime,
+        SERVER=args.server,
+        WEB_CONCURRENCY=str(args.workers),
+        DATABASE_URL=database_url,
+        DB_SSLMODE="disable",
+        TELEGRAM_API_URL=telegram_url,
+        RENDER_EXTERNAL_HOSTNAME="bench.local",
+        PROXY_COUNT="0",
+        # Лимиты формы рассчитаны на людей; в прогоне все запросы идут с одного IP
+        FORM_IP_RATE_PER_MIN=big,
+        FORM_IP_BURST=big,
+        FORM_PHONE_RATE_PER_MIN=big,
+        FORM_PHONE_BURST=big,
+        LOG_LEVEL=args.app_log_level,
+        METRICS_TOKEN="",
+    )
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "Okservice.py")], cwd=REPO_DIR, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    client = AppClient(port)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"❌ Приложение завершилось с кодом {process.returncode}, лог: {log_file.name}")
+        try:
+            status, _ = client.request("GET", "/readyz")
+            if status == 200:
+                return process, client
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"❌ Приложение не стало готовым за {args.startup_timeout} с, лог: {log_file.name}")
+
+
+# === Сценарии ===
+def run_parallel(concurrency, jobs, job):
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(job, item, recorder) for item in jobs]:
+            future.result()
+    return recorder, time.perf_counter() - started
+
+
+def scenario_form(ctx):
+    def job(i, recorder):
+        body = {"name": f"Bench {i}", "phone": f"+7 901 {ctx.run_id % 1000:03d} {i:04d}",
+                "message": "Не включается ноутбук после обновления"}
+        started = time.perf_counter()
+        try:
+            status, _ = ctx.client.request("POST", "/send_request", body)
+        except OSError:
+            status = None
+        if status == 200:
+            recorder.ok(time.perf_counter() - started)
+        else:
+            recorder.fail()
+
+    recorder, duration = run_parallel(ctx.args.concurrency, range(ctx.args.requests), job)
+    return summarize(recorder.latencies, recorder.errors, duration)
+
+
+def send_and_wait(ctx, chat_id, text, ack, recorder, method=None):
+    """Отправляет сообщение боту и ждёт его ответа в этот чат; возвращает время до ответа или None."""
+    expected = ctx.telegram.log.count(chat_id, method) + 1
+    started = time.perf_counter()
+    try:
+        status, _ = ctx.client.send_text(chat_id, text)
+    except OSError:
+        recorder.fail()
+        return None
+    ack.ok(time.perf_counter() - started)
+    if status != 200 or not ctx.telegram.log.wait_for(chat_id, expected, method, ctx.args.reply_timeout):
+        recorder.fail()
+        return None
+    elapsed = time.perf_counter() - started
+    recorder.ok(elapsed)
+    return elapsed
+
+
+def scenario_webhook_menu(ctx):
+    ack = Recorder()
+    chats = [ctx.next_chat() for _ in range(ctx.args.chats)]
+    presses_per_chat = max(1, ctx.args.requests // len(chats))
+
+    def job(chat_id, recorder):
+        for _ in range(presses_per_chat):
+            send_and_wait(ctx, chat_id, random.choice(MENU_BUTTONS), ack, recorder)
+
+    recorder, duration = run_parallel(ctx.args.concurrency, chats, job)
+    result = summarize(recorder.latencies, recorder.errors, duration)
+    result["ack"] = summarize(ack.latencies, ack.errors, duration)
+    return result
+
+
+def scenario_webhook_flow(ctx):
+    ack = Recorder()
+    steps = Recorder()
+    chats = [ctx.next_chat() for _ in range(ctx.args.chats)]
+
+    def job(chat_id, recorder):
+        started = time.perf_counter()
+        answers = [BTN_REQUEST, f"Bench {chat_id}", f"+7 902 {chat_id % 10_000_000:07d}", "Синий экран при загрузке"]
+        for text in answers:
+            if send_and_wait(ctx, chat_id, text, ack, steps) is None:
+                recorder.fail()
+                return
+        recorder.ok(time.perf_counter() - started)
+
+    recorder, duration = run_parallel(ctx.args.concurrency, chats, job)
+    result = summarize(recorder.latencies, recorder.errors, duration)
+    result["steps"] = summarize(steps.latencies, steps.errors, duration)
+    result["ack"] = summarize(ack.latencies, ack.errors, duration)
+    return result
+
+
+def next_page_callback(call):
+    markup = json.loads(call["params"].get("reply_markup") or "{}")
+    for row in markup.get("inline_keyboard", []):
+        for button in row:
+            data = button.get("callback_data", "")
+            if data.startswith("pg:") and ":next:" in data:
+                return data
+    return None
+
+
+def scenario_admin_list(ctx):
+    ack = Recorder()
+    first_page = Recorder()
+    log = ctx.telegram.log
+
+    started = time.perf_counter()
+    send_and_wait(ctx, ADMIN_ID, BTN_ALL_REQUESTS, ack, first_page, method="sendMessage")
+    message = log.last_call(ADMIN_ID, ("sendMessage",))
+    callback = next_page_callback(message) if message else None
+    message_id = 1
+
+    pages = Recorder()
+    for _ in range(ctx.args.pages):
+        if callback is None:
+            pages.fail()
+            break
+        expected = log.count(ADMIN_ID, "editMessageText") + 1
+        page_started = time.perf_counter()
+        try:
+            ctx.client.send_callback(ADMIN_ID, message_id, callback)
+        except OSError:
+            pages.fail()
+            break
+        if not log.wait_for(ADMIN_ID, expected, "editMessageText", ctx.args.reply_timeout):
+            pages.fail()
+            break
+        pages.ok(time.perf_counter() - page_started)
+        callback = next_page_callback(log.last_call(ADMIN_ID, ("editMessageText",)))
+    duration = time.perf_counter() - started
+
+    result = summarize(pages.latencies, pages.errors, duration)
+    result["first_page"] = summarize(first_page.latencies, first_page.errors, duration)
+    return result
+
+
+def scenario_admin_export(ctx):
+    ack = Recorder()
+    recorder = Recorder()
+    started = time.perf_counter()
+    for _ in range(ctx.args.exports):
+        send_and_wait(ctx, ADMIN_ID, BTN_EXPORT_CSV, ack, recorder, method="sendDocument")
+    return summarize(recorder.latencies, recorder.errors, time.perf_counter() - started)
+
+
+SCENARIO_FUNCS = {
+    "form": scenario_form,
+    "webhook_menu": scenario_webhook_menu,
+    "webhook_flow": scenario_webhook_flow,
+    "admin_list": scenario_admin_list,
+    "admin_export": scenario_admin_export,
+}
+
+
+class BenchContext:
+    def __init__(self, args, client, telegram):
+        self.args = args
+        self.client = client
+        self.telegram = telegram
+        self.run_id = int(time.time())
+        self._chat = CHAT_BASE
+        self._lock = threading.Lock()
+
+    def next_chat(self):
+        with self._lock:
+            self._chat += 1
+            return self._chat
+
+
+# === Результаты ===
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(report):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{report['commit']}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    return path
+
+
+def print_report(report):
+    config = report["config"]
+    if config.get("runtime", "sync") == "async":
+        server = "aiohttp (RUNTIME=async)"
+    else:
+        server = f"{config['server']} × {config['workers']}"
+    print(f"\nКоммит {report['commit']}, сервер {server}")
+    print(f"{'сценарий':<16}{'кол-во':>8}{'ошибки':>8}{'rps':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for name, result in report["scenarios"].items():
+        print(f"{name:<16}{result['count']:>8}{result['errors']:>8}{str(result['throughput_rps']):>10}"
+              f"{str(result['p50_ms']):>10}{str(result['p95_ms']):>10}{str(result['p99_ms']):>10}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as file:
+        old = json.load(file)
+    with open(new_path, encoding="utf-8") as file:
+        new = json.load(file)
+
+    def delta(before, after):
+        if not before or after is None:
+            return "—"
+        return f"{(after - before) / before * 100:+.1f}%"
+
+    print(f"{old['commit']} → {new['commit']}")
+    print(f"{'сценарий':<16}{'метрика':<16}{'было':>10}{'стало':>10}{'разница':>10}")
+    for name in new["scenarios"]:
+        if name not in old["scenarios"]:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors"):
+            before = old["scenarios"][name].get(metric)
+            after = new["scenarios"][name].get(metric)
+            print(f"{name:<16}{metric:<16}{str(before):>10}{str(after):>10}{delta(before, after):>10}")
+
+
+# === Запуск ===
+def run(args):
+    database_url = os.getenv("BENCH_DATABASE_URL")
+    spawned = None
+    if args.spawn_postgres:
+        spawned = SpawnedPostgres()
+        database_url = spawned.url
+    if not database_url:
+        raise SystemExit("❌ Задайте BENCH_DATABASE_URL (база будет очищена) или --spawn-postgres")
+
+    telegram = FakeTelegramServer(("127.0.0.1", 0), args.tg_latency_ms, args.tg_rate_429).start()
+    log_file = tempfile.NamedTemporaryFile("w", prefix="okservice-bench-", suffix=".log", delete=False)
+    process = None
+    try:
+        reset_database(database_url)
+        process, client = start_app(args, database_url, telegram.url, log_file)
+        print(f"⏳ Наполняем requests: {args.seed_rows} строк")
+        seed_requests(database_url, args.seed_rows)
+
+        ctx = BenchContext(args, client, telegram)
+        scenarios = {}
+        for name in args.scenarios:
+            print(f"▶️ {name}")
+            scenarios[name] = SCENARIO_FUNCS[name](ctx)
+            # Уведомления админу и выгрузки дописываются в фоне, не даём им попасть в следующий сценарий
+            telegram.log.wait_idle(quiet=1.0, timeout=args.reply_timeout)
+
+        status, body = client.request("GET", "/internal/stats")
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {key: value for key, value in vars(args).items() if key != "compare"},
+            "python": platform.python_version(),
+            "scenarios": scenarios,
+            "telegram": dict(telegram.log.summary(), throttled=telegram.throttled),
+            "app_stats": json.loads(body) if status == 200 else None,
+        }
+        print_report(report)
+        print(f"\n💾 {save_results(report)}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        telegram.shutdown()
+        log_file.close()
+        if spawned:
+            spawned.stop()
+    print(f"📄 Лог приложения: {log_file.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    parser.add_argument("--spawn-postgres", action="store_true", help="поднять временный PostgreSQL")
+    parser.add_argument("--runtime", choices=["sync", "async"], default="sync",
+                        help="async — один процесс aiohttp + AsyncTeleBot; --server и --workers не действуют")
+    parser.add_argument("--server", choices=["dev", "gunicorn"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="процессов gunicorn (WEB_CONCURRENCY)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=2000, help="запросов в сценариях form и webhook_menu")
+    parser.add_argument("--chats", type=int, default=200, help="чатов в webhook-сценариях")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pages", type=int, default=50, help="страниц, которые листает админ")
+    parser.add_argument("--exports", type=int, default=3)
+    parser.add_argument("--seed-rows", type=int, default=200_000)
+    parser.add_argument("--tg-latency-ms", type=float, default=30.0, help="задержка ответа фейкового Bot API")
+    parser.add_argument("--tg-rate-429", type=float, default=0.0, help="доля ответов 429 от фейкового Bot API")
+    parser.add_argument("--reply-timeout", type=float, default=60.0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--app-log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=42, help="зерно random для воспроизводимости")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    random.seed(args.seed)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
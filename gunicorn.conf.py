@@ -0,0 +1,28 @@
+# === Настройки gunicorn для продакшн-запуска ===
+# Запуск: gunicorn -c gunicorn.conf.py Okservice:app
+# или:    SERVER=gunicorn python Okservice.py
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+threads = int(os.getenv("WEB_THREADS", 8))
+worker_class = "gthread"
+timeout = int(os.getenv("WEB_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    # Таблицы и webhook настраиваются один раз, в отдельном процессе: мастер сразу открывает порт,
+    # а его собственные соединения и потоки не достаются воркерам после fork
+    import Okservice
+
+    multiprocessing.get_context("fork").Process(target=Okservice.startup, name="okservice-startup").start()
+
+
+def post_worker_init(worker):
+    import Okservice
+
+    Okservice.start_background_workers()
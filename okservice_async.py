@@ -0,0 +1,379 @@
+# === Асинхронный режим Okservice: AsyncTeleBot + aiohttp + пул psycopg 3 ===
+# Запуск: RUNTIME=async python Okservice.py  (или python okservice_async.py)
+#
+# Один процесс и один цикл событий держат тысячи ожидающих запросов: ожидание Telegram и БД
+# не занимает поток. Обработчики бота, тексты, маршруты, SQL, проверки формы, групповая запись
+# заявок с outbox-уведомлениями, шаги формы и выгрузки — общие с Okservice; здесь только AsyncBotIO
+# (ввод-вывод обработчиков), веб-сервер и пул соединений.
+#
+# Соединения с БД: DB_POOL_MAX — предел на процесс. ASYNC_DB_POOL_SIZE из них (по умолчанию половина)
+# у пула psycopg 3 для обработчиков и /readyz, остальные — у Okservice.db_pool, через который пишут
+# фоновые потоки: ingestor, outbox, выгрузки, обслуживание секций и шаги формы в PostgreSQL.
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from aiohttp import web
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from telebot import Handler, asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+from werkzeug.http import parse_accept_header, parse_date
+
+import Okservice
+from Okservice import log_event, metrics, timed
+
+ASYNC_MAX_UPDATES = int(os.getenv("ASYNC_MAX_UPDATES", 1000))  # апдейтов в обработке, дальше — 503 и повтор Telegram
+
+if Okservice.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = Okservice.TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+bot = AsyncTeleBot(Okservice.BOT_TOKEN)
+
+# Пул открывается в on_startup, внутри цикла событий
+db_pool = AsyncConnectionPool(
+    Okservice.DATABASE_URL,
+    min_size=min(Okservice.DB_POOL_MIN, Okservice.ASYNC_DB_POOL_SIZE),
+    max_size=Okservice.ASYNC_DB_POOL_SIZE,
+    timeout=Okservice.DB_POOL_TIMEOUT,
+    kwargs={"sslmode": Okservice.DB_SSLMODE, "row_factory": dict_row},
+    open=False,
+)
+
+
+# === Ввод-вывод обработчиков ===
+class AsyncBotIO:
+    """Как Okservice.SyncBotIO, но ожидание Telegram и БД отдаёт циклу событий.
+
+    Шаги формы лежат в том же next-step хранилище, что и у TeleBot (Okservice.bot.next_step_backend),
+    и в том же виде, поэтому их понимают оба режима.
+    """
+
+    def __init__(self, bot, pool, steps):
+        self.bot = bot
+        self.pool = pool
+        self.steps = steps
+
+    async def send(self, chat_id, text, **kwargs):
+        return await self.bot.send_message(chat_id, text, **kwargs)
+
+    async def send_location(self, chat_id, latitude, longitude):
+        return await self.bot.send_location(chat_id, latitude, longitude)
+
+    async def edit(self, text, chat_id, message_id, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id, message_id, **kwargs)
+
+    async def answer_callback(self, callback_id, text=None):
+        return await self.bot.answer_callback_query(callback_id, text)
+
+    async def _steps_call(self, method, *args):
+        # Хранилища в PostgreSQL и SQLite блокирующие — уводим их в поток
+        if isinstance(self.steps, Okservice.MemoryTTLHandlerBackend):
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def next_step(self, message, handler, *args):
+        await self._steps_call(self.steps.register_handler, message.chat.id,
+                               Handler(Okservice.run_next_step, handler, *args))
+
+    async def run_next_steps(self, message):
+        """Как TeleBot._notify_next_handlers: ожидаемый шаг формы забирает сообщение раньше меню. True — забрал."""
+        steps = await self._steps_call(self.steps.get_handlers, message.chat.id)
+        for step in steps or []:
+            handler, *args = step.args
+            await handler(self, message, *args)
+        return bool(steps)
+
+    async def queries(self, statements):
+        results = []
+        async with self.pool.connection() as conn:
+            for sql, params, many in statements:
+                with timed("db_query_seconds", op=Okservice.sql_operation(sql)):
+                    cursor = await conn.execute(sql, params)
+                    results.append(await cursor.fetchall() if many else await cursor.fetchone())
+        return results
+
+    async def query(self, sql, params=None):
+        return (await self.queries([(sql, params, True)]))[0]
+
+    async def execute(self, sql, params=None):
+        async with self.pool.connection() as conn:
+            with timed("db_query_seconds", op=Okservice.sql_operation(sql)):
+                await conn.execute(sql, params)
+
+    async def ingest(self, name, phone, problem, source, notification_text):
+        # Запись идёт общим групповым коммитом Okservice.ingestor; цикл событий только ждёт результат.
+        # shield: тайм-аут прерывает ожидание, но не отменяет Future, который заполнит поток ingest
+        future = Okservice.ingestor.submit(name, phone, problem, source, notification_text)
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), Okservice.INGEST_TIMEOUT)
+
+    async def blocking(self, func, *args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+io = AsyncBotIO(bot, db_pool, Okservice.bot.next_step_backend)
+
+
+def async_handler(handler):
+    @functools.wraps(handler)
+    async def run(update):
+        return await handler(io, update)
+    return run
+
+
+Okservice.register_bot_handlers(bot, async_handler)
+
+
+# === PostgreSQL: готовность и настройки поиска ===
+async def db_ready():
+    now = time.monotonic()
+    cached = Okservice.cached_readiness(now)
+    if cached is not None:
+        return cached
+    try:
+        rows = await io.query(Okservice.READINESS_SQL, (Okservice.BOOT_ID,))
+    except Exception:
+        rows = None
+    return Okservice.remember_readiness(now, rows)
+
+
+async def warm_search_state():
+    # build_request_filter спрашивает trgm_enabled(); узнаём ответ заранее, чтобы поиск не блокировал цикл.
+    # Пока расширения нет, ответ освежается чаще, чем устаревает: init_db может создать его позже
+    delay = Okservice.STARTUP_RETRY_BASE
+    while True:
+        try:
+            if await db_ready():
+                rows = await io.query("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                Okservice.trgm_state.update(enabled=bool(rows), checked_at=time.monotonic())
+                if rows:
+                    return
+                await asyncio.sleep(Okservice.TRGM_RECHECK_INTERVAL / 2)
+                continue
+        except Exception as e:
+            log_event("search_state_retry", "⚠️ Не удалось проверить pg_trgm, будет повтор", logging.WARNING,
+                      error=str(e))
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, Okservice.STARTUP_RETRY_MAX)
+
+
+# === Апдейты: по порядку внутри чата, параллельно между чатами ===
+chat_locks = weakref.WeakValueDictionary()  # блокировка живёт, пока её ждёт или держит хоть один апдейт
+update_tasks = set()
+update_counters = {"queue_depth": 0, "processed": 0, "errors": 0, "rejected": 0}
+
+
+async def process_update(update):
+    chat_id = Okservice.UpdateDispatcher.chat_key(update)
+    lock = chat_locks.get(chat_id)
+    if lock is None:
+        lock = chat_locks[chat_id] = asyncio.Lock()
+    update_counters["queue_depth"] += 1
+    try:
+        await lock.acquire()
+    finally:
+        update_counters["queue_depth"] -= 1
+    try:
+        if update.message is None or not await io.run_next_steps(update.message):
+            await bot.process_new_updates([update])
+        update_counters["processed"] += 1
+    except Exception as e:
+        update_counters["errors"] += 1
+        log_event("update_failed", "❌ Ошибка обработки апдейта", logging.ERROR,
+                  update_id=update.update_id, error=str(e))
+    finally:
+        lock.release()
+
+
+def update_stats():
+    """queue_depth — апдейты, ждущие своей очереди в чате; in_flight — принятые и ещё не обработанные."""
+    return dict(update_counters, in_flight=len(update_tasks), max_in_flight=ASYNC_MAX_UPDATES)
+
+
+# === HTTP ===
+def client_ip(request):
+    # Как ProxyFix(x_for=PROXY_COUNT): адрес, который записал в X-Forwarded-For ближайший к нам прокси
+    if Okservice.PROXY_COUNT:
+        forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+        if len(forwarded) >= Okservice.PROXY_COUNT:
+            return forwarded[-Okservice.PROXY_COUNT]
+    return request.remote
+
+
+def file_response(request, asset, cache_control):
+    accepted = parse_accept_header(request.headers.get("Accept-Encoding"))
+    status, body, headers = asset.respond(
+        cache_control,
+        request.headers.get("If-None-Match"),
+        parse_date(request.headers.get("If-Modified-Since")),
+        lambda encoding: accepted[encoding],
+    )
+    if status == 304:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=dict(headers, **{"Content-Type": asset.content_type}))
+
+
+async def home(request):
+    return file_response(request, Okservice.index_page.current(), "no-cache")
+
+
+async def serve_hashed_static(request):
+    asset = Okservice.static_assets.get_hashed(request.match_info["filename"])
+    if asset is None:
+        raise web.HTTPNotFound()
+    return file_response(request, asset, Okservice.IMMUTABLE_CACHE)
+
+
+async def serve_static(request):
+    asset = Okservice.static_assets.get(request.match_info["filename"])
+    if asset is None:
+        raise web.HTTPNotFound()
+    return file_response(request, asset, f"public, max-age={Okservice.STATIC_MAX_AGE}")
+
+
+async def send_request(request):
+    rejection = Okservice.precheck_form(request.content_length, client_ip(request))
+    if rejection is None:
+        try:
+            data = json.loads(await request.read())
+        except ValueError:
+            data = None
+        data, rejection = Okservice.validate_form_data(data)
+    if rejection is not None:
+        body, status, headers = rejection
+        return web.json_response(body, status=status, headers=headers)
+
+    name, phone, problem = data["name"], data["phone"], data["problem"]
+    try:
+        result = await io.ingest(name, phone, problem, "site", Okservice.site_request_text(name, phone, problem))
+        Okservice.form_recent.add((phone, problem.lower()))
+        if result["duplicate"]:
+            log_event("request_duplicate", "ℹ️ Повторная заявка с сайта пропущена", source="site", phone=phone,
+                      request_id=result["id"])
+        else:
+            log_event("request_saved", "✅ Заявка сохранена", source="site", request_id=result["id"], name=name,
+                      phone=phone)
+        return web.json_response({"status": "success"})
+    except Exception as e:
+        log_event("request_failed", "❌ Ошибка при обработке заявки", logging.ERROR, source="site", error=str(e))
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+
+
+async def telegram_webhook(request):
+    try:
+        update = types.Update.de_json(await request.text())
+    except Exception as e:
+        log_event("webhook_bad_update", "❌ Ошибка Webhook", logging.ERROR, error=str(e))
+        return web.Response(text="OK")
+
+    # Отвечаем сразу, апдейт обрабатывается задачей; при перегрузке просим Telegram повторить позже
+    if len(update_tasks) >= ASYNC_MAX_UPDATES:
+        update_counters["rejected"] += 1
+        log_event("webhook_busy", "⚠️ Слишком много апдейтов в обработке, апдейт отклонён", logging.WARNING,
+                  update_id=update.update_id)
+        return web.Response(text="Busy", status=503)
+    task = asyncio.create_task(process_update(update))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
+    return web.Response(text="OK")
+
+
+async def healthz(request):
+    return web.json_response({"status": "alive"})
+
+
+async def readyz(request):
+    ready = await db_ready()
+    return web.json_response({"status": "ready" if ready else "starting", "startup": Okservice.readiness_cache["startup"]},
+                             status=200 if ready else 503)
+
+
+# Те же разделы, что в синхронном режиме; «updates» — очередь этого цикла событий вместо UpdateDispatcher,
+# register_gauges заменяет ими синхронные показатели в /metrics
+COMPONENT_STATS = dict(Okservice.COMPONENT_STATS, updates=update_stats, async_db_pool=lambda: db_pool.get_stats())
+for section, source in COMPONENT_STATS.items():
+    metrics.register_gauges(section, source)
+
+
+def stats_allowed(request):
+    if not Okservice.METRICS_TOKEN:
+        return True
+    token = request.headers.get("X-Metrics-Token") or request.query.get("token")
+    return token == Okservice.METRICS_TOKEN
+
+
+async def internal_stats(request):
+    if not stats_allowed(request):
+        return web.json_response({"status": "error", "message": "forbidden"}, status=403)
+    return web.json_response({section: source() for section, source in COMPONENT_STATS.items()})
+
+
+async def prometheus_metrics(request):
+    if not stats_allowed(request):
+        return web.Response(text="forbidden\n", status=403)
+    return web.Response(body=metrics.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+@web.middleware
+async def observe_request(request, handler):
+    started = time.perf_counter()
+    code = 500
+    try:
+        response = await handler(request)
+        code = response.status
+        return response
+    except web.HTTPException as e:
+        code = e.status
+        raise
+    finally:
+        if Okservice.METRICS_ENABLED:
+            route = request.match_info.route
+            metrics.observe("http_request_seconds", time.perf_counter() - started,
+                            endpoint=route.name or "not_found", method=request.method, code=code)
+
+
+# === Запуск ===
+async def on_startup(app):
+    # Таблицы и webhook готовятся так же, как в синхронном режиме: один раз, в фоне, с повторами
+    Okservice.start_startup_in_background()
+    await db_pool.open(wait=False)
+    Okservice.notifier.start()
+    Okservice.ingestor.start()
+    threading.Thread(target=Okservice.next_step_janitor, name="next-step-janitor", daemon=True).start()
+    threading.Thread(target=Okservice.partition_maintainer, name="partition-maintainer", daemon=True).start()
+    app["background_tasks"] = [asyncio.create_task(warm_search_state())]
+
+
+async def on_cleanup(app):
+    for task in app["background_tasks"]:
+        task.cancel()
+    await db_pool.close()
+    await bot.close_session()
+
+
+def create_app():
+    app = web.Application(middlewares=[observe_request])
+    app.router.add_get("/", home, name="home")
+    app.router.add_get("/index.html", home, name="index_html")
+    app.router.add_get("/healthz", healthz, name="healthz")
+    app.router.add_get("/readyz", readyz, name="readyz")
+    app.router.add_get("/internal/stats", internal_stats, name="internal_stats")
+    app.router.add_get("/metrics", prometheus_metrics, name="prometheus_metrics")
+    app.router.add_post("/send_request", send_request, name="send_request")
+    app.router.add_post(f"/{Okservice.BOT_TOKEN}", telegram_webhook, name="telegram_webhook")
+    app.router.add_get("/static/{filename}", serve_hashed_static, name="serve_hashed_static")
+    # Последним: любой другой путь — файл из static/ по белому списку
+    app.router.add_get("/{filename:.+}", serve_static, name="serve_static")
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=Okservice.PORT, access_log=None)
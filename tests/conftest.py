@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Okservice читает настройки при импорте: задаём обязательные до него
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("LOG_FORMAT", "text")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,86 @@
+import threading
+
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import Okservice
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(dsn, **kwargs):
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    return opened
+
+
+def make_pool(maxconn=4):
+    return Okservice.DbPool("postgres://test", 1, maxconn, 1, 30)
+
+
+def test_returned_connections_stay_open_above_minconn(connections):
+    pool = make_pool()
+    barrier = threading.Barrier(4)
+
+    def work():
+        with pool.connection():
+            barrier.wait(timeout=5)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(connections) == 4
+    assert not any(conn.closed for conn in connections)
+    assert pool.stats()["idle"] == 4
+
+    # Следующие выдачи переиспользуют открытые соединения
+    for _ in range(10):
+        with pool.connection():
+            pass
+    assert len(connections) == 4
+
+
+def test_broken_connection_is_dropped_and_replaced(connections):
+    pool = make_pool()
+    with pool.connection() as conn:
+        conn.close()
+    assert pool.stats()["idle"] == 0
+
+    with pool.connection() as conn:
+        assert not conn.closed
+    assert len(connections) == 2
+    assert pool.stats()["idle"] == 1
+
+
+def test_close_empties_idle_list(connections):
+    pool = make_pool()
+    with pool.connection():
+        pass
+    pool.close()
+    assert pool.stats()["idle"] == 0
+    assert all(conn.closed for conn in connections)
@@ -0,0 +1,112 @@
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+
+import Okservice
+
+
+@pytest.mark.parametrize("text, export_format", [
+    (Okservice.BTN_EXPORT_XLSX, "xlsx"),
+    (Okservice.BTN_EXPORT_CSV, "csv"),
+    ("экспорт", "xlsx"),
+    ("экспорт csv.gz", "csv"),
+])
+def test_buttons_export_everything(text, export_format):
+    assert Okservice.parse_export_command(text) == (export_format, {})
+
+
+def test_filters_are_parsed():
+    export_format, query = Okservice.parse_export_command(
+        "экспорт csv с:01.10.2025 по:17.10.2025 тел:+7 источник:site"
+    )
+    assert export_format == "csv"
+    assert query == {"date_from": "2025-10-01", "date_to": "2025-10-17", "phone": "7", "source": "site"}
+
+
+def test_text_filter_needs_prefix():
+    _, query = Okservice.parse_export_command("экспорт текст:ноутбук текст:экран")
+    assert query == {"text": "ноутбук экран"}
+
+
+@pytest.mark.parametrize("text", [
+    "экспорт csv ноутбук",
+    "экспорт сс:01.10.2025",
+    "экспорт с:",
+    "экспорт 7064",
+])
+def test_unknown_words_are_rejected(text):
+    with pytest.raises(ValueError, match="Формат: экспорт"):
+        Okservice.parse_export_command(text)
+
+
+def test_bad_filter_value_is_rejected():
+    with pytest.raises(ValueError):
+        Okservice.parse_export_command("экспорт источник:email")
+
+
+def test_queue_export_reports_usage_without_starting(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(Okservice.export_executor, "submit", lambda *args: submitted.append(args))
+    reply = Okservice.queue_export(1, "экспорт опечатка")
+    assert "Формат: экспорт" in reply
+    assert not submitted
+    assert 1 not in Okservice.active_exports
+
+
+def test_writers_return_row_count(tmp_path):
+    rows = [[1, "Иван", "+7", "не включается", "2025-10-01", "site"]] * 3
+    assert Okservice.write_csv_gz(str(tmp_path / "out.csv.gz"), iter(rows), lambda done: None) == 3
+    assert Okservice.write_xlsx(str(tmp_path / "out.xlsx"), iter([]), lambda done: None) == 0
+
+
+class FakeBot:
+    def __init__(self, fail_on=()):
+        self.fail_on = fail_on
+        self.calls = []
+
+    def _call(self, method, text=None):
+        self.calls.append((method, text))
+        if any(text and text.startswith(prefix) for prefix in self.fail_on):
+            raise ConnectionError("Too Many Requests: retry after 5")
+        return SimpleNamespace(message_id=7)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._call("send_message", text)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._call("edit_message_text", text)
+
+    def send_document(self, chat_id, file, caption=None, **kwargs):
+        return self._call("send_document", caption)
+
+    def delete_message(self, chat_id, message_id):
+        return self._call("delete_message")
+
+
+@pytest.fixture
+def export_env(monkeypatch):
+    rows = [[i, "Иван", "+7", "не включается", "2025-10-01", "site"] for i in range(3)]
+    monkeypatch.setattr(Okservice, "get_db_connection", nullcontext)
+    monkeypatch.setattr(Okservice, "iter_export_rows", lambda conn, query: iter(rows))
+    monkeypatch.setattr(Okservice, "EXPORT_PROGRESS_INTERVAL", 0)
+
+    def start(fake_bot):
+        monkeypatch.setattr(Okservice, "bot", fake_bot)
+        Okservice.active_exports.add(1)
+        Okservice.run_export(1, "csv", {})
+        return fake_bot
+
+    return start
+
+
+def test_failed_status_message_releases_export_slot(export_env):
+    fake_bot = export_env(FakeBot(fail_on=["⏳ Готовлю"]))
+    assert 1 not in Okservice.active_exports
+    assert fake_bot.calls[-1][1].startswith("❌ Ошибка при экспорте")
+
+
+def test_failed_progress_edit_does_not_abort_export(export_env):
+    fake_bot = export_env(FakeBot(fail_on=["⏳ Выгружено"]))
+    assert ("send_document", "📤 Заявки экспортированы в CSV (gzip)!\nСтрок: 3") in fake_bot.calls
+    assert 1 not in Okservice.active_exports
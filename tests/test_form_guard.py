@@ -0,0 +1,87 @@
+import io
+import json
+
+import pytest
+
+import Okservice
+
+
+@pytest.fixture(autouse=True)
+def fresh_guards(monkeypatch):
+    monkeypatch.setattr(Okservice, "form_ip_limiter", Okservice.TokenBucketLimiter(60, 2, 100))
+    monkeypatch.setattr(Okservice, "form_phone_limiter", Okservice.TokenBucketLimiter(60, 2, 100))
+    monkeypatch.setattr(Okservice, "form_recent", Okservice.RecentKeys(600, 100))
+
+
+def form(**overrides):
+    data = {"name": "Иван", "phone": "8 701 123 45 67", "message": "Не включается ноутбук"}
+    data.update(overrides)
+    return data
+
+
+def test_missing_length_is_411():
+    body, status, _ = Okservice.precheck_form(None, "10.0.0.1")
+    assert status == 411
+    assert body["status"] == "error"
+
+
+def test_too_large_body_is_413():
+    _, status, _ = Okservice.precheck_form(Okservice.FORM_MAX_BYTES + 1, "10.0.0.1")
+    assert status == 413
+
+
+def test_ip_rate_limit_sends_retry_after():
+    assert Okservice.precheck_form(100, "10.0.0.1") is None
+    assert Okservice.precheck_form(100, "10.0.0.1") is None
+    _, status, headers = Okservice.precheck_form(100, "10.0.0.1")
+    assert status == 429
+    assert "Retry-After" in headers
+    assert Okservice.precheck_form(100, "10.0.0.2") is None
+
+
+def test_valid_form_is_normalized():
+    data, rejection = Okservice.validate_form_data(form(name="  Иван  ", message="  Экран  "))
+    assert rejection is None
+    assert data == {"name": "Иван", "phone": "+77011234567", "problem": "Экран"}
+
+
+def test_honeypot_gets_fake_success():
+    data, rejection = Okservice.validate_form_data(form(website="http://spam.example"))
+    assert data is None
+    assert rejection[:2] == ({"status": "success"}, 200)
+
+
+@pytest.mark.parametrize("data", [
+    None,
+    [],
+    form(name=""),
+    form(name=123),
+    form(name="<script>"),
+    form(phone="   "),
+    form(phone="позвоните"),
+    form(message="x" * (Okservice.FORM_MESSAGE_MAX + 1)),
+])
+def test_invalid_forms_are_400(data):
+    _, rejection = Okservice.validate_form_data(data)
+    assert rejection[1] == 400
+
+
+def test_repeated_submission_gets_fake_success():
+    data, _ = Okservice.validate_form_data(form())
+    Okservice.form_recent.add((data["phone"], data["problem"].lower()))
+    assert Okservice.validate_form_data(form())[1][:2] == ({"status": "success"}, 200)
+
+
+def test_phone_rate_limit():
+    for message in ("первая", "вторая"):
+        assert Okservice.validate_form_data(form(message=message))[1] is None
+    assert Okservice.validate_form_data(form(message="третья"))[1][1] == 429
+
+
+def test_endpoint_rejects_body_without_length_with_411():
+    response = Okservice.app.test_client().post(
+        "/send_request",
+        input_stream=io.BytesIO(json.dumps(form()).encode()),
+        headers={"Content-Type": "application/json", "Transfer-Encoding": "chunked"},
+    )
+    assert response.status_code == 411
@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from telebot.handler_backends import MemoryHandlerBackend
+
+import Okservice
+
+
+class FakeIO:
+    """Ввод-вывод обработчиков без Telegram и БД: запоминает отправленное и шаги формы."""
+
+    def __init__(self):
+        self.sent = []
+        self.steps = {}
+        self.ingested = []
+
+    async def send(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def next_step(self, message, handler, *args):
+        self.steps[message.chat.id] = (handler, args)
+
+    async def ingest(self, *args):
+        self.ingested.append(args)
+        return {"id": 1, "duplicate": False}
+
+    def reply(self, chat_id, text):
+        handler, args = self.steps.pop(chat_id)
+        return Okservice.run_sync(handler(self, message(text, chat_id), *args))
+
+
+def message(text, chat_id=5):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+
+def test_run_sync_returns_handler_result():
+    async def handler():
+        return 42
+
+    assert Okservice.run_sync(handler()) == 42
+
+
+def test_run_sync_refuses_real_awaits():
+    with pytest.raises(RuntimeError):
+        Okservice.run_sync(asyncio.sleep(0))
+
+
+def test_menu_button_goes_through_shared_handler():
+    io = FakeIO()
+    Okservice.run_sync(Okservice.handle_text(io, message(Okservice.BTN_ABOUT)))
+    assert io.sent == [(5, Okservice.ABOUT_TEXT)]
+
+
+def test_request_form_steps():
+    io = FakeIO()
+    Okservice.run_sync(Okservice.handle_text(io, message(Okservice.BTN_REQUEST)))
+    io.reply(5, "Иван")
+    io.reply(5, "+7 701 123 45 67")
+    io.reply(5, "Не включается")
+    assert [text for _, text in io.sent] == [
+        Okservice.FORM_NAME_PROMPT, Okservice.FORM_PHONE_PROMPT, Okservice.FORM_PROBLEM_PROMPT,
+        Okservice.FORM_SAVED_TEXT,
+    ]
+    assert io.ingested[0][:4] == ("Иван", "+7 701 123 45 67", "Не включается", "telegram")
+    assert io.steps == {}
+
+
+def test_sync_next_step_is_stored_for_both_runtimes(monkeypatch):
+    # В хранилище лежит Handler(run_next_step, обработчик, аргументы) — его исполняют и TeleBot, и okservice_async
+    monkeypatch.setattr(Okservice.bot, "next_step_backend", MemoryHandlerBackend())
+    Okservice.run_sync(Okservice.sync_io.next_step(message("Иван"), Okservice.get_phone, "Иван"))
+    [step] = Okservice.bot.next_step_backend.get_handlers(5)
+    assert step.callback is Okservice.run_next_step
+    assert step.args == (Okservice.get_phone, "Иван")
+
+    io = FakeIO()
+    handler, *args = step.args
+    Okservice.run_sync(handler(io, message("+77011234567"), *args))
+    assert io.steps[5] == (Okservice.get_problem, ("Иван", "+77011234567"))
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.committed = False
+
+    @contextmanager
+    def cursor(self):
+        yield SimpleNamespace(execute=lambda sql, params=None: self.statements.append(sql))
+
+    def commit(self):
+        self.committed = True
+
+
+def test_sync_io_commits_writes(monkeypatch):
+    # DbPool откатывает всё незафиксированное, когда соединение возвращается в пул
+    conn = RecordingConnection()
+    monkeypatch.setattr(Okservice, "get_db_connection", contextmanager(lambda: (yield conn)))
+    Okservice.run_sync(Okservice.sync_io.execute("TRUNCATE requests"))
+    assert conn.statements == ["TRUNCATE requests"]
+    assert conn.committed
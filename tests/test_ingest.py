@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+import Okservice
+
+
+@pytest.fixture
+def ingestor(monkeypatch):
+    ingestor = Okservice.RequestIngestor(50, 0.02, 600)
+    monkeypatch.setattr(ingestor, "start", lambda: None)
+    return ingestor
+
+
+def submitted_phone(ingestor, phone, source):
+    ingestor.submit("Иван", phone, "не включается", source, "уведомление")
+    item = ingestor._buffer[-1]
+    return item["phone"], item["digits"]
+
+
+def test_telegram_phone_matches_site_phone(ingestor):
+    site = Okservice.normalize_phone("+7 701 123 45 67")
+    telegram = submitted_phone(ingestor, "8 (701) 123-45-67", "telegram")
+    assert telegram == (site, "77011234567")
+    assert submitted_phone(ingestor, site, "site") == telegram
+
+
+def test_unrecognised_phone_is_kept_as_typed(ingestor):
+    assert submitted_phone(ingestor, "звоните вечером", "telegram") == ("звоните вечером", "")
+
+
+@pytest.mark.parametrize("phone, expected", [
+    ("+7 (701) 123-45-67", "+77011234567"),
+    ("87011234567", "+77011234567"),
+    ("7011234567", "+77011234567"),
+    ("+77011234567", "+77011234567"),
+    ("12345", None),
+    ("позвоните", None),
+])
+def test_normalize_phone(phone, expected):
+    assert Okservice.normalize_phone(phone) == expected
+
+
+def test_abandoned_future_does_not_stop_ingest_thread(monkeypatch):
+    # Асинхронный режим отменяет Future по тайм-ауту, пока пакет ещё пишется
+    ingestor = Okservice.RequestIngestor(50, 0.001, 600)
+    release = threading.Event()
+
+    def flush(batch):
+        release.wait(5)
+        return [{"id": 1, "duplicate": False} for _ in batch], []
+
+    monkeypatch.setattr(ingestor, "_flush", flush)
+    abandoned = ingestor.submit("Иван", "87011234567", "не включается", "site", "уведомление")
+    assert abandoned.cancel()
+    release.set()
+
+    later = ingestor.submit("Пётр", "87017654321", "не греет", "site", "уведомление")
+    assert later.result(timeout=5) == {"id": 1, "duplicate": False}
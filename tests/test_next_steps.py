@@ -0,0 +1,54 @@
+import pytest
+from telebot import Handler
+
+import Okservice
+
+
+def step(*args):
+    return Handler(Okservice.run_next_step, Okservice.get_phone, *args)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make(ttl):
+        if request.param == "memory":
+            return Okservice.MemoryTTLHandlerBackend(ttl)
+        return Okservice.SqliteHandlerBackend(str(tmp_path / "next_steps.sqlite3"), ttl)
+    return make
+
+
+def test_steps_are_consumed_on_read(make_backend):
+    backend = make_backend(60)
+    backend.register_handler(5, step("Иван"))
+    backend.register_handler(5, step("Пётр"))
+    assert [s.args for s in backend.get_handlers(5)] == [(Okservice.get_phone, "Иван"), (Okservice.get_phone, "Пётр")]
+    assert backend.get_handlers(5) is None
+
+
+def test_steps_of_other_chats_are_kept(make_backend):
+    backend = make_backend(60)
+    backend.register_handler(5, step("Иван"))
+    backend.register_handler(6, step("Пётр"))
+    backend.clear_handlers(5)
+    assert backend.get_handlers(5) is None
+    assert backend.get_handlers(6)[0].args == (Okservice.get_phone, "Пётр")
+
+
+def test_expired_step_is_ignored_and_cleaned(make_backend):
+    # Брошенная форма не перехватывает следующее сообщение пользователя
+    backend = make_backend(-1)
+    backend.register_handler(5, step("Иван"))
+    backend.register_handler(6, step("Пётр"))
+    assert backend.get_handlers(5) is None
+    assert backend.cleanup() == 1
+    assert backend.get_handlers(6) is None
+
+
+def test_sqlite_step_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "next_steps.sqlite3")
+    Okservice.SqliteHandlerBackend(path, 60).register_handler(5, step("Иван"))
+    [restored] = Okservice.SqliteHandlerBackend(path, 60).get_handlers(5)
+    # Шаг переживает pickle: функции восстанавливаются по имени модуля, а не по объекту в памяти
+    assert restored.callback is Okservice.run_next_step
+    assert restored.args == (Okservice.get_phone, "Иван")
+    assert Okservice.SqliteHandlerBackend(path, 60).get_handlers(5) is None
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+import requests
+from telebot.apihelper import ApiTelegramException
+
+import Okservice
+
+
+def telegram_error(code, description, **parameters):
+    result_json = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        result_json["parameters"] = parameters
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+class FakeBot:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        self.sent.append((chat_id, text, parse_mode))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+@pytest.fixture
+def deliver(monkeypatch):
+    """Доставляет одно уведомление с attempts-й попытки; возвращает вызовы _finish и фейкового бота."""
+    def run(fake_bot, attempts=1):
+        dispatcher = Okservice.NotificationDispatcher(1, 10, 3, 2, 60, 1, 0, 0)
+        finished = []
+        row = {"id": 11, "chat_id": 5, "text": "*Заявка*", "parse_mode": "Markdown", "attempts": attempts}
+        monkeypatch.setattr(dispatcher, "_claim", lambda notification_id: row)
+        monkeypatch.setattr(dispatcher, "_finish", lambda *args: finished.append(args))
+        monkeypatch.setattr(Okservice, "bot", fake_bot)
+        dispatcher._deliver(11)
+        return dispatcher, finished
+    return run
+
+
+def test_sent(deliver):
+    dispatcher, finished = deliver(FakeBot())
+    assert finished == [(11, "sent")]
+    assert dispatcher.sent == 1
+
+
+def test_429_waits_retry_after_and_pauses_chat(deliver):
+    dispatcher, finished = deliver(FakeBot(telegram_error(429, "Too Many Requests", retry_after=7)))
+    [(notification_id, status, _, retry_in)] = finished
+    assert (notification_id, status, retry_in) == (11, "pending", 7)
+    assert dispatcher._chat_next_send[5] >= time.monotonic() + 6
+
+
+@pytest.mark.parametrize("attempts, retry_in", [(1, 2), (2, 4)])
+def test_server_error_backs_off_exponentially(deliver, attempts, retry_in):
+    dispatcher, finished = deliver(FakeBot(telegram_error(502, "Bad Gateway")), attempts)
+    assert finished[0][1] == "pending"
+    assert finished[0][3] == retry_in
+    assert dispatcher.retried == 1
+
+
+def test_network_error_is_retried(deliver):
+    _, finished = deliver(FakeBot(requests.exceptions.ConnectionError("reset")))
+    assert finished[0][1] == "pending"
+
+
+def test_last_attempt_fails(deliver):
+    dispatcher, finished = deliver(FakeBot(telegram_error(502, "Bad Gateway")), attempts=3)
+    assert finished[0][1] == "failed"
+    assert dispatcher.failed == 1
+
+
+def test_broken_markdown_is_resent_as_plain_text(deliver):
+    fake_bot = FakeBot(telegram_error(400, "Bad Request: can't parse entities"))
+    _, finished = deliver(fake_bot)
+    assert [parse_mode for _, _, parse_mode in fake_bot.sent] == ["Markdown", None]
+    assert finished == [(11, "sent")]
+
+
+def test_rejected_message_is_not_retried(deliver):
+    dispatcher, finished = deliver(FakeBot(telegram_error(403, "Forbidden: bot was blocked by the user")))
+    assert finished[0][1] == "failed"
+    assert dispatcher.retried == 0
@@ -0,0 +1,122 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import Okservice
+
+
+@pytest.fixture(autouse=True)
+def without_trgm(monkeypatch):
+    monkeypatch.setitem(Okservice.trgm_state, "enabled", False)
+    monkeypatch.setitem(Okservice.trgm_state, "checked_at", time.monotonic())
+
+
+def row(request_id, created_at=datetime(2025, 10, 17, 12, 34, 56, 123456)):
+    return {
+        "id": request_id, "name": "Иван", "phone": "+77011234567", "problem": "Не включается",
+        "created_at": created_at, "source": "site",
+    }
+
+
+def test_cursor_round_trips_through_the_query():
+    keys = Okservice.request_sort_keys({})
+    cursor = Okservice.page_cursor(row(1234567), keys)
+    assert cursor == "2025-10-17 12:34:56.123456~1234567"
+
+    sql, params, _ = Okservice.requests_page_query({}, cursor, "next")
+    assert "(created_at, id) < (%(cursor_0)s::timestamp, %(cursor_1)s::bigint)" in sql
+    assert "ORDER BY created_at DESC, id DESC" in sql
+    assert params["cursor_0"] == "2025-10-17 12:34:56.123456"
+    assert params["cursor_1"] == "1234567"
+    assert params["limit"] == Okservice.ADMIN_PAGE_SIZE + 1
+
+
+def test_prev_page_reads_in_reverse_order():
+    sql, _, _ = Okservice.requests_page_query({}, "2025-10-17 12:00:00~5", "prev")
+    assert "(created_at, id) > (" in sql
+    assert "ORDER BY created_at ASC, id ASC" in sql
+
+
+def test_first_page_has_no_cursor_condition():
+    sql, params, _ = Okservice.requests_page_query({}, None)
+    assert "WHERE" not in sql
+    assert not any(name.startswith("cursor_") for name in params)
+
+
+def test_split_next_page():
+    rows = [row(i) for i in range(Okservice.ADMIN_PAGE_SIZE + 1, 0, -1)]
+    page, has_prev, has_next = Okservice.split_requests_page(rows, None, "next")
+    assert len(page) == Okservice.ADMIN_PAGE_SIZE
+    assert (has_prev, has_next) == (False, True)
+
+
+def test_split_prev_page_restores_display_order():
+    rows = [row(i) for i in range(1, 4)]
+    page, has_prev, has_next = Okservice.split_requests_page(rows, "c", "prev")
+    assert [r["id"] for r in page] == [3, 2, 1]
+    assert (has_prev, has_next) == (False, True)
+
+
+class SearchQueriesIO:
+    """Таблица search_queries, общая для «воркеров» — так её видит io обработчиков."""
+
+    def __init__(self):
+        self.table = {}
+
+    async def execute(self, sql, params=None):
+        key, query = params
+        self.table[key] = query
+
+    async def query(self, sql, params=None):
+        key, _ = params
+        return [{"query": self.table[key]}] if key in self.table else []
+
+
+def test_navigation_buttons_fit_callback_data_limit():
+    io = SearchQueriesIO()
+    key = Okservice.run_sync(Okservice.remember_page_query(io, {"text": "ноутбук", "source": "site"}))
+    rows = [row(10 ** 12 + i) for i in range(3)]
+    _, markup = Okservice.render_requests_page(
+        "📋", key, rows, Okservice.request_sort_keys({}), has_prev=True, has_next=True
+    )
+    buttons = markup.keyboard[0]
+    assert [button.text for button in buttons] == ["⬅️ Назад", "Далее ➡️"]
+    assert all(len(button.callback_data.encode()) <= 64 for button in buttons)
+    assert Okservice.run_sync(Okservice.load_page_query(io, key)) == {"text": "ноутбук", "source": "site"}
+
+
+def test_page_query_is_found_by_another_worker(monkeypatch):
+    io = SearchQueriesIO()
+    key = Okservice.run_sync(Okservice.remember_page_query(io, {"phone": "7064", "date_from": "2025-10-01"}))
+    # Другой воркер: своей памяти о поиске нет, только общая таблица
+    monkeypatch.setattr(Okservice, "page_queries", Okservice.OrderedDict())
+    assert Okservice.run_sync(Okservice.load_page_query(io, key)) == {"phone": "7064", "date_from": "2025-10-01"}
+    assert Okservice.run_sync(Okservice.load_page_query(io, "0123456789")) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Иван", {"text": "Иван"}),
+    ("+7 701 123", {"phone": "7701123"}),
+    ("тел:7064 с:01.10.2025 по:2025-10-17 источник:Site ноутбук", {
+        "phone": "7064", "date_from": "2025-10-01", "date_to": "2025-10-17", "source": "site", "text": "ноутбук",
+    }),
+])
+def test_parse_search_query(text, expected):
+    assert Okservice.parse_search_query(text) == expected
+
+
+@pytest.mark.parametrize("text", ["с:32.13.2025", "тел:abc", "источник:email"])
+def test_parse_search_query_rejects_bad_filters(text):
+    with pytest.raises(ValueError):
+        Okservice.parse_search_query(text)
+
+
+def test_missing_trgm_is_rechecked(monkeypatch):
+    # Ранний поиск не должен навсегда отключить нечёткий поиск: init_db создаёт pg_trgm в фоне
+    monkeypatch.setitem(Okservice.trgm_state, "enabled", False)
+    monkeypatch.setitem(Okservice.trgm_state, "checked_at", 100.0)
+    assert not Okservice.trgm_pending(100.0 + Okservice.TRGM_RECHECK_INTERVAL / 2)
+    assert Okservice.trgm_pending(100.0 + Okservice.TRGM_RECHECK_INTERVAL)
+    monkeypatch.setitem(Okservice.trgm_state, "enabled", True)
+    assert not Okservice.trgm_pending(100.0 + Okservice.TRGM_RECHECK_INTERVAL * 10)
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+import Okservice
+
+
+class RecordingCursor:
+    def __init__(self, rows=None):
+        self.rows = rows or []
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+    def fetchone(self):
+        return {"total": 3}
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.mark.parametrize("day, expected", [
+    (date(2025, 1, 1), date(2025, 2, 1)),
+    (date(2025, 1, 31), date(2025, 2, 1)),
+    (date(2024, 2, 29), date(2024, 3, 1)),
+    (date(2025, 12, 15), date(2026, 1, 1)),
+])
+def test_next_month(day, expected):
+    assert Okservice.next_month(day) == expected
+
+
+def test_request_partitions_parses_names_and_skips_others():
+    cur = RecordingCursor([
+        {"relname": "requests_p2025_10"},
+        {"relname": "requests_p2024_12"},
+        {"relname": "requests_legacy"},
+        {"relname": "requests_p2025_1"},
+    ])
+    assert Okservice.request_partitions(cur) == [
+        ("requests_p2024_12", date(2024, 12, 1), date(2025, 1, 1)),
+        ("requests_p2025_10", date(2025, 10, 1), date(2025, 11, 1)),
+    ]
+
+
+def test_drop_partition_scans_before_locking_parent():
+    # Полный проход по секции идёт под SHARE на секцию; requests блокируется только на DETACH и DROP
+    cur = RecordingCursor()
+    total = Okservice.drop_partition(cur, "requests_p2024_12", date(2024, 12, 1), date(2025, 1, 1))
+    assert total == 3
+    assert cur.statements[0] == "LOCK TABLE requests_p2024_12 IN SHARE MODE"
+    parent_lock = cur.statements.index("LOCK TABLE ONLY requests IN ACCESS EXCLUSIVE MODE")
+    scans = [i for i, sql in enumerate(cur.statements) if "FROM requests_p2024_12" in sql]
+    assert len(scans) == 2 and max(scans) < parent_lock
+    assert cur.statements[-2:] == [
+        "ALTER TABLE requests DETACH PARTITION requests_p2024_12",
+        "DROP TABLE requests_p2024_12",
+    ]
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+
+import pytest
+
+import Okservice
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        # Отметки ищутся только для этого запуска: прошлые остаются в таблице после рестарта
+        assert sql == Okservice.READINESS_SQL
+        assert params == (Okservice.BOOT_ID,)
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(Okservice, "readiness_cache", {
+        "checked_at": -100.0, "ready": False, "startup": dict.fromkeys(Okservice.STARTUP_TASKS, False),
+    })
+
+
+def database_with(monkeypatch, rows):
+    @contextmanager
+    def connection():
+        if rows is None:
+            raise Okservice.psycopg2.OperationalError("нет соединения")
+        yield FakeConnection(rows)
+
+    monkeypatch.setattr(Okservice, "get_db_connection", connection)
+
+
+def test_ready_when_another_process_prepared_the_database(monkeypatch):
+    # Под gunicorn подготовку выполняет процесс мастера: воркер видит её только по отметкам в БД
+    database_with(monkeypatch, [{"name": "db"}, {"name": "webhook"}])
+    response = Okservice.app.test_client().get("/readyz")
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "ready", "startup": {"db": True, "webhook": True}}
+
+
+def test_webhook_pending_does_not_block_readiness(monkeypatch):
+    database_with(monkeypatch, [{"name": "db"}])
+    response = Okservice.app.test_client().get("/readyz")
+    assert response.status_code == 200
+    assert response.get_json()["startup"] == {"db": True, "webhook": False}
+
+
+def test_not_ready_without_database(monkeypatch):
+    database_with(monkeypatch, None)
+    response = Okservice.app.test_client().get("/readyz")
+    assert response.status_code == 503
+    assert response.get_json() == {"status": "starting", "startup": {"db": False, "webhook": False}}
+
+
+class MarkingConnection:
+    def __init__(self):
+        self.params = []
+        self.committed = False
+
+    def cursor(self):
+        conn = self
+
+        class Cursor(FakeCursor):
+            def execute(self, sql, params=None):
+                conn.params.append(params)
+
+        return Cursor(None)
+
+    def commit(self):
+        self.committed = True
+
+
+def test_startup_mark_is_tagged_with_boot_id_and_committed(monkeypatch):
+    conn = MarkingConnection()
+    monkeypatch.setattr(Okservice, "get_db_connection", contextmanager(lambda: (yield conn)))
+    Okservice.mark_startup_done("db")
+    assert (Okservice.BOOT_ID, "db") in conn.params
+    assert conn.committed
@@ -0,0 +1,64 @@
+import pytest
+
+import Okservice
+
+
+def menu_route(text):
+    text = Okservice.normalize_route(text)
+    return Okservice.MENU_ROUTES.get(text) or Okservice.match_fallback(Okservice.MENU_FALLBACK, text)
+
+
+def admin_route(text):
+    text = Okservice.normalize_route(text)
+    return Okservice.ADMIN_ROUTES.get(text) or Okservice.match_fallback(Okservice.ADMIN_FALLBACK, text)
+
+
+@pytest.mark.parametrize("label, handler", [
+    (Okservice.BTN_ABOUT, Okservice.show_about),
+    (Okservice.BTN_PRICES, Okservice.show_prices),
+    (Okservice.BTN_PHOTOS, Okservice.show_photos),
+    (Okservice.BTN_ADDRESS, Okservice.show_address),
+    (Okservice.BTN_HOURS, Okservice.show_hours),
+    (Okservice.BTN_CONTACTS, Okservice.show_contacts),
+    (Okservice.BTN_MAP, Okservice.show_map),
+    (Okservice.BTN_REQUEST, Okservice.start_request_form),
+])
+def test_buttons_route_exactly(label, handler):
+    assert menu_route(label) is handler
+    assert menu_route("  " + label.upper() + " ") is handler
+
+
+@pytest.mark.parametrize("text, handler", [
+    # Текст подходит под несколько маршрутов: побеждает первый по порядку, как в прежней цепочке elif
+    ("ремонт телевизоров цены", Okservice.show_prices),
+    ("показать фото", Okservice.show_photos),
+    ("заявка на ремонт, какой адрес?", Okservice.show_address),
+    ("контакт для заявки", Okservice.show_contacts),
+    ("фото о сервисе", Okservice.show_about),
+    ("хочу оставить заявку", Okservice.start_request_form),
+])
+def test_menu_fallback_keeps_route_priority(text, handler):
+    assert menu_route(text) is handler
+
+
+def test_unknown_text_has_no_route():
+    assert menu_route("привет") is None
+
+
+@pytest.mark.parametrize("text, handler", [
+    ("найти все заявки", Okservice.show_all_requests),
+    ("найти статистику", Okservice.find_request_by_name),
+    ("экспорт csv", Okservice.export_to_excel),
+    ("очистить и в главное меню", Okservice.clear_database),
+    (Okservice.BTN_STATS, Okservice.show_stats),
+])
+def test_admin_fallback_keeps_route_priority(text, handler):
+    assert admin_route(text) is handler
+
+
+def test_build_fallback_prefers_list_order_over_text_position():
+    first, second = object(), object()
+    fallback = Okservice.build_fallback([("бета", first), ("альфа", second)])
+    assert Okservice.match_fallback(fallback, "альфа бета") is first
+    assert Okservice.match_fallback(fallback, "только альфа") is second
+    assert Okservice.match_fallback(fallback, "гамма") is None
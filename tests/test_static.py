@@ -0,0 +1,25 @@
+import Okservice
+
+
+def client():
+    return Okservice.app.test_client()
+
+
+def test_index_html_is_an_alias_of_home():
+    home = client().get("/")
+    legacy = client().get("/index.html")
+    assert home.status_code == 200
+    assert legacy.status_code == 200
+    assert legacy.data == home.data
+    assert legacy.headers["ETag"] == home.headers["ETag"]
+
+
+def test_home_revalidates_with_etag():
+    etag = client().get("/").headers["ETag"]
+    response = client().get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_files_outside_static_are_not_served():
+    assert client().get("/Okservice.py").status_code == 404
+    assert client().get("/requirements.txt").status_code == 404
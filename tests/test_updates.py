@@ -0,0 +1,81 @@
+import threading
+
+from telebot import types
+
+import Okservice
+
+
+def message_update(update_id, chat_id, text="привет"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Иван"},
+        },
+    }
+
+
+def callback_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": "1", "chat_instance": "1", "data": "pg:all:next:x",
+            "from": {"id": user_id, "is_bot": False, "first_name": "Иван"},
+        },
+    }
+
+
+def update(data):
+    return types.Update.de_json(data)
+
+
+def test_chat_key():
+    assert Okservice.UpdateDispatcher.chat_key(update(message_update(1, 42))) == 42
+    assert Okservice.UpdateDispatcher.chat_key(update(callback_update(2, 43))) == 43
+    assert Okservice.UpdateDispatcher.chat_key(update({"update_id": 3})) == 3
+
+
+def test_updates_of_one_chat_share_a_shard():
+    dispatcher = Okservice.UpdateDispatcher(4, 100, 0.01)
+    for i in range(10):
+        assert dispatcher.submit(update(message_update(i, 42)))
+    shard = dispatcher.queues[hash(42) % 4]
+    assert shard.qsize() == 10
+    assert [item[1].update_id for item in list(shard.queue)] == list(range(10))
+
+
+def test_updates_of_one_chat_are_processed_in_order(monkeypatch):
+    processed = []
+    done = threading.Event()
+
+    class FakeBot:
+        def process_new_updates(self, updates):
+            processed.extend(u.update_id for u in updates)
+            if len(processed) == 20:
+                done.set()
+
+    monkeypatch.setattr(Okservice, "bot", FakeBot())
+    dispatcher = Okservice.UpdateDispatcher(4, 100, 0.01)
+    dispatcher.start()
+    for i in range(20):
+        dispatcher.submit(update(message_update(i, 42)))
+    assert done.wait(5)
+    assert processed == list(range(20))
+
+
+def test_full_shard_rejects_update():
+    dispatcher = Okservice.UpdateDispatcher(1, 1, 0.01)
+    assert dispatcher.submit(update(message_update(1, 42)))
+    assert not dispatcher.submit(update(message_update(2, 42)))
+    assert dispatcher.stats()["rejected"] == 1
+
+
+def test_webhook_answers_503_when_queue_is_full(monkeypatch):
+    # 503 — Telegram повторит доставку позже, апдейт не теряется
+    dispatcher = Okservice.UpdateDispatcher(1, 1, 0.01)
+    monkeypatch.setattr(Okservice, "update_dispatcher", dispatcher)
+    client = Okservice.app.test_client()
+    assert client.post(f"/{Okservice.BOT_TOKEN}", json=message_update(1, 42)).status_code == 200
+    response = client.post(f"/{Okservice.BOT_TOKEN}", json=message_update(2, 42))
+    assert response.status_code == 503